@@ -0,0 +1,273 @@
+"""文件同步工具的基准测试
+
+生成合成目录树，分别测量扫描、哈希、忽略规则匹配、同步记录读写，以及 sync_all_files
+在模式 2（智能同步）和模式 4（完整同步）下同步到本地目标和进程内 SFTP 服务器的耗时，
+最后测量监控状态下修改单个文件到目标更新完成的延迟。结果保存为 JSON，可以与上一次的结果比较。
+
+用法:
+    python benchmarks/run_benchmarks.py --files 2000 --distribution mixed --output results.json
+    python benchmarks/run_benchmarks.py --compare results.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+from datetime import datetime
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from watchdog.observers import Observer
+from file_handler import FileHandler
+from sync_utils import should_ignore_file
+from tree_scanner import scan_tree
+from hash_service import HashService
+from sync_state import RACY_WINDOW_NS
+from tree_gen import generate_tree
+
+IGNORE_PATTERNS = ["__pycache__/*", "*.pyc", "*.tmp", "_sync_log.txt", "_sync_state.db*"]
+
+def make_config(work_dir, source_dir, targets, mode, **overrides):
+    """生成 FileHandler 使用的配置（不导入 config.py，避免启动同步）"""
+    config = {
+        'source_dir': source_dir,
+        'targets': targets,
+        'log_file': os.path.join(work_dir, '_sync_log.txt'),
+        'last_sync_file': os.path.join(work_dir, '_last_sync.json'),
+        'sync_state_file': os.path.join(work_dir, '_sync_state.db'),
+        'ignore_patterns': IGNORE_PATTERNS,
+        'only_sync_files': [],
+        'mode': mode,
+    }
+    config.update(overrides)
+    return config
+
+def timed(func, *args, **kwargs):
+    """执行 func 并返回 (耗时秒数, 返回值)"""
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+def quiet(func, *args, **kwargs):
+    """执行 func 时丢弃标准输出（同步过程会打印大量日志）"""
+    stdout = sys.stdout
+    with open(os.devnull, 'w', encoding='utf-8') as devnull:
+        sys.stdout = devnull
+        try:
+            return func(*args, **kwargs)
+        finally:
+            sys.stdout = stdout
+
+def bench_primitives(work_dir, source_dir, tree, results):
+    """扫描、哈希、忽略规则匹配、同步记录读写"""
+    seconds, entries = timed(lambda: list(scan_tree(source_dir)))
+    results['scan_tree'] = {'seconds': seconds, 'files': len(entries), 'files_per_s': len(entries) / seconds}
+
+    hasher = HashService()
+    seconds, (_, stats) = timed(hasher.hash_files, [entry.path for entry in entries])
+    hasher.close()
+    results['hash_files'] = {'seconds': seconds, 'bytes': stats['bytes'], 'mb_per_s': stats['mb_per_s']}
+
+    log_file = os.path.join(work_dir, '_sync_log.txt')
+    paths = [entry.path for entry in entries]
+    seconds, ignored = timed(lambda: sum(should_ignore_file(p, source_dir, IGNORE_PATTERNS, [], log_file) for p in paths))
+    results['should_ignore_file'] = {'seconds': seconds, 'calls': len(paths), 'calls_per_s': len(paths) / seconds,
+                                     'ignored': ignored}
+
+    state_dir = os.path.join(work_dir, 'state')
+    os.makedirs(state_dir)
+    handler = quiet(FileHandler, make_config(state_dir, source_dir, [os.path.join(state_dir, 'dst')], 2), 'bench')
+    try:
+        tracked = [entry.path for entry in entries if not handler.matcher.ignores(entry.path)]
+
+        def save_records():
+            # 按文件当前的修改时间保存记录
+            sample = [(p, os.stat(p)) for p in tracked]
+            with handler.state.batch():
+                return timed(lambda: [handler._save_sync_time(p, st=st) for p, st in sample])[0]
+
+        # 文件的修改时间设为现在：记录处于修改时间的模糊区间，检查时需要计算哈希
+        for p in tracked:
+            os.utime(p)
+        seconds = save_records()
+        results['save_sync_time'] = {'seconds': seconds, 'files': len(tracked), 'files_per_s': len(tracked) / seconds}
+        seconds, _ = timed(lambda: [handler._need_sync(p) for p in tracked])
+        results['need_sync_racy'] = {'seconds': seconds, 'files': len(tracked), 'files_per_s': len(tracked) / seconds}
+
+        # 修改时间提前到模糊区间之外后重新保存记录：签名一致即可跳过，不计算哈希
+        backdated = time.time() - RACY_WINDOW_NS / 1e9 - 60
+        for p in tracked:
+            os.utime(p, (backdated, backdated))
+        save_records()
+        seconds, _ = timed(lambda: [handler._need_sync(p) for p in tracked])
+        results['need_sync_fast_path'] = {'seconds': seconds, 'files': len(tracked), 'files_per_s': len(tracked) / seconds}
+    finally:
+        handler.close()
+
+def bench_sync(work_dir, source_dir, name, targets, results, tree):
+    """模式 2 和模式 4 的初始同步（首次运行和没有变化时再次运行）"""
+    for mode, check_time, overrides in ((2, True, {}), (4, False, {}), (4, False, {'differential_full_sync': False})):
+        label = f"{name}_mode{mode}" + ('_plain' if overrides else '')
+        run_dir = os.path.join(work_dir, label)
+        os.makedirs(run_dir)
+        resolved = [target(run_dir) for target in targets]
+        handler = quiet(FileHandler, make_config(run_dir, source_dir, resolved, mode, **overrides), 'bench')
+        try:
+            cold, _ = timed(quiet, handler.sync_all_files, check_time)
+            warm, _ = timed(quiet, handler.sync_all_files, check_time)
+        finally:
+            handler.close()
+        results[label] = {'cold_seconds': cold, 'warm_seconds': warm, 'files': tree['files'],
+                          'cold_mb_per_s': tree['bytes'] / 1024 / 1024 / cold}
+
+def bench_edit_latency(work_dir, source_dir, name, targets, results, repeat, debounce):
+    """监控状态下修改单个文件，到目标文件内容更新为止的延迟"""
+    run_dir = os.path.join(work_dir, f"{name}_latency")
+    os.makedirs(run_dir)
+    resolved = [target(run_dir) for target in targets]
+    handler = quiet(FileHandler, make_config(run_dir, source_dir, resolved, 3, debounce_seconds=debounce), 'bench')
+    observer = Observer()
+    try:
+        quiet(handler.sync_all_files, True)
+        handler.start()
+        observer.schedule(handler, source_dir, recursive=True)
+        observer.start()
+        relative_path = 'latency_probe.txt'
+        dest_paths = [os.path.join(t[2] if isinstance(t, tuple) else t, relative_path) for t in resolved]
+        samples = []
+        for i in range(repeat):
+            content = f"edit {i} {time.time()}\n".encode()
+            start = time.perf_counter()
+            with open(os.path.join(source_dir, relative_path), 'wb') as f:
+                f.write(content)
+            deadline = start + 30
+            while time.perf_counter() < deadline:
+                if all(os.path.exists(p) and open(p, 'rb').read() == content for p in dest_paths):
+                    break
+                time.sleep(0.002)
+            samples.append(time.perf_counter() - start)
+            time.sleep(0.05)
+        os.remove(os.path.join(source_dir, relative_path))
+    finally:
+        observer.stop()
+        observer.join()
+        quiet(handler.close)
+    samples.sort()
+    results[f"{name}_edit_latency"] = {
+        'debounce_seconds': debounce,
+        'samples': len(samples),
+        'median_seconds': statistics.median(samples),
+        'p95_seconds': samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+        'min_seconds': samples[0],
+    }
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, capture_output=True,
+                              text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+def compare(previous, current):
+    """打印与上一次结果相比变化超过 10% 的指标"""
+    print("\n与上一次结果比较（变化超过 10%）:")
+    old_params = previous.get('meta', {}).get('params', {})
+    new_params = current['meta']['params']
+    for key in ('files', 'distribution', 'depth', 'seed'):
+        if old_params.get(key) != new_params.get(key):
+            print(f"  注意: 参数 {key} 不同 ({old_params.get(key)} -> {new_params.get(key)})，结果不能直接比较")
+    for name, metrics in current['results'].items():
+        old = previous.get('results', {}).get(name)
+        if not old:
+            continue
+        for key, value in metrics.items():
+            old_value = old.get(key)
+            if not isinstance(value, (int, float)) or not isinstance(old_value, (int, float)) or not old_value:
+                continue
+            if not (key.endswith('seconds') or key.endswith('_per_s')):
+                continue
+            change = (value - old_value) / old_value
+            if abs(change) >= 0.1:
+                # 耗时增加或吞吐量下降都是变慢
+                slower = change > 0 if key.endswith('seconds') else change < 0
+                print(f"  {name}.{key}: {old_value:.4g} -> {value:.4g} ({change:+.0%}{'，变慢' if slower else ''})")
+
+def main():
+    parser = argparse.ArgumentParser(description="文件同步工具基准测试")
+    parser.add_argument('--files', type=int, default=2000, help="需要同步的文件数")
+    parser.add_argument('--distribution', default='small', choices=['small', 'mixed', 'large'], help="文件大小分布")
+    parser.add_argument('--depth', type=int, default=3, help="目录深度")
+    parser.add_argument('--seed', type=int, default=0, help="随机种子")
+    parser.add_argument('--repeat', type=int, default=20, help="单文件修改延迟的测量次数")
+    parser.add_argument('--debounce', type=float, default=0.2, help="测量修改延迟时的防抖时间（秒）")
+    parser.add_argument('--skip-sftp', action='store_true', help="不测试 SFTP 目标")
+    parser.add_argument('--work-dir', help="工作目录，默认使用临时目录并在结束后删除")
+    parser.add_argument('--output', default='benchmark_results.json', help="结果文件")
+    parser.add_argument('--compare', help="与之前的结果文件比较")
+    args = parser.parse_args()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='fsync-bench-')
+    os.makedirs(work_dir, exist_ok=True)
+    source_dir = os.path.join(work_dir, 'src')
+    results = {}
+    server = None
+    try:
+        print(f"生成目录树: {args.files} 个文件, 分布 {args.distribution}, 深度 {args.depth}")
+        seconds, tree = timed(generate_tree, source_dir, args.files, args.distribution, args.depth, seed=args.seed)
+        print(f"  {tree['bytes'] / 1024 / 1024:.1f} MB, {seconds:.1f} 秒")
+
+        print("测试扫描、哈希、忽略规则和同步记录...")
+        bench_primitives(work_dir, source_dir, tree, results)
+
+        print("测试本地目标同步...")
+        local_targets = [lambda run_dir: os.path.join(run_dir, 'dst')]
+        bench_sync(work_dir, source_dir, 'local', local_targets, results, tree)
+        bench_edit_latency(work_dir, source_dir, 'local', local_targets, results, args.repeat, args.debounce)
+
+        if not args.skip_sftp:
+            from sftp_server import LocalSFTPServer
+            server = LocalSFTPServer().start()
+            sftp_targets = [lambda run_dir: server.target(os.path.join(run_dir, 'remote'))]
+            print(f"测试 SFTP 目标同步 (127.0.0.1:{server.port})...")
+            bench_sync(work_dir, source_dir, 'sftp', sftp_targets, results, tree)
+            bench_edit_latency(work_dir, source_dir, 'sftp', sftp_targets, results, args.repeat, args.debounce)
+    finally:
+        if server is not None:
+            server.close()
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    output = {
+        'meta': {
+            'time': datetime.now().isoformat(),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'params': vars(args),
+            'tree': tree,
+        },
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(output, f, indent=2, ensure_ascii=False)
+
+    for name, metrics in results.items():
+        summary = ', '.join(f"{key}={value:.4g}" if isinstance(value, float) else f"{key}={value}"
+                            for key, value in metrics.items())
+        print(f"{name}: {summary}")
+    print(f"结果已保存: {os.path.abspath(args.output)}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            compare(json.load(f), output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,237 @@
+"""进程内的 paramiko SSH/SFTP 服务器，作为基准测试中的远程目标
+
+只监听 127.0.0.1，使用固定的用户名和密码，SFTP 直接访问本机文件系统，
+exec 请求通过 sh -c 在本机执行（支持 mkdir、tar、python3 辅助脚本等远程命令）。
+"""
+import os
+import socket
+import subprocess
+import threading
+import paramiko
+from paramiko import SFTPAttributes, SFTPHandle, SFTPServer, SFTPServerInterface, SFTP_OK
+from paramiko.sftp import SFTP_NO_SUCH_FILE, SFTP_PERMISSION_DENIED, SFTP_FAILURE
+
+USERNAME = 'bench'
+PASSWORD = 'bench'
+
+def _convert_error(e):
+    if isinstance(e, FileNotFoundError):
+        return SFTP_NO_SUCH_FILE
+    if isinstance(e, PermissionError):
+        return SFTP_PERMISSION_DENIED
+    return SFTP_FAILURE
+
+class _Handle(SFTPHandle):
+    def stat(self):
+        try:
+            return SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+        except OSError as e:
+            return _convert_error(e)
+
+    def chattr(self, attr):
+        try:
+            _apply_attr(self.filename, attr)
+            return SFTP_OK
+        except OSError as e:
+            return _convert_error(e)
+
+def _apply_attr(path, attr):
+    if attr._flags & attr.FLAG_PERMISSIONS:
+        os.chmod(path, attr.st_mode & 0o7777)
+    if attr._flags & attr.FLAG_AMTIME:
+        os.utime(path, (attr.st_atime, attr.st_mtime))
+    if attr._flags & attr.FLAG_SIZE:
+        with open(path, 'r+b') as f:
+            f.truncate(attr.st_size)
+
+class _LocalSFTP(SFTPServerInterface):
+    """直接映射到本机文件系统的 SFTP 实现（路径按绝对路径处理）"""
+
+    def canonicalize(self, path):
+        return os.path.normpath(path if os.path.isabs(path) else os.path.join('/', path))
+
+    def list_folder(self, path):
+        try:
+            result = []
+            for name in os.listdir(path):
+                attr = SFTPAttributes.from_stat(os.lstat(os.path.join(path, name)))
+                attr.filename = name
+                result.append(attr)
+            return result
+        except OSError as e:
+            return _convert_error(e)
+
+    def stat(self, path):
+        try:
+            return SFTPAttributes.from_stat(os.stat(path))
+        except OSError as e:
+            return _convert_error(e)
+
+    def lstat(self, path):
+        try:
+            return SFTPAttributes.from_stat(os.lstat(path))
+        except OSError as e:
+            return _convert_error(e)
+
+    def open(self, path, flags, attr):
+        try:
+            binary = getattr(os, 'O_BINARY', 0)
+            mode = attr.st_mode if attr is not None and attr.st_mode is not None else 0o666
+            fd = os.open(path, flags | binary, mode)
+        except OSError as e:
+            return _convert_error(e)
+        if flags & os.O_WRONLY:
+            fmode = 'ab' if flags & os.O_APPEND else 'wb'
+        elif flags & os.O_RDWR:
+            fmode = 'a+b' if flags & os.O_APPEND else 'r+b'
+        else:
+            fmode = 'rb'
+        f = os.fdopen(fd, fmode)
+        handle = _Handle(flags)
+        handle.filename = path
+        handle.readfile = f
+        handle.writefile = f
+        return handle
+
+    def remove(self, path):
+        try:
+            os.remove(path)
+            return SFTP_OK
+        except OSError as e:
+            return _convert_error(e)
+
+    def rename(self, oldpath, newpath):
+        try:
+            os.replace(oldpath, newpath)
+            return SFTP_OK
+        except OSError as e:
+            return _convert_error(e)
+
+    posix_rename = rename
+
+    def mkdir(self, path, attr):
+        try:
+            os.mkdir(path)
+            return SFTP_OK
+        except OSError as e:
+            return _convert_error(e)
+
+    def rmdir(self, path):
+        try:
+            os.rmdir(path)
+            return SFTP_OK
+        except OSError as e:
+            return _convert_error(e)
+
+    def chattr(self, path, attr):
+        try:
+            _apply_attr(path, attr)
+            return SFTP_OK
+        except OSError as e:
+            return _convert_error(e)
+
+class _Server(paramiko.ServerInterface):
+    def check_channel_request(self, kind, chanid):
+        if kind == 'session':
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_auth_password(self, username, password):
+        if username == USERNAME and password == PASSWORD:
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_channel_exec_request(self, channel, command):
+        threading.Thread(target=_run_exec, args=(channel, command.decode()), daemon=True).start()
+        return True
+
+def _run_exec(channel, command):
+    """在本机执行 exec 请求，并在通道和子进程之间转发数据"""
+    process = subprocess.Popen(['sh', '-c', command], stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def pump_stdin():
+        try:
+            while True:
+                data = channel.recv(1024 * 1024)
+                if not data:
+                    break
+                process.stdin.write(data)
+        except (OSError, EOFError):
+            pass
+        finally:
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+
+    def pump_stderr():
+        for chunk in iter(lambda: process.stderr.read1(65536), b""):
+            channel.sendall_stderr(chunk)
+
+    threads = [threading.Thread(target=pump_stdin, daemon=True), threading.Thread(target=pump_stderr, daemon=True)]
+    for thread in threads:
+        thread.start()
+    for chunk in iter(lambda: process.stdout.read1(65536), b""):
+        channel.sendall(chunk)
+    exit_code = process.wait()
+    threads[1].join()
+    channel.send_exit_status(exit_code)
+    channel.close()
+
+class LocalSFTPServer:
+    """在后台线程中运行的 SSH/SFTP 服务器
+
+    用法:
+        with LocalSFTPServer() as server:
+            target = ('bench', '127.0.0.1', '/tmp/dst', 'bench', server.port)
+    """
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.host_key = paramiko.RSAKey.generate(2048)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, port))
+        self.sock.listen(16)
+        self.host, self.port = self.sock.getsockname()
+        self._transports = []
+        self._closed = False
+        self._thread = threading.Thread(target=self._accept_loop, name="bench-sftp", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _accept_loop(self):
+        while not self._closed:
+            try:
+                client, _ = self.sock.accept()
+            except OSError:
+                return
+            transport = paramiko.Transport(client)
+            transport.add_server_key(self.host_key)
+            transport.set_subsystem_handler('sftp', SFTPServer, _LocalSFTP)
+            try:
+                transport.start_server(server=_Server())
+            except paramiko.SSHException:
+                continue
+            self._transports.append(transport)
+
+    def target(self, remote_path):
+        """生成指向该服务器的目标元组"""
+        return (USERNAME, self.host, remote_path, PASSWORD, self.port)
+
+    def close(self):
+        self._closed = True
+        self.sock.close()
+        for transport in self._transports:
+            transport.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,83 @@
+"""生成用于基准测试的合成目录树
+
+同一组参数和随机种子总是生成相同的目录结构和文件内容，便于多次运行之间比较。
+"""
+import os
+import random
+
+# 文件大小分布：[(概率, 最小字节数, 最大字节数), ...]
+SIZE_DISTRIBUTIONS = {
+    'small': [(1.0, 100, 4 * 1024)],
+    'mixed': [(0.90, 100, 16 * 1024), (0.09, 64 * 1024, 1024 * 1024), (0.01, 1024 * 1024, 16 * 1024 * 1024)],
+    'large': [(0.5, 1024 * 1024, 8 * 1024 * 1024), (0.5, 8 * 1024 * 1024, 64 * 1024 * 1024)],
+}
+
+# 文本文件的扩展名（内容可压缩），其余为随机二进制内容
+TEXT_EXTENSIONS = ['.py', '.txt', '.csv', '.json', '.md']
+BINARY_EXTENSIONS = ['.bin', '.dat']
+TEXT_LINE = b'id,name,value,description of the row with some repeated text\n'
+
+def _pick_size(rng, distribution):
+    roll = rng.random()
+    cumulative = 0.0
+    for probability, low, high in distribution:
+        cumulative += probability
+        if roll <= cumulative:
+            return rng.randint(low, high)
+    _, low, high = distribution[-1]
+    return rng.randint(low, high)
+
+def _content(rng, size, text):
+    if text:
+        repeated = TEXT_LINE * (size // len(TEXT_LINE) + 1)
+        return repeated[:size]
+    return rng.randbytes(size) if hasattr(rng, 'randbytes') else bytes(rng.getrandbits(8) for _ in range(size))
+
+def generate_tree(root, file_count=1000, distribution='small', depth=3, fanout=4, seed=0,
+                  shell_ratio=0.02, ignored_ratio=0.05):
+    """生成合成目录树
+
+    Args:
+        root: 根目录（不存在时创建）
+        file_count: 需要同步的文件数
+        distribution: 文件大小分布名称（SIZE_DISTRIBUTIONS 的键）
+        depth: 目录的最大深度
+        fanout: 每层的子目录数
+        seed: 随机种子
+        shell_ratio: 使用 CRLF 行尾的 .sh 脚本所占比例（测试行尾转换）
+        ignored_ratio: 额外生成的被忽略文件（__pycache__/*.pyc）相对 file_count 的比例
+
+    Returns:
+        dict: {'files': 文件数, 'bytes': 总字节数, 'ignored': 被忽略的文件数}
+    """
+    rng = random.Random(seed)
+    sizes = SIZE_DISTRIBUTIONS[distribution]
+    directories = ['']
+    frontier = ['']
+    for level in range(depth):
+        frontier = [os.path.join(parent, f"d{level}_{i}") for parent in frontier for i in range(fanout)]
+        directories += frontier
+    total_bytes = 0
+    for index in range(file_count):
+        directory = rng.choice(directories)
+        if rng.random() < shell_ratio:
+            name = f"script_{index}.sh"
+            data = b'#!/bin/sh\r\n' + b'echo line\r\n' * rng.randint(1, 200)
+        else:
+            text = rng.random() < 0.7
+            ext = rng.choice(TEXT_EXTENSIONS if text else BINARY_EXTENSIONS)
+            name = f"file_{index}{ext}"
+            data = _content(rng, _pick_size(rng, sizes), text)
+        path = os.path.join(root, directory, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        total_bytes += len(data)
+
+    ignored = int(file_count * ignored_ratio)
+    for index in range(ignored):
+        path = os.path.join(root, rng.choice(directories), '__pycache__', f"cached_{index}.pyc")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'\x00' * 256)
+    return {'files': file_count, 'bytes': total_bytes, 'ignored': ignored}
@@ -0,0 +1,90 @@
+import os
+import io
+import shlex
+import gzip
+import tarfile
+import threading
+from line_ending_handler import read_converted
+from compression import CountingWriter
+
+# 单个文件超过该大小时不放入批量归档，仍按单个文件上传（可以使用增量传输）
+MAX_BULK_FILE_SIZE = 4 * 1024 * 1024
+
+def archive_name(relative_path):
+    """归档中统一使用 / 分隔的相对路径"""
+    return relative_path.replace(os.sep, '/')
+
+def write_archive(out, files):
+    """把文件写成流式 tar 归档，shell 脚本在写入时转换行尾
+
+    Args:
+        out: 可写的二进制文件对象
+        files: (源文件路径, 相对路径) 列表
+
+    Returns:
+        tuple: (成功写入的源文件路径列表, 写入的文件内容字节数)
+    """
+    packed = []
+    total = 0
+    with tarfile.open(fileobj=out, mode='w|') as tar:
+        for src_path, relative_path in files:
+            try:
+                # 先获取 stat 再读取内容，读取期间被修改的文件下次检查时会重新同步
+                st = os.stat(src_path)
+                content, _ = read_converted(src_path, target_os='linux')
+            except OSError as e:
+                print(f"读取文件失败，跳过批量传输: {e}, 文件: {src_path}")
+                continue
+            info = tarfile.TarInfo(archive_name(relative_path))
+            info.size = len(content)
+            info.mtime = st.st_mtime
+            info.mode = st.st_mode & 0o7777
+            tar.addfile(info, io.BytesIO(content))
+            packed.append(src_path)
+            total += len(content)
+    return packed, total
+
+def bulk_upload(session, remote_root, files, compress=False):
+    """把多个文件打包为一个 tar 流，通过一次远程命令上传并解包
+
+    归档边生成边发送，不在本地落盘；远程使用 tar 解包，保留文件的修改时间和权限。
+
+    Args:
+        session: 会话对象（ParamikoSession / OpenSSHSession / LocalShellSession）
+        remote_root: 远程目标目录
+        files: (源文件路径, 相对路径) 列表
+        compress: 是否用 gzip 压缩归档（远程 tar -xz 解包）
+
+    Returns:
+        dict: {'packed': 已上传的源文件路径列表, 'bytes': 文件内容字节数, 'sent_bytes': 实际发送的字节数}
+    """
+    command = f"mkdir -p {shlex.quote(remote_root)} && tar -x{'z' if compress else ''}f - -C {shlex.quote(remote_root)}"
+    read_fd, write_fd = os.pipe()
+    result = {}
+
+    def produce():
+        try:
+            with os.fdopen(write_fd, 'wb') as raw:
+                counter = CountingWriter(raw)
+                if compress:
+                    with gzip.GzipFile(fileobj=counter, mode='wb', compresslevel=6, mtime=0) as out:
+                        result['packed'], result['bytes'] = write_archive(out, files)
+                else:
+                    result['packed'], result['bytes'] = write_archive(counter, files)
+                result['sent_bytes'] = counter.count
+        except Exception as e:
+            # 远程提前退出时管道会断开，错误以远程命令的结果为准
+            result['error'] = e
+
+    producer = threading.Thread(target=produce, name="bulk-archive", daemon=True)
+    producer.start()
+    try:
+        with os.fdopen(read_fd, 'rb') as stream:
+            exit_code, _, err = session.run(command, stdin=stream)
+    finally:
+        producer.join()
+    if exit_code != 0:
+        raise Exception(f"远程批量解包失败 (退出码: {exit_code}): {err.strip()}")
+    if 'error' in result:
+        raise Exception(f"生成批量归档失败: {result['error']}")
+    return result
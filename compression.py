@@ -0,0 +1,146 @@
+import os
+import zlib
+import gzip
+import lzma
+import shlex
+import threading
+
+# 已经压缩过的格式，再压缩几乎没有收益
+COMPRESSED_EXTENSIONS = {
+    '.gz', '.tgz', '.bz2', '.xz', '.txz', '.lz4', '.zst', '.zip', '.7z', '.rar', '.jar', '.whl', '.apk',
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic', '.mp3', '.aac', '.ogg', '.flac', '.m4a',
+    '.mp4', '.mkv', '.mov', '.avi', '.webm', '.pdf', '.docx', '.xlsx', '.pptx', '.odt', '.woff', '.woff2',
+}
+# 文本格式，压缩率通常很高
+TEXT_EXTENSIONS = {
+    '.txt', '.md', '.rst', '.csv', '.tsv', '.json', '.xml', '.html', '.htm', '.css', '.js', '.ts',
+    '.py', '.java', '.c', '.h', '.cpp', '.go', '.rs', '.sh', '.sql', '.yaml', '.yml', '.toml',
+    '.ini', '.conf', '.cfg', '.log', '.svg',
+}
+# 小于该大小的文件不压缩（压缩节省的时间抵不上额外的往返）
+MIN_COMPRESS_SIZE = 4 * 1024
+# 压缩率采样的大小
+SAMPLE_SIZE = 64 * 1024
+# 采样压缩后大小超过原大小的该比例时不压缩
+MAX_SAMPLE_RATIO = 0.9
+# 超过该大小且压缩率很高的文本文件使用 xz
+XZ_MIN_SIZE = 1024 * 1024
+
+# 在远程执行的解压脚本：从标准输入读取压缩数据，解压到同目录的临时文件，
+# 设置权限和修改时间后原子替换目标文件，输出解压后的字节数
+DECOMPRESS_HELPER = r'''
+import sys, os, gzip, lzma, tempfile
+codec, path, mode, mtime = sys.argv[1], sys.argv[2], int(sys.argv[3], 8), float(sys.argv[4])
+opener = {"gzip": lambda f: gzip.GzipFile(fileobj=f, mode="rb"), "xz": lambda f: lzma.LZMAFile(f, mode="rb")}[codec]
+directory = os.path.dirname(path) or "."
+os.makedirs(directory, exist_ok=True)
+fd, tmp = tempfile.mkstemp(dir=directory, prefix="." + os.path.basename(path) + ".")
+total = 0
+try:
+    with opener(sys.stdin.buffer) as src, os.fdopen(fd, "wb") as out:
+        for chunk in iter(lambda: src.read(1048576), b""):
+            out.write(chunk)
+            total += len(chunk)
+    os.chmod(tmp, mode)
+    os.utime(tmp, (mtime, mtime))
+    os.replace(tmp, path)
+except BaseException:
+    os.unlink(tmp)
+    raise
+print(total)
+'''
+
+def choose_codec(file_path, size=None):
+    """根据扩展名和采样的压缩率选择压缩算法和级别
+
+    Args:
+        file_path: 文件路径
+        size: 文件大小，为 None 时重新获取
+
+    Returns:
+        tuple | None: (算法, 级别)，不值得压缩时返回 None
+    """
+    ext = os.path.splitext(file_path)[1].lower()
+    if ext in COMPRESSED_EXTENSIONS:
+        return None
+    if size is None:
+        size = os.path.getsize(file_path)
+    if size < MIN_COMPRESS_SIZE:
+        return None
+    with open(file_path, 'rb') as f:
+        sample = f.read(SAMPLE_SIZE)
+    ratio = len(zlib.compress(sample, 1)) / len(sample)
+    if ratio > MAX_SAMPLE_RATIO:
+        return None
+    if ext in TEXT_EXTENSIONS or ratio < 0.5:
+        # 高度可压缩的大文件用 xz 换取更少的传输量，其余用 gzip
+        if size >= XZ_MIN_SIZE and ratio < 0.3:
+            return 'xz', 3
+        return 'gzip', 6
+    return 'gzip', 1
+
+def _open_compressor(out, codec, level):
+    if codec == 'xz':
+        return lzma.LZMAFile(out, mode='wb', preset=level)
+    return gzip.GzipFile(fileobj=out, mode='wb', compresslevel=level, mtime=0)
+
+class CountingWriter:
+    """统计写入字节数的文件包装"""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.count = 0
+
+    def write(self, data):
+        self.count += len(data)
+        return self.raw.write(data)
+
+    def flush(self):
+        self.raw.flush()
+
+def compressed_upload(session, local_path, remote_path, codec, level, mode=None):
+    """边压缩边上传文件，远程用 python3 解压后原子替换
+
+    Args:
+        session: 会话对象
+        local_path: 本地文件路径（已完成行尾转换）
+        remote_path: 远程文件路径
+        codec: 'gzip' 或 'xz'
+        level: 压缩级别
+        mode: 远程文件的权限，为 None 时使用本地文件的权限
+
+    Returns:
+        dict: {'codec': ..., 'level': ..., 'size': 原始字节数, 'sent_bytes': 实际发送的字节数}
+    """
+    st = os.stat(local_path)
+    mode = st.st_mode if mode is None else mode
+    command = (f"python3 -c {shlex.quote(DECOMPRESS_HELPER)} {codec} {shlex.quote(remote_path)} "
+               f"{mode & 0o7777:o} {st.st_mtime!r}")
+    read_fd, write_fd = os.pipe()
+    result = {}
+
+    def produce():
+        try:
+            with os.fdopen(write_fd, 'wb') as raw:
+                counter = CountingWriter(raw)
+                with open(local_path, 'rb') as src, _open_compressor(counter, codec, level) as out:
+                    for chunk in iter(lambda: src.read(1024 * 1024), b""):
+                        out.write(chunk)
+                result['sent_bytes'] = counter.count
+        except Exception as e:
+            result['error'] = e
+
+    producer = threading.Thread(target=produce, name="compress", daemon=True)
+    producer.start()
+    try:
+        with os.fdopen(read_fd, 'rb') as stream:
+            exit_code, out, err = session.run(command, stdin=stream)
+    finally:
+        producer.join()
+    if exit_code != 0:
+        raise Exception(f"远程解压失败 (退出码: {exit_code}): {err.strip()}")
+    if 'error' in result:
+        raise Exception(f"压缩文件失败: {result['error']}")
+    if int(out.strip() or -1) != st.st_size:
+        raise Exception(f"远程解压后大小不一致: {remote_path}")
+    return {'codec': codec, 'level': level, 'size': st.st_size, 'sent_bytes': result['sent_bytes']}
@@ -19,13 +19,50 @@ default_config = {
     'source_dir': '', # 源目录
     'targets': [], # 目标目录
     'log_file': os.path.join(APP_DATA_DIR, '_sync_log.txt'), # 同步日志文件
-    'last_sync_file': os.path.join(SCRIPT_DIR, '_last_sync.json'), # 上次同步时间记录文件
+    'last_sync_file': os.path.join(SCRIPT_DIR, '_last_sync.json'), # 旧格式的同步时间记录文件（首次运行时自动导入）
+    'sync_state_file': os.path.join(SCRIPT_DIR, '_sync_state.db'), # 同步记录数据库
+    'state_backend': 'sqlite', # 同步记录存储: 'sqlite' 或 'json'（旧格式）
     'ignore_patterns': [
         "__pycache__/*","*.pyc","*.tmp", # 缓存文件
-        "_file_sync*/*","_sync_log.txt","_last_sync.json","*.log", # 同步日志相关文件
+        "_file_sync*/*","_sync_log.txt","_last_sync.json","_sync_state.db*","*.log", # 同步日志相关文件
         ".git/*",".gitignore", # git 相关
     ],
     'only_sync_files': [],    # 仅同步指定文件列表（如果为空则使用 IGNORE_PATTERNS）
+    'log_level': 'INFO',  # 日志级别: 'DEBUG'（包含无需同步时的判断详情和防抖合并记录）, 'INFO', 'WARNING', 'ERROR'
+    'log_flush_interval': 1.0,  # 日志在内存中缓冲，每隔多少秒写入文件一次（错误日志立即写入）
+    'log_buffer_size': 10000,  # 日志缓冲区最多保存的消息数，写入不及时时丢弃最旧的消息
+    'log_max_bytes': 10 * 1024 * 1024,  # 日志文件超过该大小时轮转（_sync_log.txt.1、.2 ...），0 表示不轮转
+    'log_backup_count': 3,  # 轮转时保留的旧日志文件数
+    'metrics_port': None,  # 在 http://127.0.0.1:端口/metrics 输出 Prometheus 格式的运行指标（/stats.json 为 JSON），None 表示不启动
+    'metrics_file': None,  # 定期写入运行指标的 JSON 文件路径，None 表示不写入
+    'metrics_interval': 10,  # 写入指标文件的间隔（秒）
+    'hash_algorithm': 'blake2b',  # 文件哈希算法（已有的MD5记录仍按MD5校验）
+    'startup_concurrency': 4,  # 同时进行初始同步的配置数（每个配置同步完成后立即开始监控）
+    'io_concurrency': 8,  # 所有配置共用的 I/O 名额：同时计算哈希或传输的文件总数，0 表示不限制
+    'scan_workers': 4,  # 扫描目录树时并行读取子目录的线程数
+    'hash_workers': None,  # 并行计算哈希的线程数，None 表示按CPU数量自动决定
+    'debounce_seconds': 1,  # 防抖时间（秒）：文件最后一次变更之后等待多久再同步
+    'event_workers': 2,  # 处理文件事件的工作线程数
+    'delete_batch_size': 1000,  # 每批最多合并处理的删除事件数（每个远程目标一次命令）
+    'target_concurrency': 2,  # 每个目标同时进行的传输数
+    'target_queue_size': 64,  # 每个目标排队等待的最大任务数
+    'target_timeout': 900,  # 单个文件在每个目标上传输的最长时间（秒，从开始执行时算起，排队等待另外最多同样长），超时的目标记为失败，下次重新检查；None 表示不限制
+    'delta_threshold': 8 * 1024 * 1024,  # 超过该大小的文件更新远程时只传输变化的分块（需要远程有 python3），0 表示关闭
+    'remote_compression': None,  # 远程传输压缩: None 不压缩, 'ssh' 使用SSH传输层压缩, 'auto' 按文件类型选择 gzip/xz 边压缩边传输（需要远程有 python3）；也可以在目标元组的第六个元素中单独设置，如 {'compression': 'auto'}
+    'resumable_threshold': 64 * 1024 * 1024,  # 超过该大小的文件分块上传到远程临时文件，中断后从已完成的分块续传（需要远程有 python3），0 表示关闭
+    'resumable_chunk_size': 8 * 1024 * 1024,  # 分块上传的分块大小
+    'resumable_parallel': 1,  # 分块上传时并行发送的分块数（密码登录的目标使用多个 SFTP 通道）
+    'differential_full_sync': True,  # 全量同步（模式 4）时先获取目标上的文件清单，只传输不一致的文件（远程需要 python3）
+    'verify_targets': False,  # 模式 2/3 启动时也按目标清单校验，适用于目标被恢复或新增目标的情况
+    'delete_orphans': False,  # 按清单同步时删除目标上源目录中已不存在的文件
+    'dir_index': True,  # 模式 2/3 启动时按持久化的目录索引跳过文件签名未变化的文件，不再逐个查询同步记录
+    'dir_index_trust_mtime': False,  # 目录修改时间未变化时不读取目录内容（原地修改文件不会改变目录修改时间，只适合文件总是整体替换的目录）
+    'bulk_threshold': 200,  # 初始同步需要传输的文件数达到该值时，远程目标打包成一个 tar 流传输（需要远程有 tar），0 表示关闭
+    'bulk_max_file_size': 4 * 1024 * 1024,  # 超过该大小的文件不放入批量归档，仍单独上传
+    'ssh_idle_timeout': 300,  # SSH连接池中空闲连接的超时时间（秒）
+    'ssh_keepalive_interval': 30,  # SSH keepalive 间隔（秒），0 表示不发送
+    'ssh_multiplex': True,  # 无密码目标是否复用 OpenSSH 主连接（ControlMaster）
+    'baseline_reuse': True,  # 模式 11 更新同步时间时，沿用文件签名未变的已有记录，不重新计算哈希
     # mode: 0=不处理, 1=预览, 2=一次性智能同步, 3=智能同步并监控, 4=完整同步并监控, 11=预览并更新同步时间
     'mode': 3
 }
@@ -0,0 +1,279 @@
+import os
+import shlex
+import struct
+import hashlib
+import tempfile
+from itertools import accumulate
+
+# 滚动校验和的模数
+MOD = 65536
+# 分块大小的上下限
+MIN_BLOCK_SIZE = 4 * 1024
+MAX_BLOCK_SIZE = 1024 * 1024
+# 单个字面数据块的最大长度
+MAX_LITERAL = 1024 * 1024
+# 字面数据超过文件大小的该比例时放弃增量传输，直接整体上传
+MAX_LITERAL_RATIO = 0.5
+# 文件开头这么多个分块（至少 PROBE_BYTES 字节）内没有任何分块匹配时放弃增量传输：
+# 滚动校验和在 Python 中逐字节计算，被整体改写的文件扫描到底再放弃会比直接上传慢得多
+PROBE_BLOCKS = 32
+PROBE_BYTES = 256 * 1024
+# 本地文件整体读入内存后比较（不使用 mmap：文件被截断时访问 mmap 会使进程收到 SIGBUS），
+# 超过该大小的文件直接整体上传
+MAX_DELTA_SIZE = 256 * 1024 * 1024
+
+# 在远程（或本地目标）上执行的辅助脚本：
+#   sig <路径> <分块大小>   输出每个分块的 "弱校验和 长度 MD5"，文件不存在时退出码为 3
+#   patch <路径> <分块大小> [修改时间] 从标准输入读取增量指令，重建文件后原子替换，输出 "MD5 大小"
+REMOTE_HELPER = r'''
+import sys, os, stat, struct, hashlib, tempfile
+from itertools import accumulate
+
+def read_exact(f, n):
+    data = b""
+    while len(data) < n:
+        chunk = f.read(n - len(data))
+        if not chunk:
+            raise EOFError("delta stream truncated")
+        data += chunk
+    return data
+
+def sig(path, bs, *args):
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        sys.exit(3)
+    out = sys.stdout
+    with f:
+        while True:
+            block = f.read(bs)
+            if not block:
+                break
+            a = sum(block) % 65536
+            b = sum(accumulate(block)) % 65536
+            out.write("%d %d %s\n" % (a | (b << 16), len(block), hashlib.md5(block).hexdigest()))
+
+def patch(path, bs, mtime=None):
+    inp = sys.stdin.buffer
+    h = hashlib.md5()
+    total = 0
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix="." + os.path.basename(path) + ".")
+    try:
+        with open(path, "rb") as basis, os.fdopen(fd, "wb") as out:
+            while True:
+                op = inp.read(1)
+                if op == b"C":
+                    index, count = struct.unpack(">QI", read_exact(inp, 12))
+                    basis.seek(index * bs)
+                    remaining = count * bs
+                    while remaining > 0:
+                        data = basis.read(min(remaining, 1048576))
+                        if not data:
+                            break
+                        remaining -= len(data)
+                        out.write(data)
+                        h.update(data)
+                        total += len(data)
+                elif op == b"L":
+                    (n,) = struct.unpack(">I", read_exact(inp, 4))
+                    data = read_exact(inp, n)
+                    out.write(data)
+                    h.update(data)
+                    total += n
+                elif op == b"E":
+                    break
+                else:
+                    raise ValueError("bad delta op %r" % op)
+        os.chmod(tmp, stat.S_IMODE(os.stat(path).st_mode))
+        if mtime is not None:
+            os.utime(tmp, (float(mtime), float(mtime)))
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    print(h.hexdigest(), total)
+
+cmd, path, bs = sys.argv[1], sys.argv[2], int(sys.argv[3])
+{"sig": sig, "patch": patch}[cmd](path, bs, *sys.argv[4:])
+'''
+
+def choose_block_size(file_size):
+    """根据文件大小选择分块大小（约为文件大小的平方根，与 rsync 类似）"""
+    block_size = int(file_size ** 0.5)
+    block_size = max(MIN_BLOCK_SIZE, min(MAX_BLOCK_SIZE, block_size))
+    # 对齐到 1 KB
+    return (block_size + 1023) // 1024 * 1024
+
+def weak_checksum(block):
+    """计算分块的 (a, b) 弱校验和"""
+    return sum(block) % MOD, sum(accumulate(block)) % MOD
+
+def helper_command(action, remote_path, block_size, *args):
+    """生成在目标上运行辅助脚本的命令"""
+    extra = ''.join(f" {shlex.quote(str(arg))}" for arg in args)
+    return f"python3 -c {shlex.quote(REMOTE_HELPER)} {action} {shlex.quote(remote_path)} {block_size}{extra}"
+
+def parse_signatures(text):
+    """解析 sig 命令的输出
+
+    Returns:
+        tuple: ({弱校验和: [(分块序号, MD5), ...]}, 最后一个分块的 (序号, 长度, MD5))
+    """
+    table = {}
+    last = None
+    for index, line in enumerate(text.splitlines()):
+        weak, length, strong = line.split()
+        table.setdefault(int(weak), []).append((index, strong))
+        last = (index, int(length), strong)
+    return table, last
+
+class DeltaAborted(Exception):
+    """差异过大，增量传输不划算"""
+
+def compute_delta(data, table, last, block_size, out):
+    """使用滚动校验和比较本地数据与远程分块签名，把增量指令写入 out
+
+    字面数据超过文件大小的 MAX_LITERAL_RATIO，或文件开头的试探范围内没有任何分块匹配时
+    抛出 DeltaAborted（由调用方整体上传）。
+
+    Args:
+        data: 本地文件内容（bytes）
+        table: parse_signatures 返回的签名表
+        last: 远程文件最后一个分块的 (序号, 长度, MD5)
+        block_size: 分块大小
+        out: 可写的二进制文件对象
+
+    Returns:
+        dict: {'literal_bytes': 字面数据字节数, 'matched_bytes': 复用的字节数}
+    """
+    n = len(data)
+    L = block_size
+    max_literal = int(n * MAX_LITERAL_RATIO)
+    probe = max(PROBE_BLOCKS * L, PROBE_BYTES)
+    stats = {'literal_bytes': 0, 'matched_bytes': 0}
+    pending_copy = [None, 0]  # 连续复用的分块合并为一条指令
+
+    def flush_copy():
+        if pending_copy[0] is not None:
+            out.write(b'C' + struct.pack('>QI', pending_copy[0], pending_copy[1]))
+            pending_copy[0], pending_copy[1] = None, 0
+
+    def emit_copy(index, length):
+        if pending_copy[0] is not None and pending_copy[0] + pending_copy[1] == index:
+            pending_copy[1] += 1
+        else:
+            flush_copy()
+            pending_copy[0], pending_copy[1] = index, 1
+        stats['matched_bytes'] += length
+
+    def emit_literal(start, end):
+        if start >= end:
+            return
+        flush_copy()
+        stats['literal_bytes'] += end - start
+        if stats['literal_bytes'] > max_literal:
+            raise DeltaAborted()
+        for offset in range(start, end, MAX_LITERAL):
+            chunk = data[offset:min(end, offset + MAX_LITERAL)]
+            out.write(b'L' + struct.pack('>I', len(chunk)))
+            out.write(chunk)
+
+    pos = 0
+    literal_start = 0
+    if n >= L:
+        a, b = weak_checksum(data[0:L])
+    while pos + L <= n:
+        candidates = table.get(a | (b << 16))
+        if candidates:
+            strong = hashlib.md5(data[pos:pos + L]).hexdigest()
+            match = next((index for index, digest in candidates if digest == strong
+                          and (last is None or index != last[0] or last[1] == L)), None)
+            if match is not None:
+                emit_literal(literal_start, pos)
+                emit_copy(match, L)
+                pos += L
+                literal_start = pos
+                if pos + L <= n:
+                    a, b = weak_checksum(data[pos:pos + L])
+                continue
+        # 尚未写出的字面数据已经超过上限，或者试探范围内没有任何匹配时尽早放弃
+        unmatched = pos + 1 - literal_start
+        if stats['literal_bytes'] + unmatched > max_literal or \
+                (unmatched >= probe and not stats['matched_bytes']):
+            raise DeltaAborted()
+        # 向后滚动一个字节
+        if pos + L < n:
+            x_out = data[pos]
+            x_in = data[pos + L]
+            a = (a - x_out + x_in) % MOD
+            b = (b - L * x_out + a) % MOD
+        pos += 1
+
+    # 远程文件最后一个不足一个分块的部分可能与本地文件末尾一致
+    tail_start = n
+    if last is not None and last[1] < L and n - last[1] >= literal_start:
+        tail = data[n - last[1]:n]
+        if hashlib.md5(tail).hexdigest() == last[2]:
+            tail_start = n - last[1]
+    emit_literal(literal_start, tail_start)
+    if tail_start < n:
+        emit_copy(last[0], last[1])
+    flush_copy()
+    out.write(b'E')
+    return stats
+
+def delta_upload(session, local_path, remote_path, block_size=None):
+    """通过增量方式更新远程已存在的文件
+
+    先在远程计算分块签名，本地用滚动校验和找出可以复用的分块，只发送变化的数据，
+    再由远程辅助脚本重建文件并原子替换。远程需要 python3。
+
+    Args:
+        session: 会话对象（ParamikoSession / OpenSSHSession / LocalShellSession）
+        local_path: 本地文件路径（已完成行尾转换）
+        remote_path: 远程文件路径
+        block_size: 分块大小，为 None 时按文件大小自动选择
+
+    Returns:
+        dict | None: 成功时返回传输统计，远程文件不存在或不适合增量传输（包括超过 MAX_DELTA_SIZE）时
+            返回 None（由调用方整体上传）
+    """
+    size = os.path.getsize(local_path)
+    if size == 0 or size > MAX_DELTA_SIZE:
+        return None
+    block_size = block_size or choose_block_size(size)
+
+    exit_code, out, err = session.run(helper_command('sig', remote_path, block_size))
+    if exit_code == 3:
+        return None
+    if exit_code != 0:
+        print(f"获取远程分块签名失败 (退出码: {exit_code}): {err.strip()}")
+        return None
+    table, last = parse_signatures(out)
+    if not table:
+        return None
+
+    with open(local_path, 'rb') as f:
+        data = f.read(MAX_DELTA_SIZE + 1)
+    if len(data) != size:
+        raise Exception(f"文件在增量传输期间发生变化: {local_path}")
+
+    with tempfile.TemporaryFile() as delta:
+        try:
+            stats = compute_delta(data, table, last, block_size, delta)
+        except DeltaAborted:
+            return None
+        local_md5 = hashlib.md5(data).hexdigest()
+        stats['delta_bytes'] = delta.tell()
+        delta.seek(0)
+        # 重建后的文件保留本地文件的修改时间，便于之后按清单比较
+        mtime = os.stat(local_path).st_mtime
+        exit_code, out, err = session.run(helper_command('patch', remote_path, block_size, mtime), stdin=delta)
+
+    if exit_code != 0:
+        raise Exception(f"远程增量重建失败 (退出码: {exit_code}): {err.strip()}")
+    remote_md5, remote_size = out.split()
+    if remote_md5 != local_md5 or int(remote_size) != size:
+        raise Exception(f"远程增量重建校验失败: {remote_path}")
+    stats['size'] = size
+    return stats
@@ -0,0 +1,235 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from tree_scanner import ScanEntry, scan_directory
+from sync_state import RACY_WINDOW_NS, is_racy
+
+def _join(relative_dir, name):
+    return os.path.join(relative_dir, name) if relative_dir else name
+
+def file_signature(st):
+    """索引中保存的文件签名 [大小, 纳秒修改时间, inode]，刚被修改过的文件返回 None（下次总是检查）"""
+    if time.time_ns() - st.st_mtime_ns < RACY_WINDOW_NS:
+        return None
+    return [st.st_size, st.st_mtime_ns, st.st_ino]
+
+def _same_signature(recorded, st):
+    if recorded is None:
+        return False
+    size, mtime_ns, ino = recorded
+    # Windows 上 os.scandir 返回的 inode 为 0，此时不参与比较
+    return size == st.st_size and mtime_ns == st.st_mtime_ns and (not ino or not st.st_ino or ino == st.st_ino)
+
+class DirectoryIndex:
+    """持久化的按目录索引，用于重启时跳过离线期间没有变化的目录
+
+    每个目录一个条目：{'mtime_ns': 目录的修改时间, 'checked_ns': 记录时间, 'files': {文件名: 签名},
+    'dirs': [子目录名], 'rules': 忽略规则指纹, 'digest': 聚合哈希}。签名为 None 的文件下次总是检查。
+    聚合哈希由目录中文件的签名和子目录的聚合哈希计算（Merkle 树），子树中任何文件或目录变化都会
+    改变所有祖先的哈希，重启时只重写哈希变化的条目。
+
+    条目只记录已经同步到所有目标的文件签名。扫描时文件签名与条目一致的文件不再逐个查询同步记录；
+    trust_mtime 为 True 时，修改时间与条目一致（且不在模糊区间内）的目录不再读取目录内容，
+    直接沿用条目中的文件和子目录。注意原地修改文件不会改变目录的修改时间，
+    因此只有文件总是以“写临时文件再重命名”的方式更新时才应该开启 trust_mtime。
+    """
+
+    def __init__(self, state, matcher, trust_mtime=False):
+        """
+        Args:
+            state: 同步记录存储（条目保存在其中）
+            matcher: PathMatcher
+            trust_mtime: 是否跳过修改时间未变化的目录的读取
+        """
+        self.state = state
+        self.matcher = matcher
+        self.trust_mtime = trust_mtime
+        self.root = matcher.source_dir
+        # 忽略规则变化后旧条目中的文件列表不再可信
+        self.rules = hashlib.sha1(json.dumps(
+            [self.root, matcher.ignore_patterns, matcher.only_sync_files]).encode()).hexdigest()[:16]
+        self._lock = threading.Lock()
+        # 运行期间同步完成或失败的文件：{目录相对路径: {文件名: 签名或 None}}
+        self._pending = {}
+        self._stored = {}
+        self._visited = {}
+        self.stats = {}
+
+    def _valid(self, entry):
+        return entry is not None and entry.get('rules') == self.rules
+
+    def scan(self, workers=1):
+        """遍历源目录，只返回需要逐个检查的文件
+
+        Args:
+            workers: 并行读取目录的线程数
+
+        Yields:
+            ScanEntry: 签名与索引不一致（或没有索引）的文件
+        """
+        self._stored = dict(self.state.dir_items())
+        self._visited = {}
+        self.stats = {'dirs': 0, 'trusted_dirs': 0, 'files': 0, 'skipped_files': 0}
+        if workers <= 1:
+            stack = [(self.root, '')]
+            while stack:
+                path, relative_dir = stack.pop()
+                files, subdirs = self._visit(path, relative_dir)
+                yield from files
+                stack.extend(reversed(subdirs))
+            return
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="index-scan") as executor:
+            pending = {executor.submit(self._visit, self.root, '')}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    files, subdirs = future.result()
+                    for path, relative_dir in subdirs:
+                        pending.add(executor.submit(self._visit, path, relative_dir))
+                    yield from files
+
+    def _visit(self, path, relative_dir):
+        """读取单个目录并与索引条目比较
+
+        Returns:
+            tuple: (需要检查的文件列表, 子目录列表 [(绝对路径, 相对路径)])
+        """
+        checked_ns = time.time_ns()
+        try:
+            dir_mtime_ns = os.stat(path).st_mtime_ns
+        except OSError as e:
+            print(f"读取目录失败: {e}, 目录: {path}")
+            return [], []
+        stored = self._stored.get(relative_dir)
+        stored = stored if self._valid(stored) else None
+
+        check = []
+        if (self.trust_mtime and stored is not None and stored['mtime_ns'] == dir_mtime_ns
+                and not is_racy(stored)):
+            # 目录内容没有增减，沿用条目中的文件列表，只检查上次没有确认的文件
+            signatures = dict(stored['files'])
+            subdirs = [(os.path.join(path, name), _join(relative_dir, name)) for name in stored['dirs']]
+            for name, signature in signatures.items():
+                if signature is not None:
+                    continue
+                file_path = os.path.join(path, name)
+                try:
+                    st = os.stat(file_path)
+                except OSError:
+                    continue
+                check.append(ScanEntry(file_path, _join(relative_dir, name), st.st_size, st.st_mtime_ns, st))
+            trusted = True
+        else:
+            if not os.access(path, os.R_OK | os.X_OK):
+                # 无法读取的目录不记录条目
+                return scan_directory(path, relative_dir, self.matcher, True)
+            files, subdirs = scan_directory(path, relative_dir, self.matcher, True)
+            signatures = {}
+            known = stored['files'] if stored is not None else {}
+            for entry in files:
+                name = os.path.basename(entry.path)
+                if _same_signature(known.get(name), entry.stat):
+                    signatures[name] = known[name]
+                else:
+                    signatures[name] = file_signature(entry.stat)
+                    check.append(entry)
+            trusted = False
+
+        with self._lock:
+            self._visited[relative_dir] = {
+                'mtime_ns': dir_mtime_ns, 'checked_ns': checked_ns, 'files': signatures,
+                'dirs': sorted(os.path.basename(p) for p, _ in subdirs), 'rules': self.rules
+            }
+            self.stats['dirs'] += 1
+            self.stats['trusted_dirs'] += trusted
+            self.stats['files'] += len(signatures)
+            self.stats['skipped_files'] += len(signatures) - len(check)
+        return check, subdirs
+
+    def commit(self, failed=()):
+        """扫描的文件检查、同步完成后保存索引
+
+        Args:
+            failed: 没有同步成功的文件路径，在条目中记为未确认
+
+        Returns:
+            dict: 扫描统计，另外包含 'changed_dirs'（聚合哈希变化的目录数）和 'unchanged'（整个源目录是否没有变化）
+        """
+        with self._lock:
+            visited, self._visited = self._visited, {}
+            stored, self._stored = self._stored, {}
+            # 扫描期间同步的文件已包含在本次结果中
+            self._pending = {}
+        for path in failed:
+            relative_dir, name = os.path.split(os.path.relpath(path, self.root))
+            entry = visited.get(relative_dir if relative_dir != os.curdir else '')
+            if entry is not None and name in entry['files']:
+                entry['files'][name] = None
+
+        # 从最深的目录开始计算聚合哈希
+        changed = {}
+        changed_digests = 0
+        for relative_dir in sorted(visited, key=lambda d: d.count(os.sep) + bool(d), reverse=True):
+            entry = visited[relative_dir]
+            children = [(name, visited.get(_join(relative_dir, name), {}).get('digest'))
+                        for name in entry['dirs']]
+            entry['digest'] = hashlib.sha1(json.dumps(
+                [sorted(entry['files'].items()), children]).encode()).hexdigest()
+            old = stored.get(relative_dir) if self._valid(stored.get(relative_dir)) else None
+            if old is None or old.get('digest') != entry['digest']:
+                changed_digests += 1
+                changed[relative_dir] = entry
+            elif old['mtime_ns'] != entry['mtime_ns'] or is_racy(old):
+                changed[relative_dir] = entry
+
+        with self.state.batch():
+            if changed:
+                self.state.save_dirs(changed)
+            self.state.delete_dirs([path for path in stored if path not in visited])
+        self.stats['changed_dirs'] = changed_digests
+        self.stats['unchanged'] = bool(visited) and changed_digests == 0 and len(stored) == len(visited)
+        return self.stats
+
+    def file_synced(self, path, st):
+        """运行期间文件同步完成后更新所在目录的条目（在 flush 时写入）"""
+        self._update(path, file_signature(st) if st is not None else None)
+
+    def file_failed(self, path):
+        """运行期间文件同步失败：条目中记为未确认，下次启动时重新检查"""
+        self._update(path, None)
+
+    def _update(self, path, signature):
+        relative_dir, name = os.path.split(os.path.relpath(path, self.root))
+        with self._lock:
+            self._pending.setdefault(relative_dir if relative_dir != os.curdir else '', {})[name] = signature
+
+    def flush(self):
+        """把运行期间的更新写入已有的条目（没有条目的目录下次启动时完整检查）"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        updated = {}
+        for relative_dir, files in pending.items():
+            entry = self.state.get_dir(relative_dir)
+            if not self._valid(entry):
+                continue
+            entry['files'].update(files)
+            updated[relative_dir] = entry
+        # 聚合哈希在下次启动时重新计算，所有祖先的聚合哈希同样失效
+        for relative_dir in list(updated):
+            while True:
+                entry = updated.get(relative_dir) or self.state.get_dir(relative_dir)
+                if not self._valid(entry):
+                    break
+                entry['digest'] = None
+                updated[relative_dir] = entry
+                if not relative_dir:
+                    break
+                relative_dir = os.path.dirname(relative_dir)
+        if updated:
+            self.state.save_dirs(updated)
@@ -0,0 +1,204 @@
+import os
+import time
+import threading
+
+class CoalescingEventQueue:
+    """按键合并的事件队列，使用后沿防抖
+
+    同一个键（相对路径）在防抖时间内的多次事件会合并为一个，并且以最后一次事件为准，
+    在最后一次事件之后经过 delay 秒才交给消费者处理，因此一串连续写入中的最后一次不会丢失。
+    正在处理中的键不会被重复取出，处理期间到达的新事件会在处理完成后再次排队。
+    作为范围加入的键（如会扫描整个目录的目录事件）与其下的键（按路径分隔符判断）不会同时处理。
+    """
+
+    def __init__(self, delay=1.0, clock=time.monotonic):
+        """
+        Args:
+            delay: 防抖时间（秒）
+            clock: 返回当前时间（秒）的函数，测试时可以替换
+        """
+        self.delay = delay
+        self._clock = clock
+        self._pending = {}  # 键 -> (事件类型, 附加数据, 到期时间)
+        self._in_flight = set()
+        # 作为范围加入的键：尚未处理的和正在处理的
+        self._pending_scopes = set()
+        self._in_flight_scopes = set()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._draining = False
+        self.coalesced_count = 0
+
+    def put(self, key, kind, payload=None, merge=None, scope=None):
+        """加入事件，已有同键事件时合并
+
+        Args:
+            key: 事件键（相对路径）
+            kind: 事件类型
+            payload: 附加数据
+            merge: 合并函数 merge(旧类型, 旧数据, 新类型, 新数据) -> (类型, 数据)，为 None 时以新事件为准
+            scope: 判断函数 scope(类型, 数据) -> bool，合并后的事件的处理是否覆盖其下的所有键（处理期间不取出其下的键）
+
+        Returns:
+            bool: 是否与已有事件合并
+        """
+        with self._cond:
+            if self._closed:
+                return False
+            coalesced = key in self._pending
+            if coalesced:
+                self.coalesced_count += 1
+                if merge is not None:
+                    old_kind, old_payload, _ = self._pending[key]
+                    kind, payload = merge(old_kind, old_payload, kind, payload)
+            self._pending[key] = (kind, payload, self._clock() + self.delay)
+            if scope is not None and scope(kind, payload):
+                self._pending_scopes.add(key)
+            else:
+                self._pending_scopes.discard(key)
+            self._cond.notify()
+            return coalesced
+
+    def cover(self, key):
+        """键的上层有尚未处理的范围事件时，把该事件的到期时间推迟到 delay 秒之后
+
+        Returns:
+            bool: 是否找到并推迟了范围事件（该范围事件的处理会覆盖此键）
+        """
+        with self._cond:
+            if self._closed or not self._pending_scopes:
+                return False
+            parent = os.path.dirname(key)
+            while parent:
+                if parent in self._pending_scopes:
+                    kind, payload, _ = self._pending[parent]
+                    self._pending[parent] = (kind, payload, self._clock() + self.delay)
+                    self.coalesced_count += 1
+                    return True
+                parent = os.path.dirname(parent)
+            return False
+
+    def _blocked(self, key):
+        """键或其上层范围正在处理中，或键是范围且其下有键正在处理中"""
+        if key in self._in_flight:
+            return True
+        if key in self._pending_scopes:
+            prefix = os.path.join(key, '')
+            if any(k.startswith(prefix) for k in self._in_flight):
+                return True
+        if self._in_flight_scopes:
+            parent = os.path.dirname(key)
+            while parent:
+                if parent in self._in_flight_scopes:
+                    return True
+                parent = os.path.dirname(parent)
+        return False
+
+    def _due_keys(self, now, limit, extra_kind=None, extra_limit=0):
+        keys = []
+        count = extra = 0
+        for key, (kind, _, due) in self._pending.items():
+            if self._blocked(key):
+                continue
+            if self._draining or due <= now:
+                if kind == extra_kind and extra < extra_limit:
+                    extra += 1
+                elif count < limit:
+                    count += 1
+                else:
+                    continue
+                keys.append(key)
+                if count >= limit and (extra_kind is None or extra >= extra_limit):
+                    break
+        if 0 < extra < extra_limit:
+            # 有该类型的事件到期时，尚未到期的同类事件也一并取出（如删除目录树时陆续到达的删除事件）
+            taken = set(keys)
+            for key, (kind, _, _) in self._pending.items():
+                if kind == extra_kind and key not in taken and not self._blocked(key):
+                    keys.append(key)
+                    extra += 1
+                    if extra >= extra_limit:
+                        break
+        return keys
+
+    def _next_due(self):
+        dues = [due for key, (_, _, due) in self._pending.items() if not self._blocked(key)]
+        return min(dues) if dues else None
+
+    def get_batch(self, max_items=64, extra_kind=None, extra_items=0, block=True):
+        """取出一批已到期的事件，没有到期事件时阻塞等待
+
+        Args:
+            max_items: 每批最多取出的事件数
+            extra_kind: 可以额外多取的事件类型（如删除事件，整批合并成一次远程命令），
+                其中有事件到期时，尚未到期的同类事件也一并取出
+            extra_items: 该类型事件最多额外取出的数量
+            block: 为 False 时没有到期事件立即返回空列表
+
+        Returns:
+            list | None: [(键, 事件类型, 附加数据), ...]，队列关闭且已清空时返回 None
+        """
+        with self._cond:
+            while True:
+                now = self._clock()
+                keys = self._due_keys(now, max_items, extra_kind, extra_items)
+                if keys:
+                    batch = []
+                    for key in keys:
+                        kind, payload, _ = self._pending.pop(key)
+                        self._in_flight.add(key)
+                        if key in self._pending_scopes:
+                            self._pending_scopes.discard(key)
+                            self._in_flight_scopes.add(key)
+                        batch.append((key, kind, payload))
+                    return batch
+                if self._closed and (not self._draining or not self._pending):
+                    return None
+                if not block:
+                    return []
+                next_due = self._next_due()
+                self._cond.wait(None if next_due is None else max(0.0, next_due - now))
+
+    def done(self, key):
+        """标记事件处理完成"""
+        with self._cond:
+            self._in_flight.discard(key)
+            self._in_flight_scopes.discard(key)
+            self._cond.notify_all()
+
+    def discard(self, predicate, kinds=None):
+        """丢弃尚未处理且键满足 predicate 的事件
+
+        Args:
+            predicate: 键的判断函数
+            kinds: 只丢弃这些类型的事件，为 None 时不限类型
+
+        Returns:
+            list: 被丢弃的 (键, 事件类型, 附加数据)
+        """
+        with self._cond:
+            removed = []
+            for key in [k for k, (kind, _, _) in self._pending.items()
+                        if predicate(k) and (kinds is None or kind in kinds)]:
+                kind, payload, _ = self._pending.pop(key)
+                self._pending_scopes.discard(key)
+                removed.append((key, kind, payload))
+            return removed
+
+    def __len__(self):
+        with self._cond:
+            return len(self._pending)
+
+    def close(self, drain=True):
+        """关闭队列
+
+        Args:
+            drain: 为 True 时忽略防抖时间，让消费者处理完剩余事件
+        """
+        with self._cond:
+            self._closed = True
+            self._draining = drain
+            if not drain:
+                self._pending.clear()
+                self._pending_scopes.clear()
+            self._cond.notify_all()
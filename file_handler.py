@@ -2,132 +2,361 @@ from watchdog.events import FileSystemEventHandler
 from datetime import datetime
 import os
 import time
-import json
-from sync_utils import sync_to_local, sync_to_remote, should_ignore_file, parse_targets, delete_from_local, delete_from_remote, delete_from_remote_dir, delete_from_local_dir, calculate_md5
+import threading
+from collections import deque
+from contextlib import nullcontext
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from sync_utils import sync_to_local, sync_to_remote, bulk_sync_to_remote, parse_targets, describe_target, run_with_session, delete_many_from_local, delete_many_from_remote, move_in_local, move_in_remote
 from line_ending_handler import print_shell_script_commands
+from ssh_pool import SSHConnectionPool
+from sync_state import open_sync_state, normalize_record, record_digest, stat_signature, signature_matches, is_racy
+from hash_service import HashService, DEFAULT_ALGORITHM
+from target_workers import TargetWorker
+from event_queue import CoalescingEventQueue
+from path_matcher import PathMatcher
+from tree_scanner import scan_tree
+from dir_index import DirectoryIndex
+from bulk_transfer import MAX_BULK_FILE_SIZE
+from local_copy import LocalCopier
+from metrics import REGISTRY
+from log_writer import create_log_writer, level_value
+from manifest import local_signatures, collect_remote_manifest, collect_local_manifest, plan_differences
 
 class FileHandler(FileSystemEventHandler):
-    def __init__(self, config: dict, config_name: str):
+    def __init__(self, config: dict, config_name: str, log_writer=None, io_limiter=None):
         super().__init__()
         self.source_dir = os.path.abspath(config['source_dir'])
-        self.targets = parse_targets(config['targets'])
+        self.targets = parse_targets(config['targets'], remote_options={
+            'delta_threshold': config.get('delta_threshold', 8 * 1024 * 1024),
+            'compression': config.get('remote_compression'),
+            'resumable_threshold': config.get('resumable_threshold', 64 * 1024 * 1024),
+            'resumable_chunk_size': config.get('resumable_chunk_size', 8 * 1024 * 1024),
+            'resumable_parallel': config.get('resumable_parallel', 1),
+        })
         self.log_file = os.path.abspath(config['log_file'])
+        # 低于该级别的日志不写入也不输出，延迟生成的消息不会被计算
+        self.log_level = level_value(config.get('log_level', 'INFO'))
+        # 后台批量写入日志文件，未传入时由处理器自己创建并在关闭时释放
+        self._owns_log_writer = log_writer is None
+        self.log_writer = log_writer if log_writer is not None else create_log_writer(config)
         self.ignore_patterns = config['ignore_patterns']
         self.only_sync_files = config['only_sync_files']
         self.mode = config['mode']
         self.last_sync_file = os.path.abspath(config['last_sync_file'])
+        # 编译后的忽略/仅同步规则，遍历目录时用于剪枝
+        self.matcher = PathMatcher(self.source_dir, self.ignore_patterns, self.only_sync_files, self.log_file)
         self.config_name = config_name
-        self._load_sync_times()
+        # 同步记录存储（默认 SQLite，按配置隔离）
+        self.state = open_sync_state(config, config_name)
+        # 按目录保存的索引（与同步记录存在一起），增量同步启动时跳过没有变化的文件和目录
+        self.dir_index = (DirectoryIndex(self.state, self.matcher, config.get('dir_index_trust_mtime', False))
+                          if config.get('dir_index', True) else None)
+
+        # 多个配置共用的 I/O 信号量：同时读取（哈希）和传输的文件总数不超过名额，为 None 时不限制
+        self.io_limiter = io_limiter if io_limiter is not None else nullcontext()
+
+        # 文件哈希服务（并行计算，算法可配置）
+        self.hasher = HashService(
+            algorithm=config.get('hash_algorithm', DEFAULT_ALGORITHM),
+            workers=config.get('hash_workers'),
+            io_limiter=io_limiter
+        )
+        self.hash_stats = {'files': 0, 'bytes': 0, 'seconds': 0.0}
+
+        # 远程目标共用的SSH连接池，由处理器持有并在关闭时释放
+        self.ssh_pool = SSHConnectionPool(
+            idle_timeout=config.get('ssh_idle_timeout', 300),
+            keepalive_interval=config.get('ssh_keepalive_interval', 30),
+            multiplex=config.get('ssh_multiplex', True)
+        )
+
+        # 本地目标共用的复制引擎（写时复制克隆、零拷贝，缓存已存在的目录）
+        self.local_copier = LocalCopier()
 
         # 确保本地目标目录存在
         for target in self.targets:
             if not target['remote']:
                 os.makedirs(target['path'], exist_ok=True)
 
-        self.last_sync_timestamps = {}
-        self.debounce_seconds = 1
+        # 每个目标独立的工作线程和有界队列，慢速目标不会拖慢其他目标
+        self.target_workers = [
+            TargetWorker(describe_target(target),
+                         concurrency=config.get('target_concurrency', 2),
+                         queue_size=config.get('target_queue_size', 64))
+            for target in self.targets
+        ]
+        # 等待单个文件在所有目标上完成的最长时间（秒），卡住的目标不会阻塞之后的文件，None 表示一直等待
+        self.target_timeout = config.get('target_timeout', 900)
+
+        # 扫描目录树时并行读取子目录的线程数
+        self.scan_workers = config.get('scan_workers', 4)
+        # sync_all_files 每批检查的文件数，批内需要哈希的文件并行计算
+        self.check_batch_size = config.get('check_batch_size', 256)
+        # 全量同步时先获取目标上的文件清单，只传输差异
+        self.differential_full_sync = config.get('differential_full_sync', True)
+        # 增量同步（模式 2/3）时也按目标清单校验，而不只依赖本地同步记录
+        self.verify_targets = config.get('verify_targets', False)
+        # 按清单同步时删除目标上源目录中已不存在的文件
+        self.delete_orphans = config.get('delete_orphans', False)
+        # 初始同步需要传输的文件数达到该值时，远程目标改为打包成一个 tar 流传输，0 表示关闭
+        self.bulk_threshold = config.get('bulk_threshold', 200)
+        # 超过该大小的文件不放入批量归档
+        self.bulk_max_file_size = config.get('bulk_max_file_size', MAX_BULK_FILE_SIZE)
+
+        # 文件事件先进入按相对路径合并的队列，最后一次事件之后 debounce_seconds 秒再由工作线程处理
+        self.debounce_seconds = config.get('debounce_seconds', 1)
+        self.events = CoalescingEventQueue(delay=self.debounce_seconds)
+        self.event_workers = config.get('event_workers', 2)
+        self.event_batch_size = config.get('event_batch_size', 64)
+        # 删除事件另外按批取出，同一批删除在每个目标上合并为一次操作
+        self.delete_batch_size = config.get('delete_batch_size', 1000)
+        self._event_threads = []
         self.last_logged_file = None
 
-    def _load_sync_times(self):
-        """加载上次同步时间记录"""
-        try:
-            if os.path.exists(self.last_sync_file):
-                with open(self.last_sync_file, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                if content:
-                    all_sync_times = json.loads(content)
-                else:
-                    all_sync_times = {}
-                self.sync_times = all_sync_times.get(self.config_name, {})
-            else:
-                self.sync_times = {}
-        except Exception as e:
-            print(f"加载同步时间记录失败: {e}")
-            self.sync_times = {}
+        # 运行指标（所有处理器共用一个注册表，按配置名区分）
+        self.metrics = REGISTRY
+        self._register_metrics()
+
+    def _register_metrics(self):
+        """注册在输出时取值的指标：队列长度、哈希统计"""
+        labels = {'config': self.config_name}
+        self.metrics.register_callback('event_queue_depth', 'gauge', lambda: len(self.events),
+                                       '等待处理的文件事件数', **labels)
+        self.metrics.register_callback('files_hashed_total', 'counter', lambda: self.hasher.totals['files'],
+                                       '计算过哈希的文件数', **labels)
+        self.metrics.register_callback('bytes_hashed_total', 'counter', lambda: self.hasher.totals['bytes'],
+                                       '计算过哈希的字节数', **labels)
+        for target, worker in zip(self.targets, self.target_workers):
+            self.metrics.register_callback('target_queue_depth', 'gauge', worker.queue_depth,
+                                           '目标工作线程中排队和正在执行的任务数',
+                                           target=describe_target(target), **labels)
 
-    def _save_sync_time(self, file_path):
-        """保存文件的同步时间和MD5哈希值"""
+    def _save_sync_time(self, file_path, st=None, digest=None):
+        """保存文件的同步时间、哈希值和文件签名
+
+        Args:
+            file_path: 文件路径
+            st: 计算哈希前获取的 os.stat 结果，为 None 时重新获取
+            digest: 已经用 self.hasher.algorithm 计算好的哈希值，为 None 时重新计算
+        """
         abs_path = os.path.abspath(file_path)
         timestamp = datetime.now().isoformat()
         
         try:
-            # 计算文件的MD5哈希值
-            md5_hash = calculate_md5(file_path)
-            
-            all_sync_times = {}
-            if os.path.exists(self.last_sync_file):
-                with open(self.last_sync_file, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                if content:
-                    all_sync_times = json.loads(content)
-                else:
-                    all_sync_times = {}
-            
-            if self.config_name not in all_sync_times:
-                all_sync_times[self.config_name] = {}
+            # 先获取文件签名再计算哈希，哈希期间文件被修改时签名会不一致，下次检查会重新计算
+            if st is None:
+                st = os.stat(file_path)
+            # 计算文件的哈希值
+            if digest is None:
+                digest = self.hasher.hash_file(file_path)
             
-            # 保存时间戳和MD5哈希值
-            if abs_path not in all_sync_times[self.config_name]:
-                all_sync_times[self.config_name][abs_path] = {}
-            
-            all_sync_times[self.config_name][abs_path] = {
+            # 保存时间戳、哈希值和文件签名
+            start = time.perf_counter()
+            self.state.upsert(abs_path, {
                 'timestamp': timestamp,
-                'md5': md5_hash
-            }
-            
-            os.makedirs(os.path.dirname(self.last_sync_file), exist_ok=True)
-            with open(self.last_sync_file, 'w', encoding='utf-8') as f:
-                json.dump(all_sync_times, f, indent=2, ensure_ascii=False)
-            
-            self.sync_times = all_sync_times[self.config_name]
+                'hash': digest,
+                'hash_algo': self.hasher.algorithm,
+                **stat_signature(st)
+            })
+            self.metrics.observe('state_save_seconds', time.perf_counter() - start,
+                                 '保存一条同步记录的耗时', config=self.config_name)
         except Exception as e:
+            self.metrics.inc('failures_total', 1, '失败次数', config=self.config_name, target='', operation='save_state')
             print(f"保存同步时间记录失败: {e}")
 
-    def _need_sync(self, file_path):
-        """检查文件是否需要同步
-        只有当文件的最后修改时间晚于上次同步时间，并且MD5哈希值不同时，才需要同步。
+    def build_baseline(self, reuse=True, chunk_size=1000, progress_interval=2.0):
+        """把源目录中的所有文件记录为已同步（模式 11）
+
+        扫描一次目录树，分批并行计算哈希，所有记录在一个事务中提交。reuse 为 True 时，
+        文件签名与已有记录一致（且不在修改时间的模糊区间内）的文件直接沿用记录，不重新计算哈希。
+        源目录中已不存在的文件的记录会被删除。
+
+        Args:
+            reuse: 是否沿用签名未变的记录
+            chunk_size: 每批计算哈希的文件数
+            progress_interval: 输出进度的最短间隔（秒）
+
+        Returns:
+            dict: {'files': 文件数, 'reused': 沿用的记录数, 'hashed': 计算哈希的文件数,
+                   'bytes': 计算哈希的字节数, 'failed': 失败数, 'seconds': 耗时}
+        """
+        start = time.perf_counter()
+        entries = list(scan_tree(self.source_dir, self.matcher, workers=self.scan_workers))
+        print(f"扫描完成: {len(entries)} 个文件 ({time.perf_counter() - start:.1f}秒)")
+
+        stats = {'files': len(entries), 'reused': 0, 'hashed': 0, 'bytes': 0, 'failed': 0}
+        to_hash = []
+        if reuse:
+            for entry in entries:
+                record = normalize_record(self.state.get(entry.path))
+                if (record and record_digest(record)[1] and signature_matches(record, entry.stat)
+                        and not is_racy(record)):
+                    stats['reused'] += 1
+                else:
+                    to_hash.append(entry)
+        else:
+            to_hash = entries
+
+        hash_start = time.perf_counter()
+        last_report = hash_start
+        with self.state.batch():
+            for i in range(0, len(to_hash), chunk_size):
+                chunk = to_hash[i:i + chunk_size]
+                digests, chunk_stats = self.hasher.hash_files([entry.path for entry in chunk])
+                for entry in chunk:
+                    digest = digests[entry.path]
+                    if isinstance(digest, Exception):
+                        stats['failed'] += 1
+                        print(f"计算哈希失败: {digest}, 文件: {entry.path}")
+                        continue
+                    self._save_sync_time(entry.path, st=entry.stat, digest=digest)
+                stats['hashed'] += len(chunk)
+                stats['bytes'] += chunk_stats['bytes']
+                now = time.perf_counter()
+                if now - last_report >= progress_interval or i + chunk_size >= len(to_hash):
+                    last_report = now
+                    elapsed = max(now - hash_start, 1e-9)
+                    print(f"进度: {stats['hashed']}/{len(to_hash)} 个文件, "
+                          f"{stats['hashed'] / elapsed:.0f} 个文件/s, "
+                          f"{stats['bytes'] / 1024 / 1024 / elapsed:.1f} MB/s")
+
+            # 删除源目录中已不存在（或已被忽略）的文件的记录
+            present = {entry.path for entry in entries}
+            stale = [path for path, _ in self.state.items() if path not in present]
+            self.state.delete_many(stale)
+
+        stats['seconds'] = time.perf_counter() - start
+        return stats
+
+    def _check_sync(self, file_path, st=None, defer_hash=False):
+        """检查文件是否需要同步，并返回判断依据
+
+        文件签名（大小、mtime_ns、inode、设备号）与记录一致时只需一次 os.stat 即可判断无需同步；
+        大小变化时直接判断需要同步；只有无法确定时才计算一次哈希。
+
+        Args:
+            file_path: 文件路径
+            st: 已获取的 os.stat 结果，为 None 时重新获取
+            defer_hash: 为 True 时不计算哈希，需要哈希才能判断时返回 (None, 判断信息)，
+                由调用方计算后交给 _compare_hash
+
+        Returns:
+            tuple: (是否需要同步, 判断信息字典)
+                判断信息包含 record（同步记录）、stat、hash/hash_algo（本次计算的哈希，未计算时为 None）和 reason
         """
         abs_path = os.path.abspath(file_path)
-        sync_info = self.sync_times.get(abs_path)
+        sync_info = normalize_record(self.state.get(abs_path))
+        hash_algo, last_digest = record_digest(sync_info)
+        detail = {'path': abs_path, 'record': sync_info, 'stat': st, 'hash': None,
+                  'hash_algo': hash_algo, 'reason': '无同步记录'}
         
         if not sync_info:
-            return True
+            return True, detail
         
         try:
-            # 处理旧格式（字符串）和新格式（字典）
-            if isinstance(sync_info, str):
-                # 旧格式：只有时间戳，没有MD5
-                last_sync_time_str = sync_info
-                last_md5 = None
-            else:
-                # 新格式：包含时间戳和MD5
-                last_sync_time_str = sync_info.get('timestamp')
-                last_md5 = sync_info.get('md5')
+            if st is None:
+                st = detail['stat'] = os.stat(file_path)
             
-            # 如果没有MD5记录，使用旧的逻辑
-            if not last_md5:
-                last_sync_time = datetime.fromisoformat(last_sync_time_str)
-                last_modified_time = datetime.fromtimestamp(os.path.getmtime(file_path))
-                return last_modified_time > last_sync_time
+            # 文件签名一致且不处于修改时间的模糊区间，无需读取文件内容
+            matched = signature_matches(sync_info, st)
+            if matched and not is_racy(sync_info):
+                detail['reason'] = '文件签名未变化'
+                return False, detail
+            if matched is False and sync_info['size'] != st.st_size:
+                detail['reason'] = '文件大小变化'
+                return True, detail
             
-            # 检查修改时间
-            last_sync_time = datetime.fromisoformat(last_sync_time_str)
-            last_modified_time = datetime.fromtimestamp(os.path.getmtime(file_path))
-            time_changed = last_modified_time > last_sync_time
+            # 旧记录没有文件签名时，先比较修改时间
+            if matched is None:
+                last_sync_time = datetime.fromisoformat(sync_info.get('timestamp'))
+                last_modified_time = datetime.fromtimestamp(st.st_mtime)
+                if not last_modified_time > last_sync_time:
+                    detail['reason'] = '修改时间早于上次同步时间'
+                    return False, detail
+                # 如果没有哈希记录，使用旧的逻辑
+                if not last_digest:
+                    detail['reason'] = '修改时间晚于上次同步时间'
+                    return True, detail
             
-            # 如果时间没有变化，不需要同步
-            if not time_changed:
-                return False
-            
-            # 计算当前文件的MD5哈希值
-            current_md5 = calculate_md5(file_path)
-            
-            # 只有当时间变化并且MD5哈希值不同时，才需要同步
-            return current_md5 != last_md5
+            if defer_hash:
+                return None, detail
+            # 按记录使用的算法计算当前文件的哈希值（每次判断最多计算一次）
+            return self._compare_hash(detail, self.hasher.hash_file(file_path, hash_algo))
             
         except Exception as e:
-            print(f"比较时间或MD5失败: {e}, 文件: {file_path}")
-            return True
+            print(f"比较文件签名或哈希失败: {e}, 文件: {file_path}")
+            detail['reason'] = f'检查失败: {e}'
+            return True, detail
+
+    def _compare_hash(self, detail, digest):
+        """用计算出的哈希值完成 _check_sync 的判断
+
+        Args:
+            detail: _check_sync 返回的判断信息
+            digest: 按 detail['hash_algo'] 计算的哈希值，计算失败时为异常对象
+        """
+        if isinstance(digest, Exception):
+            detail['reason'] = f'计算哈希失败: {digest}'
+            return True, detail
+        detail['hash'] = digest
+        if digest != record_digest(detail['record'])[1]:
+            detail['reason'] = '哈希值变化'
+            return True, detail
+        
+        # 内容未变化，更新记录中的文件签名，下次检查可以直接走快速路径
+        detail['reason'] = '文件签名变化但哈希值未变化'
+        self.state.upsert(detail['path'], {**detail['record'], **stat_signature(detail['stat'])})
+        return False, detail
+
+    def _check_sync_many(self, files):
+        """批量检查多个文件，需要哈希才能判断的文件在线程池中并行计算
+
+        Args:
+            files: (文件路径, os.stat 结果或 None) 列表
+
+        Returns:
+            list: 与输入顺序一致的 (文件路径, (是否需要同步, 判断信息)) 列表
+        """
+        results = []
+        pending = []
+        for file_path, st in files:
+            check = self._check_sync(file_path, st, defer_hash=True)
+            results.append((file_path, check))
+            if check[0] is None:
+                pending.append(len(results) - 1)
+        if pending:
+            jobs = [(results[i][0], results[i][1][1]['hash_algo']) for i in pending]
+            digests, stats = self.hasher.hash_files(jobs)
+            for i in pending:
+                file_path, (_, detail) = results[i]
+                results[i] = (file_path, self._compare_hash(detail, digests[file_path]))
+            self.hash_stats['files'] += stats['files']
+            self.hash_stats['bytes'] += stats['bytes']
+            self.hash_stats['seconds'] += stats['seconds']
+        return results
+
+    def _need_sync(self, file_path):
+        """检查文件是否需要同步"""
+        return self._check_sync(file_path)[0]
+
+    def _describe_check(self, detail, prefix=""):
+        """根据 _check_sync 的判断信息生成日志内容（不会重新计算哈希）"""
+        sync_info = detail['record'] or {}
+        last_sync_time_str = sync_info.get('timestamp', '')
+        last_sync_time = datetime.fromisoformat(last_sync_time_str) if last_sync_time_str else datetime.min
+        st = detail['stat']
+        last_digest = record_digest(sync_info)[1] or '未记录'
+        current_digest = detail['hash'] or '未计算'
+        
+        log_message = f"{prefix}上次同步时间: {last_sync_time.strftime('%Y-%m-%d %H:%M:%S')}\n"
+        if st is not None:
+            last_modified_time = datetime.fromtimestamp(st.st_mtime)
+            log_message += f"{prefix}文件修改时间: {last_modified_time.strftime('%Y-%m-%d %H:%M:%S')}\n"
+            log_message += f"{prefix}时间是否变化: {'是' if last_modified_time > last_sync_time else '否'}\n"
+        log_message += f"{prefix}文件哈希({detail['hash_algo']}): {current_digest}\n"
+        log_message += f"{prefix}上次哈希: {last_digest}\n"
+        log_message += f"{prefix}判断依据: {detail['reason']}\n"
+        return log_message
 
     def preview_sync_files(self):
         """以树形结构预览将要同步的文件"""
@@ -141,21 +370,14 @@ class FileHandler(FileSystemEventHandler):
         print(f"\n将从 {self.source_dir} 同步的文件:")
         
         file_tree = {}
-        for root, dirs, files in os.walk(self.source_dir):
-            for file in files:
-                file_path = os.path.join(root, file)
-                if should_ignore_file(file_path, self.source_dir, self.ignore_patterns, 
-                                    self.only_sync_files, self.log_file):
-                    continue
-                relative_path = os.path.relpath(file_path, self.source_dir)
-                
-                parts = relative_path.split(os.sep)
-                current = file_tree
-                for part in parts[:-1]:
-                    if part not in current:
-                        current[part] = {}
-                    current = current[part]
-                current[parts[-1]] = None
+        for entry in scan_tree(self.source_dir, self.matcher, with_stat=False):
+            parts = entry.relative_path.split(os.sep)
+            current = file_tree
+            for part in parts[:-1]:
+                if part not in current:
+                    current[part] = {}
+                current = current[part]
+            current[parts[-1]] = None
         
         def print_tree(node, prefix="", is_last=True):
             items = list(node.items())
@@ -168,64 +390,67 @@ class FileHandler(FileSystemEventHandler):
         
         print_tree(file_tree)
 
-    def _log(self, message, write_to_file=True, write_to_console=True):
+    def _log(self, message, write_to_file=True, write_to_console=True, level='INFO'):
         """统一的日志记录方法
         Args:
-            message: 日志消息
-            write_to_file: 是否写入文件
+            message: 日志消息，也可以是返回消息的函数（级别启用时才调用）
+            write_to_file: 是否写入文件（由后台线程批量写入）
             write_to_console: 是否输出到控制台
+            level: 日志级别
         """
+        level = level_value(level)
+        if level < self.log_level or not (write_to_file or write_to_console):
+            return
+        if callable(message):
+            message = message()
         if write_to_file:
-            with open(self.log_file, "a", encoding='utf-8') as log_file:
-                log_file.write(message)
+            self.log_writer.write(self.log_file, message, urgent=level >= level_value('ERROR'))
         if write_to_console:
             print(message, end='')
 
-    def _sync_file(self, src_path):
-        """同步单个文件到所有目标"""
-        if should_ignore_file(src_path, self.source_dir, self.ignore_patterns, 
-                            self.only_sync_files, self.log_file):
+    def close(self):
+        """释放处理器持有的资源（SSH连接池、同步记录存储等）
+
+        先处理完事件队列中剩余的事件，再关闭各目标的工作线程和连接。
+        """
+        self.events.close(drain=True)
+        for thread in self._event_threads:
+            thread.join()
+        self._event_threads = []
+        for worker in self.target_workers:
+            worker.close(timeout=5)
+        self.ssh_pool.close_all()
+        self.hasher.close()
+        if self.dir_index is not None:
+            self.dir_index.flush()
+        self.state.close()
+        self.metrics.unregister(config=self.config_name)
+        if self._owns_log_writer:
+            self.log_writer.close()
+        else:
+            self.log_writer.flush()
+
+    def _sync_file(self, src_path, check=None):
+        """同步单个文件到所有目标
+
+        Args:
+            src_path: 源文件路径
+            check: 调用方已经得到的 _check_sync 结果，避免重复判断
+        """
+        if self.matcher.ignores(src_path):
             return False
 
         # 添加检查是否需要同步
-        if not self._need_sync(src_path):
-            sync_info = self.sync_times.get(src_path, {})
-            
+        need_sync, detail = check if check is not None else self._check_sync(src_path)
+        if not need_sync:
             try:
-                # 处理旧格式（字符串）和新格式（字典）
-                if isinstance(sync_info, str):
-                    last_sync_time_str = sync_info
-                    last_md5 = "未记录"
-                else:
-                    last_sync_time_str = sync_info.get('timestamp', '')
-                    last_md5 = sync_info.get('md5', '未记录')
-                
-                last_sync_time = datetime.fromisoformat(last_sync_time_str) if last_sync_time_str else datetime.min
-                last_modified_time = datetime.fromtimestamp(os.path.getmtime(src_path))
-                current_md5 = calculate_md5(src_path)
-                
-                log_message = f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 文件无需同步: {src_path}\n"
-                log_message += f"_sync_file: 上次同步时间: {last_sync_time.strftime('%Y-%m-%d %H:%M:%S')}\n"
-                log_message += f"_sync_file: 文件修改时间: {last_modified_time.strftime('%Y-%m-%d %H:%M:%S')}\n"
-                log_message += f"_sync_file: 时间是否变化: {'是' if last_modified_time > last_sync_time else '否'}\n"
-                log_message += f"_sync_file: 文件MD5: {current_md5}\n"
-                log_message += f"_sync_file: 上次MD5: {last_md5}\n"
-                log_message += f"_sync_file: MD5是否变化: {'是' if current_md5 != last_md5 else '否'}\n"
-                log_message += f"_sync_file: 同步条件: 时间变化 且 MD5变化\n"
-                self._log(log_message)
+                header = f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 文件无需同步: {src_path}\n"
+                self._log(lambda: header + self._describe_check(detail, prefix="_sync_file: "), level='DEBUG')
             except Exception as e:
                 print(f"获取同步信息失败: {e}, 文件: {src_path}")
             return False
 
         relative_path = os.path.relpath(src_path, self.source_dir)
-        current_time = time.time()
-
-        # 检查是否需要同步（防抖）
-        if (relative_path in self.last_sync_timestamps and 
-            current_time - self.last_sync_timestamps[relative_path] < self.debounce_seconds):
-            return False
-
-        self.last_sync_timestamps[relative_path] = current_time
 
         # 记录日志
         if relative_path != self.last_logged_file:
@@ -234,182 +459,770 @@ class FileHandler(FileSystemEventHandler):
             self._log(log_message)
             self.last_logged_file = relative_path
 
-        # 同步到所有目标
-        for target in self.targets:
-            if target['remote']:
-                remote_path = os.path.join(target['path'], relative_path).replace('\\', '/')
-                sync_to_remote(src_path, remote_path, target)
-            else:
-                dest_path = os.path.join(target['path'], relative_path)
-                sync_to_local(src_path, dest_path)
+        # 并行同步到所有目标，等待每个目标的结果
+        if not self._sync_to_targets(src_path, relative_path):
+            if self.dir_index is not None:
+                self.dir_index.file_failed(src_path)
+            return False
 
-        # 同步完成后保存同步时间
-        self._save_sync_time(src_path)
+        self._finish_sync(src_path, detail)
+        return True
+
+    def _finish_sync(self, src_path, detail):
+        """文件在所有目标上同步完成后保存同步记录，并打印 shell 脚本需要的命令"""
+        # 同步完成后保存同步时间（算法一致时复用判断时获取的签名和哈希）
+        if detail['hash'] is not None and detail['stat'] is not None and detail['hash_algo'] == self.hasher.algorithm:
+            self._save_sync_time(src_path, st=detail['stat'], digest=detail['hash'])
+        else:
+            self._save_sync_time(src_path, st=detail['stat'])
+        if self.dir_index is not None:
+            self.dir_index.file_synced(src_path, detail['stat'])
         
         # 检查是否需要打印特殊命令
         print_shell_script_commands(src_path, self.source_dir)
-        
-        return True
 
     def sync_all_files(self, check_time=False):
         """初始化时同步所有文件"""
+        if (self.differential_full_sync and not check_time) or (self.verify_targets and check_time):
+            return self.differential_sync(self.delete_orphans)
+
         log_message = f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 开始初始同步...\n"
         log_message += "-" * 60 + "\n"
         self._log(log_message)
 
-        synced_count = 0
-        for root, dirs, files in os.walk(self.source_dir):
-            for file in files:
-                file_path = os.path.join(root, file)
-                if should_ignore_file(file_path, self.source_dir, self.ignore_patterns, 
-                                    self.only_sync_files, self.log_file):
-                    continue
-                
-                # 添加时间检查
-                if check_time and not self._need_sync(file_path):
-                    continue
-                
-                if self._sync_file(file_path):
-                    synced_count += 1
+        self.hash_stats = {'files': 0, 'bytes': 0, 'seconds': 0.0}
+        self.local_copier.reset_stats()
+        # 增量同步时按目录索引扫描，签名与索引一致的文件不再逐个检查
+        use_index = check_time and self.dir_index is not None
+        # 所有同步记录在遍历结束后一次提交
+        with self.state.batch():
+            batch = []
+            planned = []
+            # 扫描时已经得到每个文件的 stat 信息，检查时不再重复获取
+            entries = (self.dir_index.scan(self.scan_workers) if use_index
+                       else scan_tree(self.source_dir, self.matcher, workers=self.scan_workers))
+            for entry in entries:
+                batch.append((entry.path, entry.stat))
+                if len(batch) >= self.check_batch_size:
+                    planned += self._sync_checked(batch, check_time)
+                    batch = []
+            planned += self._sync_checked(batch, check_time)
+
+            # 检查完成后统一传输，文件较多时远程目标使用批量传输
+            files = [(file_path, os.path.relpath(file_path, self.source_dir),
+                      detail['stat'].st_size if detail['stat'] is not None else None, None)
+                     for file_path, (_, detail) in planned]
+            synced = self._transfer_many(files)
+            for file_path, (_, detail) in planned:
+                if file_path in synced:
+                    self._finish_sync(file_path, detail)
+            synced_count = len(synced)
+            if use_index:
+                stats = self.dir_index.commit(failed=[path for path, _ in planned if path not in synced])
+                log_message = f"目录索引: {stats['dirs']} 个目录 (未读取 {stats['trusted_dirs']} 个), "
+                log_message += f"{stats['files']} 个文件中 {stats['skipped_files']} 个签名未变化, "
+                log_message += f"{stats['changed_dirs']} 个目录有变化\n"
+                if stats['unchanged']:
+                    log_message += "源目录自上次运行以来没有变化\n"
+                self._log(log_message)
+
+        if self.hash_stats['files']:
+            seconds = self.hash_stats['seconds']
+            mb = self.hash_stats['bytes'] / 1024 / 1024
+            log_message = f"哈希计算: {self.hash_stats['files']} 个文件, {mb:.1f} MB, "
+            log_message += f"{mb / seconds if seconds > 0 else 0:.1f} MB/s\n"
+            self._log(log_message)
+
+        if any(not target['remote'] for target in self.targets):
+            self._log(f"本地复制: {self.local_copier.summary()}\n")
 
         log_message = f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] "
         log_message += f"初始同步完成！已同步 {synced_count} 个文件。\n"
         log_message += "-" * 60 + "\n"
         self._log(log_message)
 
-    def on_modified(self, event):
-        """文件修改事件处理"""
+    def _collect_manifest(self, target, signatures):
+        """一次性获取目标上整个目录树的文件清单（远程目标执行一条命令，本地目标一次遍历）"""
+        if target['remote']:
+            return run_with_session(target, self.ssh_pool,
+                                    lambda session: collect_remote_manifest(session, target['path'], signatures))
+        return collect_local_manifest(target['path'], signatures, self.hasher)
+
+    def differential_sync(self, delete_orphans=False):
+        """按目标上已有的文件清单同步：只传输大小、修改时间或内容不同的文件
+
+        目标被恢复或新增目标时，本地同步记录不可信，此时以目标的实际内容为准。
+
+        Args:
+            delete_orphans: 是否删除目标上源目录中已不存在的文件
+        """
+        log_message = f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 开始按目标清单同步...\n"
+        log_message += "-" * 60 + "\n"
+        self._log(log_message)
+
+        entries = list(scan_tree(self.source_dir, self.matcher, workers=self.scan_workers))
+        # 每个文件需要传输到的目标序号
+        pending = {}
+        orphans = []
+        for index, target in enumerate(self.targets):
+            start = time.perf_counter()
+            try:
+                signatures = local_signatures(entries, target['remote'])
+                manifest = self._collect_manifest(target, signatures)
+                to_transfer, target_orphans = plan_differences(entries, manifest, self.hasher,
+                                                               target['remote'], self.matcher)
+            except Exception as e:
+                # 无法获取清单时该目标退回到全部传输
+                self._log(f"获取目标文件清单失败，将传输全部文件: {describe_target(target)}: {e}\n", level='WARNING')
+                manifest, to_transfer, target_orphans = {}, entries, []
+            for entry in to_transfer:
+                pending.setdefault(entry.path, set()).add(index)
+            orphans.extend((target, relative_path) for relative_path in target_orphans)
+            log_message = f"目标清单: {describe_target(target)}: 目标上 {len(manifest)} 个文件, "
+            log_message += f"需传输 {len(to_transfer)} 个, 多余 {len(target_orphans)} 个 "
+            log_message += f"({time.perf_counter() - start:.1f}秒)\n"
+            self._log(log_message)
+
+        with self.state.batch():
+            files = [(entry.path, entry.relative_path, entry.size, [self.targets[i] for i in sorted(pending[entry.path])])
+                     for entry in entries if entry.path in pending]
+            synced = self._transfer_many(files)
+            synced_count = len(synced)
+            to_record = []
+            for entry in entries:
+                if entry.path in pending:
+                    if entry.path not in synced:
+                        continue
+                    print_shell_script_commands(entry.path, self.source_dir)
+                    to_record.append(entry)
+                    continue
+                # 所有目标都与源文件一致，记录缺失或已过期时更新同步记录
+                record = normalize_record(self.state.get(entry.path))
+                if not record or not signature_matches(record, entry.stat):
+                    to_record.append(entry)
+
+            # 需要更新记录的文件并行计算哈希
+            for i in range(0, len(to_record), self.check_batch_size):
+                chunk = to_record[i:i + self.check_batch_size]
+                digests, _ = self.hasher.hash_files([entry.path for entry in chunk])
+                for entry in chunk:
+                    digest = digests[entry.path]
+                    self._save_sync_time(entry.path, st=entry.stat,
+                                         digest=None if isinstance(digest, Exception) else digest)
+
+            if delete_orphans:
+                # 每个目标的多余文件一次删除
+                for target in self.targets:
+                    items = [(relative_path, False) for t, relative_path in orphans if t is target]
+                    if not items:
+                        continue
+                    try:
+                        self._delete_many_from_target(target, items)
+                    except Exception as e:
+                        self._log(f"删除文件失败: {e}\n", level='ERROR')
+
+        log_message = f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] "
+        log_message += f"按清单同步完成！共 {len(entries)} 个文件，已同步 {synced_count} 个文件"
+        if delete_orphans:
+            log_message += f"，删除多余文件 {len(orphans)} 个"
+        log_message += "。\n" + "-" * 60 + "\n"
+        self._log(log_message)
+
+    def _sync_to_target(self, src_path, relative_path, target):
+        """同步单个文件到单个目标（在目标的工作线程中执行）"""
+        start = time.perf_counter()
+        labels = {'config': self.config_name, 'target': describe_target(target)}
+        stats = None
+        try:
+            with self.io_limiter:
+                if target['remote']:
+                    remote_path = os.path.join(target['path'], relative_path).replace('\\', '/')
+                    stats = sync_to_remote(src_path, remote_path, target, pool=self.ssh_pool, progress=self.state)
+                else:
+                    dest_path = os.path.join(target['path'], relative_path)
+                    sync_to_local(src_path, dest_path, copier=self.local_copier)
+        except Exception:
+            self.metrics.inc('failures_total', 1, '失败次数', operation='transfer', **labels)
+            raise
+        if stats and stats['method'] == 'compressed':
+            self._log_compression(f"压缩传输: {labels['target']} <- {relative_path} {stats['codec']}-{stats['level']}",
+                                  stats['size'], stats['sent_bytes'])
+        self._record_transfer(labels, time.perf_counter() - start, 1, os.path.getsize(src_path))
+
+    def _log_compression(self, message, size, sent_bytes):
+        """把压缩传输发送和节省的字节数写入传输日志"""
+        saved = size - sent_bytes
+        self._log(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {message} 发送 {sent_bytes} / {size} 字节，"
+                  f"节省 {saved} 字节 ({saved * 100 / size if size else 0:.0f}%)\n")
+
+    def _record_transfer(self, labels, seconds, files, size):
+        """记录一次成功传输的指标（字节数为源文件大小，不计压缩和增量传输节省的部分）"""
+        self.metrics.observe('transfer_seconds', seconds, '单次传输的耗时', **labels)
+        self.metrics.inc('files_transferred_total', files, '传输的文件数', **labels)
+        self.metrics.inc('bytes_transferred_total', size, '传输的源文件字节数', **labels)
+
+    def _sync_to_targets(self, src_path, relative_path, targets=None):
+        """把文件同时提交给所有目标的工作线程，并逐个报告结果
+
+        Args:
+            src_path: 源文件路径
+            relative_path: 相对路径
+            targets: 只同步到这些目标，为 None 时同步到所有目标
+
+        Returns:
+            bool: 所有目标都同步成功时返回 True
+        """
+        futures = [
+            (target, worker.submit(self._sync_to_target, src_path, relative_path, target))
+            for target, worker in zip(self.targets, self.target_workers)
+            if targets is None or any(target is t for t in targets)
+        ]
+        all_ok = True
+        for target, future in futures:
+            if not self._wait_target(target, future, relative_path):
+                all_ok = False
+        if not all_ok:
+            self._log(f"部分目标同步失败，未记录同步时间: {relative_path}\n", level='WARNING')
+        return all_ok
+
+    def _wait_target(self, target, future, relative_path):
+        """等待单个目标上的传输结果，超时或失败时记录日志
+
+        target_timeout 从任务开始执行时算起，排在其他任务之后的任务不会在执行之前就被判为超时；
+        排队等待开始执行的时间另外最多 target_timeout（排在卡住的任务之后），超过时取消任务。
+
+        Args:
+            future: TargetWorker.submit 返回的 TargetFuture
+
+        Returns:
+            bool: 是否同步成功
+        """
+        try:
+            timeout = None
+            if self.target_timeout:
+                queued = max(0, future.submitted_at + self.target_timeout - time.monotonic())
+                if not future.wait_started(queued) and future.cancel():
+                    self.metrics.inc('failures_total', 1, '失败次数', config=self.config_name,
+                                     target=describe_target(target), operation='timeout')
+                    self._log(f"排队超时 ({self.target_timeout}秒内未开始执行): {describe_target(target)} <- {relative_path}\n",
+                              level='ERROR')
+                    return False
+                started_at = future.started_at or time.monotonic()
+                timeout = max(0, started_at + self.target_timeout - time.monotonic())
+            future.result(timeout=timeout)
+            return True
+        except FutureTimeoutError:
+            self.metrics.inc('failures_total', 1, '失败次数', config=self.config_name,
+                             target=describe_target(target), operation='timeout')
+            self._log(f"同步超时 ({self.target_timeout}秒): {describe_target(target)} <- {relative_path}\n",
+                      level='ERROR')
+        except Exception as e:
+            self._log(f"同步失败: {describe_target(target)} <- {relative_path}: {e}\n", level='ERROR')
+        return False
+
+    def _sync_checked(self, files, check_time):
+        """批量检查（并行计算哈希），返回需要同步的文件
+
+        Returns:
+            list: 需要同步的 (文件路径, (是否需要同步, 判断信息)) 列表
+        """
+        planned = []
+        for file_path, check in self._check_sync_many(files):
+            if not check[0]:
+                # 添加时间检查
+                if not check_time:
+                    self._sync_file(file_path, check=check)
+                continue
+            planned.append((file_path, check))
+        return planned
+
+    def _transfer_many(self, files):
+        """传输一批文件
+
+        文件数达到 bulk_threshold 时，发往每个远程目标的小文件打包成一个 tar 流，
+        通过一次远程命令传输；其余文件逐个同步。
+
+        Args:
+            files: (源文件路径, 相对路径, 文件大小, 目标列表) 列表，目标列表为 None 时表示所有目标
+
+        Returns:
+            set: 在所有目标上都同步成功的源文件路径
+        """
+        use_bulk = bool(self.bulk_threshold) and len(files) >= self.bulk_threshold
+        bulk_files = [[] for _ in self.targets]
+        single = []
+        for src_path, relative_path, size, targets in files:
+            rest = []
+            for index, target in enumerate(self.targets):
+                if targets is not None and not any(target is t for t in targets):
+                    continue
+                if (use_bulk and target['remote'] and size is not None
+                        and size <= self.bulk_max_file_size):
+                    bulk_files[index].append((src_path, relative_path))
+                else:
+                    rest.append(target)
+            if rest:
+                single.append((src_path, relative_path, rest))
+
+        # 批量任务先提交给各目标的工作线程，与逐个同步的文件并行进行
+        bulk_jobs = []
+        for index, batch in enumerate(bulk_files):
+            if not batch:
+                continue
+            target = self.targets[index]
+            self._log(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 批量传输: {describe_target(target)} {len(batch)} 个文件\n")
+            for _, relative_path in batch:
+                self._log(f"批量同步文件: {relative_path}\n", write_to_console=False)
+            future = self.target_workers[index].submit(self._bulk_to_target, batch, target)
+            bulk_jobs.append((target, batch, time.perf_counter(), future))
+
+        failed = self._pipeline_to_targets(single)
+
+        for target, batch, start, future in bulk_jobs:
+            try:
+                packed = set(future.result())
+            except Exception as e:
+                self._log(f"批量传输失败: {describe_target(target)}: {e}\n", level='ERROR')
+                packed = set()
+            failed.update(src_path for src_path, _ in batch if src_path not in packed)
+            self._log(f"批量传输完成: {describe_target(target)} {len(packed)} / {len(batch)} 个文件 "
+                      f"({time.perf_counter() - start:.1f}秒)\n")
+        return {src_path for src_path, _, _, _ in files if src_path not in failed}
+
+    def _pipeline_to_targets(self, files):
+        """逐个同步的文件按目标流水线提交：每个目标同时最多 target_concurrency 个文件在传输，
+        不等待上一个文件在所有目标上完成
+
+        Args:
+            files: (源文件路径, 相对路径, 目标列表) 列表
+
+        Returns:
+            set: 至少在一个目标上同步失败的源文件路径
+        """
+        in_flight = [deque() for _ in self.targets]
+        failed = set()
+
+        def finish(index):
+            src_path, relative_path, future = in_flight[index].popleft()
+            if not self._wait_target(self.targets[index], future, relative_path):
+                if src_path not in failed:
+                    self._log(f"部分目标同步失败，未记录同步时间: {relative_path}\n", level='WARNING')
+                failed.add(src_path)
+
+        for src_path, relative_path, targets in files:
+            if relative_path != self.last_logged_file:
+                self._log(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 同步文件: {relative_path}\n")
+                self.last_logged_file = relative_path
+            for index, (target, worker) in enumerate(zip(self.targets, self.target_workers)):
+                if not any(target is t for t in targets):
+                    continue
+                # 该目标的传输名额已满时先等待它最早提交的文件，其他目标不受影响
+                while len(in_flight[index]) >= worker.concurrency:
+                    finish(index)
+                future = worker.submit(self._sync_to_target, src_path, relative_path, target)
+                in_flight[index].append((src_path, relative_path, future))
+        for index in range(len(self.targets)):
+            while in_flight[index]:
+                finish(index)
+        return failed
+
+    def _bulk_to_target(self, batch, target):
+        """批量传输到单个远程目标（在目标的工作线程中执行）"""
+        start = time.perf_counter()
+        labels = {'config': self.config_name, 'target': describe_target(target)}
+        try:
+            with self.io_limiter:
+                result = bulk_sync_to_remote(batch, target, self.ssh_pool)
+        except Exception:
+            self.metrics.inc('failures_total', 1, '失败次数', operation='bulk_transfer', **labels)
+            raise
+        packed = result['packed']
+        if result['compressed'] and result['bytes']:
+            self._log_compression(f"批量压缩传输: {labels['target']} {len(packed)} 个文件",
+                                  result['bytes'], result['sent_bytes'])
+        size = sum(os.path.getsize(path) for path in packed if os.path.exists(path))
+        self._record_transfer(labels, time.perf_counter() - start, len(packed), size)
+        return packed
+
+    def start(self):
+        """启动事件处理工作线程（监控模式下在启动观察者之前调用）"""
+        for i in range(max(1, self.event_workers)):
+            thread = threading.Thread(target=self._event_loop, name=f"events-{self.config_name}-{i}", daemon=True)
+            thread.start()
+            self._event_threads.append(thread)
+
+    def _event_loop(self):
+        """从事件队列中按批取出事件并处理"""
+        while True:
+            batch = self.events.get_batch(self.event_batch_size, 'deleted', self.delete_batch_size)
+            if batch is None:
+                return
+            try:
+                self._process_events(batch)
+            except Exception as e:
+                self._log(f"处理文件事件失败: {e}\n", level='ERROR')
+            finally:
+                for key, _, _ in batch:
+                    self.events.done(key)
+
+    def _process_events(self, batch):
+        """处理一批已合并的事件：先处理移动事件，修改事件批量检查（并行计算哈希）后同步，删除事件逐个处理"""
+        for key, kind, payload in batch:
+            if kind == 'moved':
+                self._handle_moved(payload)
+
+        # 同一批中目录检查到的文件和文件自身的事件只检查一次
+        modified = {}
+        deleted = []
+        for key, kind, payload in batch:
+            if kind == 'moved':
+                continue
+            file_path = payload['path']
+            if kind == 'deleted' and not os.path.lexists(file_path):
+                deleted.append((file_path, payload['is_directory']))
+            elif os.path.isdir(file_path):
+                # 新建的目录（或删除后又重新创建）：检查目录中已有的文件
+                relative_dir = os.path.relpath(file_path, self.source_dir)
+                modified.update((entry.path, entry.stat)
+                                for entry in scan_tree(file_path, self.matcher, relative_dir=relative_dir))
+            elif os.path.isfile(file_path):
+                modified.setdefault(file_path, None)
+        if deleted:
+            self._handle_deleted_many(deleted)
+        
+        for file_path, check in self._check_sync_many(list(modified.items())):
+            # 检查是否需要同步
+            if not check[0]:
+                try:
+                    header = f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 检测到文件变更但无需同步: {file_path}\n"
+                    self._log(lambda: header + self._describe_check(check[1]), write_to_console=False, level='DEBUG')
+                except Exception as e:
+                    print(f"获取同步信息失败: {e}, 文件: {file_path}")
+                self.last_logged_file = file_path
+                continue
+            
+            self._sync_file(file_path, check=check)
+            self.last_logged_file = file_path
+        if self.dir_index is not None:
+            self.dir_index.flush()
+
+    def _enqueue(self, file_path, kind, is_directory=False, **extra):
+        """将文件事件加入合并队列"""
+        relative_path = os.path.relpath(file_path, self.source_dir)
+        payload = {'path': file_path, 'is_directory': is_directory, **extra}
+        if self._scans_directory(kind, payload):
+            # 目录的新建、移动事件处理时会检查其下所有文件，其下尚未处理的新建、修改事件不再单独处理
+            prefix = os.path.join(relative_path, '')
+            self.events.discard(lambda key: key.startswith(prefix), kinds=('created', 'modified'))
+            coalesced = self.events.put(relative_path, kind, payload, merge=self._merge_events,
+                                        scope=self._scans_directory)
+        elif kind == 'modified' and self.events.cover(relative_path):
+            # 由上层尚未处理的目录事件一并检查
+            coalesced = True
+        else:
+            coalesced = self.events.put(relative_path, kind, payload, merge=self._merge_events,
+                                        scope=self._scans_directory)
+        self.metrics.inc('events_received_total', 1, '收到的文件事件数', config=self.config_name, kind=kind)
+        if coalesced:
+            self.metrics.inc('events_debounced_total', 1, '被防抖合并的文件事件数', config=self.config_name)
+            # 防抖：与尚未处理的事件合并，以最后一次事件为准
+            self._log(lambda: f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 防抖：合并文件变更: {relative_path}\n",
+                      write_to_console=False, level='DEBUG')
+
+    @staticmethod
+    def _scans_directory(kind, payload):
+        """事件的处理是否会检查目录下的所有文件（新建或移动的目录）"""
+        return payload['is_directory'] and kind in ('created', 'moved')
+
+    @staticmethod
+    def _merge_events(old_kind, old_payload, kind, payload):
+        """合并同一路径上尚未处理的事件
+
+        移动事件处理完后会重新检查新路径上的文件（包括已被删除的情况），因此随后的修改、删除事件
+        并入移动事件；另一个文件又移动到同一路径时，前一次移动的原路径需要在目标上删除。
+        """
+        if old_kind != 'moved':
+            return kind, payload
+        if kind != 'moved':
+            return old_kind, old_payload
+        replaced = old_payload.get('replaced', []) + [(old_payload['src_path'], old_payload['is_directory'])]
+        return kind, dict(payload, replaced=replaced + payload.get('replaced', []))
+
+    def on_created(self, event):
+        """新建文件或目录事件处理（目录会检查其中已有的文件，如从监控目录之外移入的目录）"""
+        # 观察者为移入的目录中每个文件补发的事件，已由目录事件处理
+        if getattr(event, 'is_synthetic', False):
+            return
         if event.is_directory:
+            if not self.matcher.excludes_dir(self.matcher.relative(event.src_path)):
+                self._enqueue(event.src_path, 'created', True)
             return
-        
-        file_path = event.src_path
 
-        if should_ignore_file(file_path, self.source_dir, self.ignore_patterns, 
-                         self.only_sync_files, self.log_file):
+        if self.matcher.ignores(event.src_path):
             return
-        
-        # 检查是否在防抖时间内
-        current_time = time.time()
-        last_time = self.last_sync_timestamps.get(file_path, 0)
-        if current_time - last_time < self.debounce_seconds:
-            # 防抖：忽略文件变更
-            log_message = f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 防抖：忽略文件变更"
-            log_message += f": {file_path}\n" if self.last_logged_file != file_path else ", "
-            log_message += f"距上次触发: {current_time - last_time:.3f}秒\n"
-            self._log(log_message, write_to_console=False)
+
+        self._enqueue(event.src_path, 'modified')
+
+    def on_moved(self, event):
+        """移动（重命名）事件处理
+
+        跨越忽略规则边界的移动改为新路径上的新建或原路径上的删除，其余在目标上直接移动。
+        """
+        # 目录移动时观察者为其中每个文件补发的移动事件，已由目录的移动处理
+        if getattr(event, 'is_synthetic', False):
+            return
+        src_path, dest_path = event.src_path, event.dest_path
+        if event.is_directory:
+            src_ignored = self.matcher.excludes_dir(self.matcher.relative(src_path))
+            dest_ignored = self.matcher.excludes_dir(self.matcher.relative(dest_path))
+        else:
+            src_ignored = self.matcher.ignores(src_path)
+            dest_ignored = self.matcher.ignores(dest_path)
+        if src_ignored and dest_ignored:
+            return
+        if dest_ignored:
+            self._enqueue(src_path, 'deleted', event.is_directory)
+            return
+        if src_ignored:
+            self._enqueue(dest_path, 'created' if event.is_directory else 'modified', event.is_directory)
+            return
+
+        # 原路径（目录时包括其下的路径）上尚未处理的事件由这次移动接管：
+        # 连续移动时从最初的路径移动，其他路径上的移动的原路径在目标上删除，修改和删除在移动后重新检查
+        relative_src = os.path.relpath(src_path, self.source_dir)
+        prefix = os.path.join(relative_src, '')
+        replaced = []
+        for key, kind, payload in self.events.discard(
+                lambda key: key == relative_src or (event.is_directory and key.startswith(prefix))):
+            if kind != 'moved':
+                continue
+            if key == relative_src:
+                src_path = payload['src_path']
+            else:
+                replaced.append((payload['src_path'], payload['is_directory']))
+            replaced += payload.get('replaced', [])
+        self._enqueue(dest_path, 'moved', event.is_directory, src_path=src_path, replaced=replaced)
+
+    def on_modified(self, event):
+        """文件修改事件处理（只入队，不在观察者线程中同步）"""
+        if event.is_directory:
             return
         
-        # 更新最后同步时间戳
-        self.last_sync_timestamps[file_path] = current_time
-        
-        # 检查是否需要同步
-        if not self._need_sync(file_path):
-            sync_info = self.sync_times.get(file_path, {})
-            
-            try:
-                # 处理旧格式（字符串）和新格式（字典）
-                if isinstance(sync_info, str):
-                    last_sync_time_str = sync_info
-                    last_md5 = "未记录"
-                else:
-                    last_sync_time_str = sync_info.get('timestamp', '')
-                    last_md5 = sync_info.get('md5', '未记录')
-                
-                last_sync_time = datetime.fromisoformat(last_sync_time_str) if last_sync_time_str else datetime.min
-                last_modified_time = datetime.fromtimestamp(os.path.getmtime(file_path))
-                current_md5 = calculate_md5(file_path)
-                
-                log_message = f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 检测到文件变更但无需同步: {file_path}\n"
-                log_message += f"上次同步时间: {last_sync_time.strftime('%Y-%m-%d %H:%M:%S')}\n"
-                log_message += f"文件修改时间: {last_modified_time.strftime('%Y-%m-%d %H:%M:%S')}\n"
-                log_message += f"时间是否变化: {'是' if last_modified_time > last_sync_time else '否'}\n"
-                log_message += f"文件MD5: {current_md5}\n"
-                log_message += f"上次MD5: {last_md5}\n"
-                log_message += f"MD5是否变化: {'是' if current_md5 != last_md5 else '否'}\n"
-                log_message += f"同步条件: 时间变化 且 MD5变化\n"
-                self._log(log_message, write_to_console=False)
-            except Exception as e:
-                print(f"获取同步信息失败: {e}, 文件: {file_path}")
-                
-            self.last_logged_file = file_path
+        file_path = event.src_path
+
+        if self.matcher.ignores(file_path):
             return
         
-        self._sync_file(file_path)
-        self.last_logged_file = file_path
+        self._enqueue(file_path, 'modified')
 
     def on_deleted(self, event):
-        """文件删除事件处理"""
+        """文件删除事件处理（只入队，不在观察者线程中删除）"""
         file_path = event.src_path
 
-        if should_ignore_file(file_path, self.source_dir, self.ignore_patterns, 
-                         self.only_sync_files, self.log_file):
+        if self.matcher.ignores(file_path):
             return
         
-        # 记录日志
+        self._enqueue(file_path, 'deleted', event.is_directory)
+
+    def _handle_moved(self, payload):
+        """在所有目标上移动文件或目录，同步记录改为新路径（不重新计算哈希和传输）
+
+        无法直接移动的目标（原路径在目标上不存在、目标目录已存在等）改为上传新路径上的文件并删除原路径。
+        """
+        src_path, dest_path, is_directory = payload['src_path'], payload['path'], payload['is_directory']
+        relative_src = os.path.relpath(src_path, self.source_dir)
+        relative_dest = os.path.relpath(dest_path, self.source_dir)
         log_message = f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] "
-        if event.is_directory:
-            log_message += f"检测到目录删除: {os.path.relpath(file_path, self.source_dir)}\n"
-        else:
-            log_message += f"检测到文件删除: {os.path.relpath(file_path, self.source_dir)}\n"
+        log_message += f"检测到{'目录' if is_directory else '文件'}移动: {relative_src} -> {relative_dest}\n"
         self._log(log_message)
-        
-        # 删除所有目标中的对应文件或目录
-        self._delete_file(file_path, event.is_directory)
-        
-        # 从同步时间记录中删除该文件
-        if not event.is_directory:
-            self._remove_sync_time(file_path)
 
-    def _delete_file(self, src_path, is_directory=False):
-        """删除所有目标中的对应文件或目录"""
-        relative_path = os.path.relpath(src_path, self.source_dir)
-        
-        # 删除所有目标中的对应文件或目录
-        for target in self.targets:
+        # 被后续移动覆盖的路径
+        for path, replaced_is_directory in payload.get('replaced', []):
+            if not os.path.lexists(path):
+                self._handle_deleted(path, replaced_is_directory)
+
+        fallback = []
+        if src_path != dest_path:
+            for target in self.targets:
+                try:
+                    if not self._move_in_target(target, relative_src, relative_dest, is_directory):
+                        fallback.append(target)
+                except Exception as e:
+                    self.metrics.inc('failures_total', 1, '失败次数', config=self.config_name,
+                                     target=describe_target(target), operation='move')
+                    self._log(f"移动失败，改为重新上传: {describe_target(target)}: {e}\n", level='ERROR')
+                    fallback.append(target)
+            self.state.rename(os.path.abspath(src_path), os.path.abspath(dest_path), is_directory)
+
+        self._reconcile_moved(dest_path, relative_dest, is_directory, fallback)
+
+        for target in fallback:
             try:
-                if target['remote']:
-                    remote_path = os.path.join(target['path'], relative_path).replace('\\', '/')
-                    if is_directory:
-                        delete_from_remote_dir(remote_path, target)
-                        log_message = f"已删除远程目录: {target['server']}:{remote_path}\n"
-                    else:
-                        delete_from_remote(remote_path, target)
-                        log_message = f"已删除远程文件: {target['server']}:{remote_path}\n"
-                else:
-                    dest_path = os.path.join(target['path'], relative_path)
-                    if is_directory:
-                        delete_from_local_dir(dest_path)
-                        log_message = f"已删除本地目录: {dest_path}\n"
-                    else:
-                        delete_from_local(dest_path)
-                        log_message = f"已删除本地文件: {dest_path}\n"
-                
-                self._log(log_message, write_to_console=False)
+                self._delete_from_target(target, relative_src, is_directory)
             except Exception as e:
-                error_message = f"删除{'目录' if is_directory else '文件'}失败: {e}\n"
-                self._log(error_message)
+                self._log(f"删除{'目录' if is_directory else '文件'}失败: {e}\n", level='ERROR')
 
-    def _remove_sync_time(self, file_path):
-        """从同步时间记录中删除文件"""
-        abs_path = os.path.abspath(file_path)
-        
+    def _reconcile_moved(self, dest_path, relative_dest, is_directory, fallback):
+        """移动后检查新路径上的文件
+
+        移动期间被修改的文件、原来被忽略的文件照常同步；已经不存在或改为被忽略的文件从目标和同步记录中删除；
+        无法直接移动的目标上传全部文件。
+        """
+        abs_dest = os.path.abspath(dest_path)
+        if is_directory:
+            entries = []
+            if os.path.isdir(dest_path):
+                entries = [(entry.path, entry.stat)
+                           for entry in scan_tree(dest_path, self.matcher, relative_dir=relative_dest)]
+            present = {path for path, _ in entries}
+            stale = [path for path in self.state.paths_under(abs_dest) if path not in present]
+        elif os.path.isfile(dest_path) and not self.matcher.ignores(dest_path):
+            entries, stale = [(dest_path, os.stat(dest_path))], []
+        else:
+            entries, stale = [], [abs_dest] if self.state.get(abs_dest) is not None else []
+
+        if stale:
+            self._delete_paths([(os.path.relpath(path, self.source_dir), False) for path in stale])
+        with self.state.batch():
+            self.state.delete_many(stale)
+            if fallback:
+                files = [(path, os.path.relpath(path, self.source_dir), st.st_size, fallback) for path, st in entries]
+                uploaded = self._transfer_many(files)
+                # 没有上传成功的文件删除同步记录，下面重新同步到所有目标
+                self.state.delete_many([os.path.abspath(path) for path, _ in entries if path not in uploaded])
+
+            planned = [(path, check) for path, check in self._check_sync_many(entries) if check[0]]
+            files = [(path, os.path.relpath(path, self.source_dir),
+                      detail['stat'].st_size if detail['stat'] is not None else None, None)
+                     for path, (_, detail) in planned]
+            synced = self._transfer_many(files)
+            for path, (_, detail) in planned:
+                if path in synced:
+                    self._finish_sync(path, detail)
+                elif self.dir_index is not None:
+                    self.dir_index.file_failed(path)
+
+    def _move_in_target(self, target, relative_src, relative_dest, is_directory=False):
+        """在单个目标中移动文件或目录
+
+        Returns:
+            bool: 是否已移动，False 表示需要改为上传
+        """
+        if target['remote']:
+            remote_src = os.path.join(target['path'], relative_src).replace('\\', '/')
+            remote_dest = os.path.join(target['path'], relative_dest).replace('\\', '/')
+            moved = move_in_remote(remote_src, remote_dest, target, pool=self.ssh_pool, is_directory=is_directory)
+            log_message = f"已移动远程{'目录' if is_directory else '文件'}: {target['server']}:{remote_src} -> {remote_dest}\n"
+        else:
+            src = os.path.join(target['path'], relative_src)
+            dest = os.path.join(target['path'], relative_dest)
+            moved = move_in_local(src, dest, is_directory)
+            if moved and is_directory:
+                self.local_copier.forget_dir(src)
+            log_message = f"已移动本地{'目录' if is_directory else '文件'}: {src} -> {dest}\n"
+        if moved:
+            self._log(log_message, write_to_console=False)
+        return moved
+
+    def _handle_deleted(self, file_path, is_directory):
+        """删除所有目标中的对应文件或目录"""
+        self._handle_deleted_many([(file_path, is_directory)])
+
+    def _handle_deleted_many(self, items):
+        """删除所有目标中的一批文件或目录
+
+        已删除的目录下的路径不再单独删除；每个目标只执行一次删除（远程目标为一个命令），
+        随后删除变空的父目录，同步记录在一个事务中删除。
+
+        Args:
+            items: [(源路径, 是否为目录)]
+        """
+        relative_items = {}
+        for path, is_directory in items:
+            relative_items[os.path.relpath(path, self.source_dir)] = is_directory
+        deleted_dirs = {rel for rel, is_directory in relative_items.items() if is_directory}
+
+        def covered(rel):
+            parent = os.path.dirname(rel)
+            while parent:
+                if parent in deleted_dirs:
+                    return True
+                parent = os.path.dirname(parent)
+            return False
+
+        relative_items = [(rel, is_directory) for rel, is_directory in relative_items.items() if not covered(rel)]
+        if not relative_items:
+            return
+
+        # 记录日志（批量删除时每个路径只写入日志文件，控制台输出汇总）
+        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        for rel, is_directory in relative_items:
+            self._log(f"[{timestamp}] 检测到{'目录' if is_directory else '文件'}删除: {rel}\n",
+                      write_to_console=len(relative_items) == 1)
+        if len(relative_items) > 1:
+            self._log(f"[{timestamp}] 检测到删除: {len(relative_items)} 个文件或目录\n")
+
+        # 删除所有目标中的对应文件或目录
+        self._delete_paths(relative_items)
+
+        # 从同步记录中删除这些文件以及已删除目录下的文件
+        stale = [os.path.join(self.source_dir, rel) for rel, is_directory in relative_items if not is_directory]
         try:
-            all_sync_times = {}
-            if os.path.exists(self.last_sync_file):
-                with open(self.last_sync_file, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                if content:
-                    all_sync_times = json.loads(content)
-                else:
-                    all_sync_times = {}
-            
-            if self.config_name in all_sync_times and abs_path in all_sync_times[self.config_name]:
-                del all_sync_times[self.config_name][abs_path]
-                
-                os.makedirs(os.path.dirname(self.last_sync_file), exist_ok=True)
-                with open(self.last_sync_file, 'w', encoding='utf-8') as f:
-                    json.dump(all_sync_times, f, indent=2, ensure_ascii=False)
-                
-                self.sync_times = all_sync_times[self.config_name]
+            for rel, is_directory in relative_items:
+                if is_directory:
+                    stale += self.state.paths_under(os.path.join(self.source_dir, rel))
+            self.state.delete_many(stale)
         except Exception as e:
             print(f"删除同步时间记录失败: {e}")
+
+    def _delete_paths(self, items):
+        """在所有目标中删除一批文件或目录
+
+        Args:
+            items: [(相对路径, 是否为目录)]
+        """
+        for target in self.targets:
+            try:
+                self._delete_many_from_target(target, items)
+            except Exception as e:
+                self.metrics.inc('failures_total', 1, '失败次数', config=self.config_name,
+                                 target=describe_target(target), operation='delete')
+                self._log(f"删除失败: {describe_target(target)}: {e}\n", level='ERROR')
+
+    def _delete_from_target(self, target, relative_path, is_directory=False):
+        """删除单个目标中的对应文件或目录"""
+        self._delete_many_from_target(target, [(relative_path, is_directory)])
+
+    def _delete_many_from_target(self, target, items):
+        """删除单个目标中的一批文件或目录，源目录中已不存在的父目录在变空后一并删除
+
+        Args:
+            target: 目标配置
+            items: [(相对路径, 是否为目录)]
+        """
+        cleanup = set()
+        for relative_path, _ in items:
+            parent = os.path.dirname(relative_path)
+            while parent and parent not in cleanup and not os.path.isdir(os.path.join(self.source_dir, parent)):
+                cleanup.add(parent)
+                parent = os.path.dirname(parent)
+
+        if target['remote']:
+            def remote(relative_path):
+                return os.path.join(target['path'], relative_path).replace('\\', '/')
+            delete_many_from_remote([remote(rel) for rel, _ in items], target, pool=self.ssh_pool,
+                                    cleanup_dirs=[remote(rel) for rel in cleanup])
+            for relative_path, is_directory in items:
+                self._log(f"已删除远程{'目录' if is_directory else '文件'}: {target['server']}:{remote(relative_path)}\n",
+                          write_to_console=False)
+        else:
+            paths = [(os.path.join(target['path'], rel), is_directory) for rel, is_directory in items]
+            cleanup_dirs = [os.path.join(target['path'], rel) for rel in cleanup]
+            delete_many_from_local([path for path, _ in paths], cleanup_dirs=cleanup_dirs)
+            for path, is_directory in paths:
+                if is_directory:
+                    self.local_copier.forget_dir(path)
+                self._log(f"已删除本地{'目录' if is_directory else '文件'}: {path}\n", write_to_console=False)
+            for path in cleanup_dirs:
+                if not os.path.isdir(path):
+                    self.local_copier.forget_dir(path)
@@ -0,0 +1,152 @@
+import os
+import time
+import hashlib
+import threading
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+
+# 默认哈希算法：BLAKE2b 在 64 位平台上比 MD5 更快，已有的 MD5 记录仍然按 MD5 校验
+DEFAULT_ALGORITHM = 'blake2b'
+# 每次读取的块大小
+CHUNK_SIZE = 1024 * 1024
+
+def new_hash(algorithm):
+    """创建哈希对象
+
+    Args:
+        algorithm: 算法名称，如 'md5'、'blake2b'、'sha256'
+
+    Returns:
+        hashlib 哈希对象
+    """
+    if algorithm == 'md5':
+        return hashlib.md5()
+    if algorithm == 'blake2b':
+        return hashlib.blake2b()
+    return hashlib.new(algorithm)
+
+def hash_file(file_path, algorithm=DEFAULT_ALGORITHM, chunk_size=CHUNK_SIZE):
+    """计算文件的哈希值，参见 hash_file_with_size"""
+    return hash_file_with_size(file_path, algorithm, chunk_size)[0]
+
+def hash_file_with_size(file_path, algorithm=DEFAULT_ALGORITHM, chunk_size=CHUNK_SIZE):
+    """计算文件的哈希值
+
+    使用可复用的缓冲区分块读取（readinto 直接读入缓冲区，不产生额外的拷贝）。
+    不使用 mmap：监控中的文件可能在计算期间被其他进程截断，访问 mmap 中已截断的部分会使整个进程收到 SIGBUS，
+    而分块读取只会读到较短的内容。
+    hashlib 在处理大块数据时会释放 GIL，因此可以在多个线程中并行调用。
+
+    Args:
+        file_path: 文件路径
+        algorithm: 哈希算法
+        chunk_size: 分块大小
+
+    Returns:
+        tuple: (十六进制哈希值, 读取的字节数)
+    """
+    h = new_hash(algorithm)
+    with open(file_path, "rb") as f:
+        buffer = bytearray(chunk_size)
+        view = memoryview(buffer)
+        size = 0
+        while True:
+            n = f.readinto(buffer)
+            if not n:
+                break
+            h.update(view[:n])
+            size += n
+    return h.hexdigest(), size
+
+class HashService:
+    """文件哈希服务，使用线程池并行计算多个文件的哈希值"""
+
+    def __init__(self, algorithm=DEFAULT_ALGORITHM, workers=None, chunk_size=CHUNK_SIZE, io_limiter=None):
+        """
+        Args:
+            algorithm: 默认哈希算法
+            workers: 并行线程数，为 None 时根据 CPU 数量决定
+            chunk_size: 分块大小
+            io_limiter: 多个配置共用的 I/O 信号量，每读取一个文件占用一个名额，为 None 时不限制
+        """
+        self.algorithm = algorithm
+        self.workers = workers or min(8, (os.cpu_count() or 1) + 2)
+        self.chunk_size = chunk_size
+        self.io_limiter = io_limiter if io_limiter is not None else nullcontext()
+        self._executor = None
+        self._lock = threading.Lock()
+        # 累计计算过的文件数和字节数（用于指标统计）
+        self.totals = {'files': 0, 'bytes': 0}
+
+    def _count(self, files, size):
+        with self._lock:
+            self.totals['files'] += files
+            self.totals['bytes'] += size
+
+    def hash_file(self, file_path, algorithm=None):
+        """计算单个文件的哈希值"""
+        with self.io_limiter:
+            digest, size = hash_file_with_size(file_path, algorithm or self.algorithm, self.chunk_size)
+        self._count(1, size)
+        return digest
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="hash")
+            return self._executor
+
+    def hash_files(self, file_paths, algorithm=None):
+        """并行计算多个文件的哈希值
+
+        Args:
+            file_paths: 文件路径列表，也可以是 (路径, 算法) 元组列表
+            algorithm: 未单独指定算法时使用的哈希算法
+
+        Returns:
+            tuple: (结果字典, 统计信息)
+                结果字典为 {路径: 哈希值}，计算失败的文件值为异常对象；
+                统计信息包含 files、bytes、seconds、mb_per_s
+        """
+        jobs = []
+        for item in file_paths:
+            if isinstance(item, tuple):
+                jobs.append(item)
+            else:
+                jobs.append((item, algorithm or self.algorithm))
+
+        def work(job):
+            path, algo = job
+            try:
+                with self.io_limiter:
+                    digest, size = hash_file_with_size(path, algo, self.chunk_size)
+                return path, digest, size
+            except Exception as e:
+                return path, e, 0
+
+        start = time.perf_counter()
+        results = {}
+        total_bytes = 0
+        if len(jobs) <= 1 or self.workers <= 1:
+            outputs = map(work, jobs)
+        else:
+            outputs = self._get_executor().map(work, jobs)
+        for path, digest, size in outputs:
+            results[path] = digest
+            total_bytes += size
+        seconds = time.perf_counter() - start
+        self._count(len(jobs), total_bytes)
+        stats = {
+            'files': len(jobs),
+            'bytes': total_bytes,
+            'seconds': seconds,
+            'mb_per_s': total_bytes / 1024 / 1024 / seconds if seconds > 0 else 0.0
+        }
+        return results, stats
+
+    def close(self):
+        """关闭线程池"""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
@@ -58,6 +58,22 @@ def convert_line_endings(source_path, target_os='linux'):
     # 返回临时文件路径和创建临时文件的标志
     return temp_path, True
 
+def read_converted(source_path, target_os='linux'):
+    """读取文件内容，shell脚本按目标操作系统转换行尾符号（不创建临时文件）
+    
+    Args:
+        source_path: 源文件路径
+        target_os: 目标操作系统，默认为'linux'
+        
+    Returns:
+        tuple: (文件内容, 是否进行了转换)
+    """
+    with open(source_path, 'rb') as f:
+        content = f.read()
+    if not is_linux_shell_script(source_path) or b'\r' not in content:
+        return content, False
+    return content.replace(b'\r\n', b'\n').replace(b'\r', b'\n'), True
+
 def cleanup_temp_file(temp_path, is_temp=False):
     """清理临时文件
     
@@ -0,0 +1,152 @@
+import os
+import errno
+import shutil
+import tempfile
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# Linux 的 FICLONE ioctl：在支持写时复制的文件系统（btrfs、XFS 等）上共享数据块
+FICLONE = 0x40049409
+# 这些错误表示当前文件系统或内核不支持该复制方式，换用下一种方式
+UNSUPPORTED_ERRORS = {errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EBADF, errno.EPERM}
+
+class LocalCopier:
+    """本地目标的文件复制引擎
+
+    依次尝试写时复制克隆（FICLONE）、os.copy_file_range、os.sendfile，最后退化为普通读写。
+    目标文件大小和 mtime_ns 与源文件一致时跳过复制；先写入同目录下的临时文件再原子替换，
+    读取方不会看到写了一半的文件；已经存在的目录会被缓存，不再重复调用 makedirs。
+    """
+
+    def __init__(self):
+        self._known_dirs = set()
+        # 不支持某种复制方式的 (源设备号, 目标设备号)，之后不再尝试
+        self._unsupported = {'reflink': set(), 'copy_file_range': set(), 'sendfile': set()}
+        self._lock = threading.Lock()
+        self.stats = {'reflink': 0, 'copy_file_range': 0, 'sendfile': 0, 'copy': 0, 'skipped': 0, 'bytes': 0}
+
+    def _ensure_dir(self, dir_path):
+        if dir_path in self._known_dirs:
+            return
+        os.makedirs(dir_path, exist_ok=True)
+        with self._lock:
+            self._known_dirs.add(dir_path)
+
+    def forget_dir(self, dir_path):
+        """目录被删除后从缓存中移除（包括其子目录）"""
+        prefix = os.path.join(dir_path, '')
+        with self._lock:
+            self._known_dirs = {d for d in self._known_dirs if d != dir_path and not d.startswith(prefix)}
+
+    def _count(self, method, size):
+        with self._lock:
+            self.stats[method] += 1
+            self.stats['bytes'] += size
+
+    def _mark_unsupported(self, method, devices):
+        with self._lock:
+            self._unsupported[method].add(devices)
+
+    def _copy_data(self, src_fd, dst_fd, size, devices):
+        """把源文件的数据写入目标文件，返回使用的复制方式"""
+        if fcntl is not None and devices not in self._unsupported['reflink']:
+            try:
+                fcntl.ioctl(dst_fd, FICLONE, src_fd)
+                return 'reflink'
+            except OSError as e:
+                if e.errno not in UNSUPPORTED_ERRORS:
+                    raise
+                self._mark_unsupported('reflink', devices)
+
+        for method in ('copy_file_range', 'sendfile'):
+            func = getattr(os, method, None)
+            if func is None or devices in self._unsupported[method]:
+                continue
+            try:
+                offset = 0
+                while offset < size:
+                    if method == 'copy_file_range':
+                        n = func(src_fd, dst_fd, size - offset, offset, offset)
+                    else:
+                        n = func(dst_fd, src_fd, offset, size - offset)
+                    if n == 0:
+                        break
+                    offset += n
+                return method
+            except OSError as e:
+                if e.errno not in UNSUPPORTED_ERRORS:
+                    raise
+                self._mark_unsupported(method, devices)
+                # 换用下一种方式前清空已写入的部分
+                os.ftruncate(dst_fd, 0)
+                os.lseek(dst_fd, 0, os.SEEK_SET)
+
+        with os.fdopen(os.dup(src_fd), 'rb') as src, os.fdopen(os.dup(dst_fd), 'wb') as dst:
+            src.seek(0)
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        return 'copy'
+
+    def copy(self, source_path, destination_path):
+        """复制文件到本地目标，并保留权限和修改时间
+
+        Args:
+            source_path: 源文件路径
+            destination_path: 目标文件路径
+
+        Returns:
+            str: 使用的复制方式（'reflink'、'copy_file_range'、'sendfile'、'copy'），跳过时为 'skipped'
+        """
+        src_st = os.stat(source_path)
+        try:
+            dst_st = os.stat(destination_path)
+            if dst_st.st_size == src_st.st_size and dst_st.st_mtime_ns == src_st.st_mtime_ns:
+                self._count('skipped', 0)
+                return 'skipped'
+        except FileNotFoundError:
+            dst_st = None
+
+        dir_path = os.path.dirname(destination_path)
+        self._ensure_dir(dir_path)
+        try:
+            fd, temp_path = tempfile.mkstemp(dir=dir_path, prefix='.' + os.path.basename(destination_path) + '.', suffix='.tmp')
+        except FileNotFoundError:
+            # 缓存的目录已被删除
+            self.forget_dir(dir_path)
+            self._ensure_dir(dir_path)
+            fd, temp_path = tempfile.mkstemp(dir=dir_path, prefix='.' + os.path.basename(destination_path) + '.', suffix='.tmp')
+
+        try:
+            with open(source_path, 'rb') as src:
+                size = os.fstat(src.fileno()).st_size
+                devices = (src_st.st_dev, dst_st.st_dev if dst_st is not None else os.fstat(fd).st_dev)
+                method = self._copy_data(src.fileno(), fd, size, devices)
+            os.close(fd)
+            fd = None
+            shutil.copystat(source_path, temp_path)
+            os.replace(temp_path, destination_path)
+        except BaseException:
+            if fd is not None:
+                os.close(fd)
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+        self._count(method, size)
+        return method
+
+    def reset_stats(self):
+        """清零复制方式统计"""
+        with self._lock:
+            self.stats = dict.fromkeys(self.stats, 0)
+
+    def summary(self):
+        """复制方式统计的日志文本"""
+        stats = self.stats
+        return (f"克隆 {stats['reflink']}, copy_file_range {stats['copy_file_range']}, "
+                f"sendfile {stats['sendfile']}, 普通复制 {stats['copy']}, 跳过 {stats['skipped']}, "
+                f"{stats['bytes'] / 1024 / 1024:.1f} MB")
@@ -0,0 +1,130 @@
+import os
+import threading
+from collections import deque
+
+# 日志级别
+LEVELS = {'DEBUG': 10, 'INFO': 20, 'WARNING': 30, 'ERROR': 40}
+
+def level_value(level):
+    """日志级别名称或数值转换为数值"""
+    if isinstance(level, int):
+        return level
+    return LEVELS[str(level).upper()]
+
+class LogWriter:
+    """在后台线程中批量写入日志文件
+
+    调用方只把消息放入内存中的环形缓冲区，由后台线程每隔 flush_interval 秒（或缓冲区达到一半、
+    写入 ERROR 消息时）合并写入。缓冲区满时丢弃最旧的消息并在日志中注明丢弃的条数。
+    单个日志文件超过 max_bytes 时轮转为 .1、.2 ...，最多保留 backup_count 个。
+    一个写入器可以同时写多个日志文件，多个处理器共用时按文件路径分组写入。
+    """
+
+    def __init__(self, buffer_size=10000, flush_interval=1.0, max_bytes=10 * 1024 * 1024, backup_count=3):
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._buffer = deque(maxlen=buffer_size)
+        self._dropped = 0
+        self._condition = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._files = {}
+        self._closed = False
+        self._thread = threading.Thread(target=self._loop, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def write(self, path, message, urgent=False):
+        """把消息加入缓冲区（不阻塞在文件 I/O 上）
+
+        Args:
+            path: 日志文件路径
+            message: 日志内容
+            urgent: 是否尽快写入（如错误消息）
+        """
+        with self._condition:
+            if self._closed:
+                # 关闭之后的消息直接追加写入
+                with open(path, "a", encoding='utf-8') as f:
+                    f.write(message)
+                return
+            if len(self._buffer) == self._buffer.maxlen:
+                self._dropped += 1
+            self._buffer.append((path, message))
+            if urgent or len(self._buffer) >= self._buffer.maxlen // 2:
+                self._condition.notify()
+
+    def _loop(self):
+        while True:
+            with self._condition:
+                if not self._buffer and not self._closed:
+                    self._condition.wait(self.flush_interval)
+                closed = self._closed
+            self.flush()
+            if closed:
+                return
+
+    def flush(self):
+        """把缓冲区中的消息写入文件"""
+        # 取出和写入都在写锁内进行，多个线程同时刷新时不会打乱消息顺序
+        with self._write_lock:
+            with self._condition:
+                batch = list(self._buffer)
+                self._buffer.clear()
+                dropped, self._dropped = self._dropped, 0
+            if dropped and batch:
+                batch.insert(0, (batch[0][0], f"[日志缓冲区已满，丢弃了 {dropped} 条消息]\n"))
+            grouped = {}
+            for path, message in batch:
+                grouped.setdefault(path, []).append(message)
+            for path, messages in grouped.items():
+                try:
+                    data = ''.join(messages)
+                    f = self._open(path)
+                    if self.max_bytes and f.tell() and f.tell() + len(data.encode('utf-8')) > self.max_bytes:
+                        self._rotate(path)
+                        f = self._open(path)
+                    f.write(data)
+                    f.flush()
+                except Exception as e:
+                    print(f"写入日志文件失败: {e}")
+
+    def _open(self, path):
+        f = self._files.get(path)
+        if f is None:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            f = self._files[path] = open(path, "a", encoding='utf-8')
+        return f
+
+    def _rotate(self, path):
+        """关闭当前日志文件并依次重命名为 .1、.2 ..."""
+        self._files.pop(path).close()
+        if self.backup_count <= 0:
+            os.remove(path)
+            return
+        for i in range(self.backup_count - 1, 0, -1):
+            if os.path.exists(f"{path}.{i}"):
+                os.replace(f"{path}.{i}", f"{path}.{i + 1}")
+        os.replace(path, f"{path}.1")
+
+    def close(self):
+        """写入剩余的消息并关闭文件"""
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+        self.flush()
+        with self._write_lock:
+            for f in self._files.values():
+                f.close()
+            self._files = {}
+
+def create_log_writer(config):
+    """根据配置创建日志写入器"""
+    return LogWriter(
+        buffer_size=config.get('log_buffer_size', 10000),
+        flush_interval=config.get('log_flush_interval', 1.0),
+        max_bytes=config.get('log_max_bytes', 10 * 1024 * 1024),
+        backup_count=config.get('log_backup_count', 3)
+    )
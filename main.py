@@ -1,13 +1,116 @@
-from watchdog.observers import Observer
 import time
 import sys
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from file_handler import FileHandler
-from sync_utils import should_ignore_file
+from metrics import start_exporters
+from log_writer import create_log_writer
+from watch_manager import WatchManager
+
+def start_config(config_name, config, start_message, log_writer=None, io_limiter=None, stopping=None,
+                 watch_manager=None):
+    """创建处理器并执行该配置的预览或初始同步，模式 3/4 在自己的初始同步完成后立即开始监控
+
+    Args:
+        config_name: 配置名称
+        config: 配置字典
+        start_message: 写入日志的启动信息
+        log_writer: 共用的日志写入器
+        io_limiter: 共用的 I/O 信号量
+        stopping: 设置后不再启动监控的 threading.Event
+        watch_manager: 所有配置共用的文件监控，为 None 时单独创建
+
+    Returns:
+        tuple: (处理器, 文件监控)，不需要监控时文件监控为 None
+    """
+    stopping = stopping or threading.Event()
+    # 确保日志目录存在
+    log_file = os.path.abspath(config['log_file'])
+    os.makedirs(os.path.dirname(log_file), exist_ok=True)
+    
+    event_handler = FileHandler(config, config_name, log_writer=log_writer, io_limiter=io_limiter)
+    
+    try:
+        return event_handler, _run_config(event_handler, config_name, config, start_message, log_file, stopping,
+                                          watch_manager)
+    except Exception:
+        event_handler.close()
+        raise
+
+def _run_config(event_handler, config_name, config, start_message, log_file, stopping, watch_manager):
+    """执行配置的预览或初始同步，需要时启动监控（start_config 的主体）"""
+    # 将启动信息写入日志
+    config_start_message = start_message + f"日志文件: {log_file}\n"  # 为每个配置添加其对应的日志文件路径
+    event_handler._log(config_start_message)
+    
+    # 预览模式 (mode = 1) 或 预览并更新同步时间模式 (mode = 11)
+    if config['mode'] in [1, 11]:
+        print(f"\n=== 配置 '{config_name}' 预览 ===")
+        event_handler.preview_sync_files()
+        
+        if config['mode'] == 11:
+            print(f"\n正在更新文件同步时间...")
+            # 扫描一次，并行计算哈希后一次性写入同步记录，签名未变的记录直接沿用
+            stats = event_handler.build_baseline(reuse=config.get('baseline_reuse', True))
+            log_message = f"已记录 {stats['files']} 个文件: 沿用 {stats['reused']} 个, "
+            log_message += f"计算哈希 {stats['hashed']} 个 ({stats['bytes'] / 1024 / 1024:.1f} MB)"
+            if stats['failed']:
+                log_message += f", 失败 {stats['failed']} 个"
+            log_message += f", 用时 {stats['seconds']:.1f} 秒\n"
+            event_handler._log(log_message)
+            print("同步时间更新完成！")
+        return None
+    
+    # 一次性智能同步模式 (mode = 2)
+    if config['mode'] == 2:
+        print(f"\n=== 配置 '{config_name}' 一次性智能同步 ===")
+        event_handler.sync_all_files(check_time=True)
+        return None
+        
+    # 智能同步并监控模式 (mode = 3)
+    if config['mode'] == 3:
+        print(f"\n=== 配置 '{config_name}' 智能同步并监控 ===")
+        event_handler.sync_all_files(check_time=True)
+    
+    # 完整同步并监控模式 (mode = 4)
+    if config['mode'] == 4:
+        print(f"\n=== 配置 '{config_name}' 完整同步并监控 ===")
+        event_handler.sync_all_files(check_time=False)
+    
+    # 对 mode 3 和 4 启动文件监控（启动过程中被中断时不再启动）
+    if config['mode'] in [3, 4] and not stopping.is_set():
+        event_handler.start()
+        if watch_manager is None:
+            watch_manager = WatchManager()
+        watch_manager.add(event_handler)
+        
+        log_message = f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 配置 '{config_name}' 监控已启动:\n"
+        log_message += f"监控目录: {config['source_dir']}\n"
+        # 格式化目标路径显示
+        target_paths = []
+        for target in config['targets']:
+            if isinstance(target, tuple):
+                username, ip, path, _, port = target[:5]
+                if port:
+                    target_paths.append(f"{username}@{ip}:{path}")
+                else:
+                    target_paths.append(f"{username}@{ip}:{path}")
+            else:
+                target_paths.append(str(target))
+        log_message += f"目标路径: {', '.join(target_paths)}\n"
+        log_message += "-" * 60 + "\n"
+        event_handler._log(log_message)
+        return watch_manager
+    return None
 
 def main(configs):
     """主函数，处理文件同步和监控
+
+    各配置的初始同步并行进行（同时启动的配置数和共用的 I/O 名额可配置），
+    每个配置在自己的初始同步完成后立即开始监控，不等待其他配置。
+    所有配置共用一个观察者，只监控未被排除的目录。
     Args:
         configs: 配置字典
     """
@@ -17,107 +120,111 @@ def main(configs):
     start_message += f"运行时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
     start_message += f"运行脚本: {script_path}\n"
 
-    # 创建观察者和处理器列表
-    observers = []
+    # 所有配置共用的文件监控和处理器列表
+    watch_manager = WatchManager()
+    watching = False
     handlers = []
     
-    # 为每个配置创建观察者和处理器
-    for config_name, config in configs.items():
-        # 如果 mode 为 0，跳过此配置
-        if config['mode'] == 0:
-            continue
-            
-        # 确保日志目录存在
-        log_file = os.path.abspath(config['log_file'])
-        os.makedirs(os.path.dirname(log_file), exist_ok=True)
-        
-        event_handler = FileHandler(config, config_name)
-        handlers.append(event_handler)
-        
-        # 将启动信息写入日志
-        config_start_message = start_message + f"日志文件: {log_file}\n"  # 为每个配置添加其对应的日志文件路径
-        event_handler._log(config_start_message)
-        
-        # 预览模式 (mode = 1) 或 预览并更新同步时间模式 (mode = 11)
-        if config['mode'] in [1, 11]:
-            print(f"\n=== 配置 '{config_name}' 预览 ===")
-            event_handler.preview_sync_files()
-            
-            if config['mode'] == 11:
-                print(f"\n正在更新文件同步时间...")
-                for root, dirs, files in os.walk(config['source_dir']):
-                    for file in files:
-                        file_path = os.path.join(root, file)
-                        if not should_ignore_file(file_path, config['source_dir'], 
-                                               config['ignore_patterns'], 
-                                               config['only_sync_files'], 
-                                               config['log_file']):
-                            event_handler._save_sync_time(file_path)
-                print("同步时间更新完成！")
-            continue
-        
-        # 一次性智能同步模式 (mode = 2)
-        if config['mode'] == 2:
-            print(f"\n=== 配置 '{config_name}' 一次性智能同步 ===")
-            event_handler.sync_all_files(check_time=True)
-            continue
-            
-        # 智能同步并监控模式 (mode = 3)
-        if config['mode'] == 3:
-            print(f"\n=== 配置 '{config_name}' 智能同步并监控 ===")
-            event_handler.sync_all_files(check_time=True)
-        
-        # 完整同步并监控模式 (mode = 4)
-        if config['mode'] == 4:
-            print(f"\n=== 配置 '{config_name}' 完整同步并监控 ===")
-            event_handler.sync_all_files(check_time=False)
-        
-        # 对 mode 3 和 4 启动文件监控
-        if config['mode'] in [3, 4]:
-            observer = Observer()
-            observer.schedule(event_handler, config['source_dir'], recursive=True)
-            observer.start()
-            observers.append(observer)
-            
-            log_message = f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 配置 '{config_name}' 监控已启动:\n"
-            log_message += f"监控目录: {config['source_dir']}\n"
-            # 格式化目标路径显示
-            target_paths = []
-            for target in config['targets']:
-                if isinstance(target, tuple):
-                    username, ip, path, _, port = target
-                    if port:
-                        target_paths.append(f"{username}@{ip}:{path}")
-                    else:
-                        target_paths.append(f"{username}@{ip}:{path}")
-                else:
-                    target_paths.append(str(target))
-            log_message += f"目标路径: {', '.join(target_paths)}\n"
-            log_message += "-" * 60 + "\n"
-            event_handler._log(log_message)
+    # 指标输出（HTTP 端点或定期写入的 JSON 文件），在初始同步之前启动
+    exporters = start_exporters([config for config in configs.values() if config['mode'] in [2, 3, 4]])
+    
+    # 所有处理器共用一个后台日志写入器（多个配置通常写同一个日志文件），按第一个启用的配置设置缓冲和轮转
+    active_configs = [(name, config) for name, config in configs.items() if config['mode'] != 0]
+    settings = active_configs[0][1] if active_configs else {}
+    log_writer = create_log_writer(settings)
+    # 所有配置共用的 I/O 名额（同时哈希或传输的文件数）
+    io_concurrency = settings.get('io_concurrency', 8)
+    io_limiter = threading.BoundedSemaphore(io_concurrency) if io_concurrency else None
+    stopping = threading.Event()
+    startup_times = {}
+    main_start = time.perf_counter()
+
+    def run(config_name, config):
+        start = time.perf_counter()
+        handler, watcher = start_config(config_name, config, start_message, log_writer, io_limiter, stopping,
+                                        watch_manager)
+        return handler, watcher, time.perf_counter() - start
+
+    def collect(config_name, result):
+        nonlocal watching
+        try:
+            handler, watcher, seconds = result()
+        except Exception as e:
+            print(f"配置 '{config_name}' 启动失败: {e}")
+            startup_times[config_name] = None
+            return
+        handlers.append(handler)
+        if watcher is not None:
+            watching = True
+        startup_times[config_name] = (seconds, time.perf_counter() - main_start)
+
+    # 预览模式输出目录树，在主线程中依次执行，避免与其他配置的输出交错
+    previews = [(name, config) for name, config in active_configs if config['mode'] in [1, 11]]
+    syncs = [(name, config) for name, config in active_configs if config['mode'] not in [1, 11]]
+    interrupted = False
+    futures = {}
+    executor = ThreadPoolExecutor(max_workers=max(1, settings.get('startup_concurrency', 4)),
+                                  thread_name_prefix="startup")
+    try:
+        for config_name, config in previews:
+            collect(config_name, lambda: run(config_name, config))
+        futures = {executor.submit(run, name, config): name for name, config in syncs}
+        for future in as_completed(futures):
+            collect(futures[future], future.result)
+    except KeyboardInterrupt:
+        # 启动过程中被中断：不再启动新的配置和监控，等待正在进行的初始同步结束
+        interrupted = True
+        stopping.set()
+        print("\n正在停止，等待进行中的初始同步结束...")
+        executor.shutdown(wait=True, cancel_futures=True)
+        for future, config_name in futures.items():
+            if not future.cancelled() and config_name not in startup_times:
+                collect(config_name, future.result)
+    executor.shutdown(wait=True)
+
+    # 各配置的启动耗时
+    if len(startup_times) > 1:
+        print("\n=== 启动耗时 ===")
+        for config_name, times in startup_times.items():
+            if times is None:
+                print(f"  {config_name}: 启动失败")
+            else:
+                print(f"  {config_name}: 模式 {configs[config_name]['mode']}, 用时 {times[0]:.1f} 秒, "
+                      f"完成于启动后 {times[1]:.1f} 秒")
     
     # 如果所有配置都是预览模式或者被跳过，直接退出
-    if not observers:
+    if not watching and not interrupted:
+        for handler in handlers:
+            handler.close()
+        for exporter in exporters:
+            exporter.close()
+        log_writer.close()
         sys.exit(0)
     
     try:
-        while True:
+        while not interrupted:
             time.sleep(1)
     except KeyboardInterrupt:
-        # 停止所有观察者
-        for observer in observers:
-            observer.stop()
-        
-        # 记录停止信息
-        for handler in handlers:
-            if not configs[handler.config_name]['mode'] == 1:  # 只为非预览模式的配置记录停止信息
-                log_message = f"\n[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 监控已停止\n"
-                log_message += "-" * 60 + "\n"
-                handler._log(log_message)
+        pass
+    # 停止文件监控
+    watch_manager.stop()
     
-    # 等待所有观察者完成
-    for observer in observers:
-        observer.join()
+    # 记录停止信息
+    for handler in handlers:
+        if not configs[handler.config_name]['mode'] == 1:  # 只为非预览模式的配置记录停止信息
+            log_message = f"\n[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 监控已停止\n"
+            log_message += "-" * 60 + "\n"
+            handler._log(log_message)
+    
+    # 等待文件监控结束
+    watch_manager.join()
+
+    # 关闭处理器持有的SSH连接（包括无密码目标的 ssh 主连接）
+    for handler in handlers:
+        handler.close()
+    for exporter in exporters:
+        exporter.close()
+    log_writer.close()
 
 if __name__ == "__main__":
     print("请通过config文件运行此程序")
@@ -0,0 +1,164 @@
+import os
+import json
+import shlex
+from line_ending_handler import is_linux_shell_script, read_converted
+from hash_service import new_hash
+from tree_scanner import scan_tree
+
+# 在远程目标上执行的清单脚本：从标准输入读取本地文件的 {相对路径: [大小, 修改时间(秒)]}，
+# 遍历目标目录，输出每个文件的 [相对路径, 大小, 修改时间(纳秒), MD5]。
+# 只有大小相同但修改时间不同的文件才计算 MD5，其余为 null。
+MANIFEST_HELPER = r'''
+import sys, os, json, hashlib
+root = sys.argv[1]
+local = json.load(sys.stdin)
+out = sys.stdout
+for dirpath, dirnames, filenames in os.walk(root):
+    for name in filenames:
+        path = os.path.join(dirpath, name)
+        rel = os.path.relpath(path, root).replace(os.sep, "/")
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        digest = None
+        sig = local.get(rel)
+        if sig is not None and sig[0] == st.st_size and sig[1] != st.st_mtime_ns // 1000000000:
+            h = hashlib.md5()
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1048576), b""):
+                    h.update(chunk)
+            digest = h.hexdigest()
+        out.write(json.dumps([rel, st.st_size, st.st_mtime_ns, digest]) + "\n")
+'''
+
+def manifest_key(relative_path):
+    """清单中统一使用 / 分隔的相对路径"""
+    return relative_path.replace(os.sep, '/')
+
+def _converted_content(file_path):
+    """远程目标上 shell 脚本会转换行尾，返回转换后的内容（无需转换时返回 None）"""
+    if not is_linux_shell_script(file_path):
+        return None
+    content, converted = read_converted(file_path)
+    return content if converted else None
+
+def local_signatures(entries, remote):
+    """生成本地文件在目标上应有的 {清单键: [大小, 修改时间(秒)]}
+
+    Args:
+        entries: scan_tree 返回的 ScanEntry 列表
+        remote: 目标是否为远程（远程目标上的 shell 脚本会转换行尾，大小可能不同）
+    """
+    signatures = {}
+    for entry in entries:
+        size = entry.size
+        if remote:
+            converted = _converted_content(entry.path)
+            if converted is not None:
+                size = len(converted)
+        signatures[manifest_key(entry.relative_path)] = [size, entry.mtime_ns // 1_000_000_000]
+    return signatures
+
+def collect_remote_manifest(session, root, signatures):
+    """在远程目标上一次性收集整个目录树的清单
+
+    Args:
+        session: 会话对象
+        root: 远程目标目录
+        signatures: local_signatures 的结果，用于决定哪些文件需要计算 MD5
+
+    Returns:
+        dict: {清单键: {'size': ..., 'mtime_ns': ..., 'md5': ...}}
+    """
+    command = f"mkdir -p {shlex.quote(root)} && python3 -c {shlex.quote(MANIFEST_HELPER)} {shlex.quote(root)}"
+    exit_code, out, err = session.run(command, stdin=json.dumps(signatures).encode())
+    if exit_code != 0:
+        raise Exception(f"获取远程文件清单失败 (退出码: {exit_code}): {err.strip()}")
+    manifest = {}
+    for line in out.splitlines():
+        rel, size, mtime_ns, digest = json.loads(line)
+        manifest[rel] = {'size': size, 'mtime_ns': mtime_ns, 'md5': digest}
+    return manifest
+
+def collect_local_manifest(root, signatures, hasher):
+    """对本地目标目录做一次 scandir 遍历，收集清单
+
+    Args:
+        root: 本地目标目录
+        signatures: local_signatures 的结果
+        hasher: HashService，用于并行计算需要比较内容的文件的 MD5
+    """
+    manifest = {}
+    if not os.path.isdir(root):
+        return manifest
+    to_hash = []
+    for entry in scan_tree(root, workers=hasher.workers):
+        key = manifest_key(entry.relative_path)
+        manifest[key] = {'size': entry.size, 'mtime_ns': entry.mtime_ns, 'md5': None, 'path': entry.path}
+        sig = signatures.get(key)
+        if sig is not None and sig[0] == entry.size and sig[1] != entry.mtime_ns // 1_000_000_000:
+            to_hash.append(entry.path)
+    if to_hash:
+        digests, _ = hasher.hash_files(to_hash, 'md5')
+        for info in manifest.values():
+            digest = digests.get(info['path'])
+            if digest is not None and not isinstance(digest, Exception):
+                info['md5'] = digest
+    return manifest
+
+def plan_differences(entries, manifest, hasher, remote, matcher=None):
+    """比较本地文件与目标清单，找出需要传输的文件和目标上多余的文件
+
+    大小不同直接传输；大小相同且修改时间（秒）相同视为一致；否则比较 MD5。
+
+    Args:
+        entries: scan_tree 返回的 ScanEntry 列表
+        manifest: 目标清单
+        hasher: HashService
+        remote: 目标是否为远程
+        matcher: PathMatcher，目标上被忽略规则匹配的多余文件不算作孤立文件
+
+    Returns:
+        tuple: (需要传输的 ScanEntry 列表, 目标上多余文件的相对路径列表)
+    """
+    signatures = local_signatures(entries, remote)
+    to_transfer = []
+    to_compare = []
+    for entry in entries:
+        key = manifest_key(entry.relative_path)
+        info = manifest.get(key)
+        size, mtime_s = signatures[key]
+        if info is None or info['size'] != size:
+            to_transfer.append(entry)
+        elif info['mtime_ns'] // 1_000_000_000 == mtime_s:
+            continue
+        elif info['md5'] is None:
+            to_transfer.append(entry)
+        else:
+            to_compare.append((entry, info['md5']))
+
+    if to_compare:
+        plain = [entry.path for entry, _ in to_compare
+                 if not (remote and is_linux_shell_script(entry.path))]
+        digests, _ = hasher.hash_files(plain, 'md5')
+        for entry, target_md5 in to_compare:
+            digest = digests.get(entry.path)
+            if digest is None:
+                # 需要转换行尾的脚本按转换后的内容比较
+                h = new_hash('md5')
+                h.update(read_converted(entry.path)[0])
+                digest = h.hexdigest()
+            if digest != target_md5:
+                to_transfer.append(entry)
+
+    local_keys = set(signatures)
+    orphans = []
+    for key in manifest:
+        if key in local_keys:
+            continue
+        relative_path = key.replace('/', os.sep)
+        if matcher is not None and matcher.ignores_relative(relative_path):
+            continue
+        orphans.append(relative_path)
+    return to_transfer, orphans
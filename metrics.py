@@ -0,0 +1,239 @@
+import os
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 延迟类直方图的默认分桶（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(labels, extra=None):
+    items = list(labels) + (list(extra.items()) if extra else [])
+    if not items:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in items) + '}'
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class MetricsRegistry:
+    """进程内的计数器、仪表和直方图
+
+    所有 FileHandler 共用一个注册表（以 config 标签区分），通过 MetricsServer 以 Prometheus
+    文本格式输出，或由 StatsFileWriter 定期写入 JSON 文件。仪表可以注册为回调，在输出时才取值。
+    """
+
+    def __init__(self, prefix='file_sync_'):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        # 名称 -> {'type': ..., 'help': ..., 'values': {标签键: 值}, 'buckets': ...}
+        self._metrics = {}
+        # 名称 -> [(标签, 回调)]
+        self._callbacks = {}
+
+    def _metric(self, name, kind, help_text, buckets=None):
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = {'type': kind, 'help': help_text, 'values': {}, 'buckets': buckets}
+        return metric
+
+    def inc(self, name, value=1, help_text='', **labels):
+        """计数器增加 value"""
+        with self._lock:
+            values = self._metric(name, 'counter', help_text)['values']
+            key = _label_key(labels)
+            values[key] = values.get(key, 0) + value
+
+    def set(self, name, value, help_text='', **labels):
+        """设置仪表的值"""
+        with self._lock:
+            self._metric(name, 'gauge', help_text)['values'][_label_key(labels)] = value
+
+    def observe(self, name, value, help_text='', buckets=DEFAULT_BUCKETS, **labels):
+        """记录一次直方图观测值"""
+        with self._lock:
+            metric = self._metric(name, 'histogram', help_text, buckets)
+            key = _label_key(labels)
+            state = metric['values'].get(key)
+            if state is None:
+                state = metric['values'][key] = {'counts': [0] * len(metric['buckets']), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(metric['buckets']):
+                if value <= bound:
+                    state['counts'][i] += 1
+            state['sum'] += value
+            state['count'] += 1
+
+    def register_callback(self, name, kind, func, help_text='', **labels):
+        """注册在输出时取值的计数器或仪表（如队列长度）"""
+        with self._lock:
+            self._metric(name, kind, help_text)
+            self._callbacks.setdefault(name, []).append((labels, func))
+
+    def unregister(self, **labels):
+        """移除标签匹配的回调（处理器关闭时调用）"""
+        with self._lock:
+            for name, callbacks in self._callbacks.items():
+                callbacks[:] = [(l, f) for l, f in callbacks
+                                if any(l.get(k) != v for k, v in labels.items())]
+
+    def _collect(self):
+        """返回 {名称: (类型, 说明, {标签键: 值}, 分桶)} 的快照"""
+        with self._lock:
+            snapshot = {}
+            for name, metric in self._metrics.items():
+                values = {key: (dict(value, counts=list(value['counts'])) if isinstance(value, dict) else value)
+                          for key, value in metric['values'].items()}
+                snapshot[name] = (metric['type'], metric['help'], values, metric['buckets'])
+            callbacks = {name: list(items) for name, items in self._callbacks.items()}
+        for name, items in callbacks.items():
+            for labels, func in items:
+                try:
+                    snapshot[name][2][_label_key(labels)] = func()
+                except Exception:
+                    continue
+        return snapshot
+
+    def render_prometheus(self):
+        """Prometheus 文本格式"""
+        lines = []
+        for name, (kind, help_text, values, buckets) in sorted(self._collect().items()):
+            full_name = self.prefix + name
+            if help_text:
+                lines.append(f"# HELP {full_name} {help_text}")
+            lines.append(f"# TYPE {full_name} {kind}")
+            for key, value in sorted(values.items()):
+                if kind == 'histogram':
+                    for bound, count in zip(buckets, value['counts']):
+                        lines.append(f"{full_name}_bucket{_format_labels(key, {'le': _format_value(bound)})} {count}")
+                    lines.append(f"{full_name}_bucket{_format_labels(key, {'le': '+Inf'})} {value['count']}")
+                    lines.append(f"{full_name}_sum{_format_labels(key)} {_format_value(value['sum'])}")
+                    lines.append(f"{full_name}_count{_format_labels(key)} {value['count']}")
+                else:
+                    lines.append(f"{full_name}{_format_labels(key)} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        """JSON 可序列化的快照"""
+        result = {}
+        for name, (kind, _, values, buckets) in sorted(self._collect().items()):
+            entries = []
+            for key, value in sorted(values.items()):
+                entry = {'labels': dict(key)}
+                if kind == 'histogram':
+                    entry.update({'count': value['count'], 'sum': value['sum'],
+                                  'avg': value['sum'] / value['count'] if value['count'] else 0.0,
+                                  'buckets': dict(zip((str(b) for b in buckets), value['counts']))})
+                else:
+                    entry['value'] = value
+                entries.append(entry)
+            result[self.prefix + name] = {'type': kind, 'values': entries}
+        return {'time': time.time(), 'metrics': result}
+
+# 所有处理器共用的注册表
+REGISTRY = MetricsRegistry()
+
+class MetricsServer:
+    """在本地 HTTP 端口上输出指标：/metrics 为 Prometheus 文本格式，/stats.json 为 JSON"""
+
+    def __init__(self, registry=REGISTRY, port=9105, host='127.0.0.1'):
+        registry_ref = registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.startswith('/metrics'):
+                    body = registry_ref.render_prometheus().encode()
+                    content_type = 'text/plain; version=0.0.4; charset=utf-8'
+                elif self.path.startswith('/stats.json'):
+                    body = json.dumps(registry_ref.snapshot(), ensure_ascii=False).encode()
+                    content_type = 'application/json; charset=utf-8'
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self._thread = threading.Thread(target=self.server.serve_forever, name="metrics-http", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+class StatsFileWriter:
+    """定期把指标快照写入 JSON 文件（先写临时文件再替换）"""
+
+    def __init__(self, path, registry=REGISTRY, interval=10):
+        self.path = os.path.abspath(path)
+        self.registry = registry
+        self.interval = interval
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name="metrics-file", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def write(self):
+        """立即写入一次"""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.registry.snapshot(), f, indent=2, ensure_ascii=False)
+        os.replace(temp_path, self.path)
+
+    def _loop(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.write()
+            except Exception as e:
+                print(f"写入统计文件失败: {e}")
+
+    def close(self):
+        self._stop_event.set()
+        self._thread.join()
+        try:
+            self.write()
+        except Exception as e:
+            print(f"写入统计文件失败: {e}")
+
+def start_exporters(configs, registry=REGISTRY):
+    """根据配置启动指标输出（取第一个设置了 metrics_port / metrics_file 的配置）
+
+    Returns:
+        list: 已启动的输出对象（退出时调用 close）
+    """
+    exporters = []
+    port = next((c.get('metrics_port') for c in configs if c.get('metrics_port')), None)
+    path = next((c.get('metrics_file') for c in configs if c.get('metrics_file')), None)
+    if port:
+        host = next((c.get('metrics_host') for c in configs if c.get('metrics_port')), None) or '127.0.0.1'
+        try:
+            server = MetricsServer(registry, port, host).start()
+            print(f"指标服务已启动: http://{host}:{server.port}/metrics")
+            exporters.append(server)
+        except OSError as e:
+            print(f"启动指标服务失败: {e}")
+    if path:
+        interval = next((c.get('metrics_interval') for c in configs if c.get('metrics_file')), None) or 10
+        exporters.append(StatsFileWriter(path, registry, interval).start())
+    return exporters
@@ -9,7 +9,7 @@
 新格式: {"file_path": {"timestamp": "timestamp", "md5": "md5_hash"}}
 
 使用方法:
-    python migrate_sync_records.py [同步记录文件路径]
+    python migrate_sync_records.py [同步记录文件路径] [--sqlite 数据库路径] [--workers 线程数]
 
 如果不提供路径参数，将使用默认路径。
 """
@@ -17,115 +17,296 @@
 import os
 import sys
 import json
-import hashlib
-from datetime import datetime
+import time
+import argparse
+from hash_service import HashService
+from sync_state import SqliteSyncState, normalize_record
 
-def calculate_md5(file_path):
-    """计算文件的MD5哈希值
-    
-    Args:
-        file_path: 文件路径
-        
-    Returns:
-        str: 文件的MD5哈希值
+# 每次从文件读取的字符数
+READ_SIZE = 1024 * 1024
+# 每批处理（并行计算哈希后写出）的记录数
+CHUNK_SIZE = 1000
+
+class _JsonStream:
+    """从文件中逐段读取 JSON 文本，按需补充缓冲区"""
+
+    def __init__(self, f):
+        self.f = f
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self):
+        if self.eof:
+            return False
+        data = self.f.read(READ_SIZE)
+        if not data:
+            self.eof = True
+            return False
+        # 丢弃已经解析过的部分
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """跳过空白，返回下一个字符（文件结束时返回空字符串）"""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"JSON 格式错误: 位置 {self.pos} 处应为 '{char}'")
+        self.pos += 1
+
+    def value(self):
+        """解析一个完整的 JSON 值（字符串或对象），缓冲区不完整时继续读取"""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+                # 值刚好在缓冲区末尾结束时，可能是被截断的数字等，读入更多内容后再确认
+                if end < len(self.buf) or self.eof or not self._fill():
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+
+def iter_json_records(f):
+    """流式解析 {配置名: {文件路径: 记录}} 格式的同步记录文件
+
+    Yields:
+        tuple: (配置名, 文件路径, 记录)；没有记录的配置产生一个 (配置名, None, None)
     """
-    hash_md5 = hashlib.md5()
-    with open(file_path, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hash_md5.update(chunk)
-    return hash_md5.hexdigest()
+    stream = _JsonStream(f)
+    if stream.peek() == '':
+        return
+    stream.expect('{')
+    if stream.peek() == '}':
+        return
+    while True:
+        config_name = stream.value()
+        stream.expect(':')
+        stream.expect('{')
+        if stream.peek() == '}':
+            stream.pos += 1
+            yield config_name, None, None
+        else:
+            while True:
+                file_path = stream.value()
+                stream.expect(':')
+                yield config_name, file_path, stream.value()
+                if stream.peek() == ',':
+                    stream.pos += 1
+                    continue
+                stream.expect('}')
+                break
+        if stream.peek() == ',':
+            stream.pos += 1
+            continue
+        stream.expect('}')
+        return
+
+class _JsonWriter:
+    """逐条写出 JSON 格式的同步记录（每条记录一行）"""
+
+    def __init__(self, f):
+        self.f = f
+        self.config_name = None
+        self.first_record = True
+        f.write('{')
+
+    def accepts(self, config_name):
+        return True
+
+    def write(self, config_name, file_path, record):
+        if config_name != self.config_name:
+            if self.config_name is not None:
+                self.f.write('\n  },')
+            self.f.write(f"\n  {json.dumps(config_name, ensure_ascii=False)}: {{")
+            self.config_name = config_name
+            self.first_record = True
+        if file_path is None:
+            return
+        self.f.write(('' if self.first_record else ',') + '\n    ' + json.dumps(file_path, ensure_ascii=False)
+                     + ': ' + json.dumps(record, ensure_ascii=False))
+        self.first_record = False
+
+    def close(self):
+        if self.config_name is not None:
+            self.f.write('\n  }')
+        self.f.write('\n}\n')
+
+class _SqliteWriter:
+    """把记录直接写入 SQLite 同步记录数据库（按配置分别标记为已导入）
+
+    数据库中已有记录（或已导入过）的配置整体跳过：其中的记录可能比 JSON 文件中的更新，不能被覆盖。
+    """
+
+    def __init__(self, db_path, source_path):
+        self.db_path = db_path
+        self.source_path = source_path
+        self.store = None
+        # 配置名 -> 是否写入该配置的记录
+        self._accepted = {}
 
-def migrate_sync_records(sync_file_path):
+    def accepts(self, config_name):
+        """该配置的记录是否会被写入（不写入的记录不需要计算哈希）"""
+        if config_name not in self._accepted:
+            store = SqliteSyncState(self.db_path, config_name)
+            try:
+                existing = store.is_imported() or store.has_records()
+            finally:
+                store.close()
+            if existing:
+                print(f"跳过配置 {config_name}: 数据库中已有该配置的同步记录")
+            self._accepted[config_name] = not existing
+        return self._accepted[config_name]
+
+    def write(self, config_name, file_path, record):
+        if not self.accepts(config_name):
+            return
+        if self.store is None or self.store.config_name != config_name:
+            self._close_store()
+            self.store = SqliteSyncState(self.db_path, config_name)
+            self._batch = self.store.batch()
+            self._batch.__enter__()
+        if file_path is None:
+            return
+        self.store.upsert(file_path, normalize_record(record))
+
+    def _close_store(self):
+        if self.store is not None:
+            self._batch.__exit__(None, None, None)
+            self.store.mark_imported(self.source_path)
+            self.store.close()
+            self.store = None
+
+    def close(self):
+        self._close_store()
+
+def migrate_sync_records(sync_file_path, sqlite_path=None, workers=None, chunk_size=CHUNK_SIZE):
     """迁移同步记录格式
-    
+
+    流式读取记录文件，旧格式（只有时间戳）的记录分批并行计算 MD5，结果逐批写入临时文件，
+    全部完成后原子替换原文件；指定 sqlite_path 时直接写入 SQLite 同步记录数据库，原文件保持不变，
+    数据库中已有记录的配置会被跳过（不覆盖较新的记录）。
+
     Args:
         sync_file_path: 同步记录文件路径
-        
+        sqlite_path: SQLite 数据库路径，为 None 时写回 JSON 文件
+        workers: 计算哈希的线程数，None 表示按CPU数量自动决定
+        chunk_size: 每批处理的记录数
+
     Returns:
         bool: 是否成功迁移
     """
     if not os.path.exists(sync_file_path):
         print(f"错误: 同步记录文件不存在: {sync_file_path}")
         return False
-        
+    if os.path.getsize(sync_file_path) == 0:
+        print("同步记录文件为空")
+        return False
+
+    temp_path = sync_file_path + '.tmp'
+    hasher = HashService(algorithm='md5', workers=workers)
+    configs = set()
+    stats = {'records': 0, 'migrated': 0, 'failed': 0, 'missing': 0, 'skipped': 0}
+    start = time.perf_counter()
+    out = None
     try:
-        # 读取同步记录
+        if sqlite_path:
+            writer = _SqliteWriter(os.path.abspath(sqlite_path), os.path.abspath(sync_file_path))
+        else:
+            out = open(temp_path, 'w', encoding='utf-8')
+            writer = _JsonWriter(out)
+
+        def flush(chunk):
+            # 不会写出的记录（目标数据库中已有该配置）不需要计算哈希
+            accepted = [item for item in chunk if writer.accepts(item[0])]
+            stats['skipped'] += sum(1 for _, path, _ in chunk if path is not None) - \
+                sum(1 for _, path, _ in accepted if path is not None)
+            chunk = accepted
+            # 旧格式的记录中文件仍存在的并行计算 MD5
+            legacy = [path for _, path, info in chunk if isinstance(info, str) and os.path.isfile(path)]
+            digests, _ = hasher.hash_files(legacy) if legacy else ({}, None)
+            for config_name, file_path, sync_info in chunk:
+                if isinstance(sync_info, str):
+                    digest = digests.get(file_path)
+                    if digest is None:
+                        stats['missing'] += 1
+                        stats['migrated'] += 1
+                        digest = ''
+                    elif isinstance(digest, Exception):
+                        print(f"  ✗ 计算MD5失败: {digest}, 文件: {file_path}")
+                        stats['failed'] += 1
+                        digest = ''
+                    else:
+                        stats['migrated'] += 1
+                    sync_info = {'timestamp': sync_info, 'md5': digest}
+                writer.write(config_name, file_path, sync_info)
+
         with open(sync_file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-        if not content:
-            print("同步记录文件为空")
-            return False
-            
-        all_sync_times = json.loads(content)
-        if not all_sync_times:
+            chunk = []
+            chunks = 0
+            for config_name, file_path, sync_info in iter_json_records(f):
+                configs.add(config_name)
+                chunk.append((config_name, file_path, sync_info))
+                if file_path is None:
+                    continue
+                stats['records'] += 1
+                if len(chunk) >= chunk_size:
+                    flush(chunk)
+                    chunk = []
+                    chunks += 1
+                    if chunks % 100 == 0:
+                        elapsed = time.perf_counter() - start
+                        print(f"已处理 {stats['records']} 条记录 ({stats['records'] / elapsed:.0f} 条/s)")
+            flush(chunk)
+        writer.close()
+
+        if not configs:
             print("同步记录为空")
+            if out is not None:
+                out.close()
+                os.remove(temp_path)
             return False
-            
-        # 记录迁移统计
-        total_configs = 0
-        total_records = 0
-        migrated_records = 0
-        failed_records = 0
-        
-        # 迁移每个配置的记录
-        for config_name, sync_times in all_sync_times.items():
-            total_configs += 1
-            print(f"\n处理配置 '{config_name}':")
-            
-            # 迁移该配置下的所有记录
-            for file_path, sync_info in list(sync_times.items()):
-                total_records += 1
-                
-                # 如果已经是新格式，跳过
-                if not isinstance(sync_info, str):
-                    print(f"  [已是新格式] {file_path}")
-                    continue
-                    
-                print(f"  迁移: {file_path}")
-                
-                # 如果文件存在，计算MD5
-                if os.path.exists(file_path):
-                    try:
-                        md5_hash = calculate_md5(file_path)
-                        sync_times[file_path] = {
-                            'timestamp': sync_info,
-                            'md5': md5_hash
-                        }
-                        migrated_records += 1
-                        print(f"    ✓ MD5: {md5_hash}")
-                    except Exception as e:
-                        print(f"    ✗ 计算MD5失败: {e}")
-                        # 使用空MD5
-                        sync_times[file_path] = {
-                            'timestamp': sync_info,
-                            'md5': ''
-                        }
-                        failed_records += 1
-                else:
-                    # 如果文件不存在，使用空MD5
-                    print(f"    ⚠ 文件不存在，使用空MD5")
-                    sync_times[file_path] = {
-                        'timestamp': sync_info,
-                        'md5': ''
-                    }
-                    migrated_records += 1
-        
-        # 保存迁移后的记录
-        with open(sync_file_path, 'w', encoding='utf-8') as f:
-            json.dump(all_sync_times, f, indent=2, ensure_ascii=False)
-            
+
+        if out is not None:
+            out.flush()
+            os.fsync(out.fileno())
+            out.close()
+            os.replace(temp_path, sync_file_path)
+
         # 打印迁移结果
         print("\n迁移完成!")
-        print(f"处理配置数: {total_configs}")
-        print(f"总记录数: {total_records}")
-        print(f"成功迁移: {migrated_records}")
-        print(f"迁移失败: {failed_records}")
-        print(f"无需迁移: {total_records - migrated_records - failed_records}")
-        
+        print(f"处理配置数: {len(configs)}")
+        print(f"总记录数: {stats['records']}")
+        print(f"成功迁移: {stats['migrated']}（其中文件不存在、使用空MD5: {stats['missing']}）")
+        print(f"迁移失败: {stats['failed']}")
+        print(f"无需迁移: {stats['records'] - stats['migrated'] - stats['failed'] - stats['skipped']}")
+        if stats['skipped']:
+            print(f"已跳过（数据库中已有该配置的记录）: {stats['skipped']}")
+        print(f"用时: {time.perf_counter() - start:.1f} 秒")
+        if sqlite_path:
+            print(f"已写入: {os.path.abspath(sqlite_path)}")
+
         return True
     except Exception as e:
         print(f"迁移过程中出错: {e}")
+        if out is not None:
+            out.close()
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
         return False
+    finally:
+        hasher.close()
 
 def main():
     """主函数"""
@@ -139,16 +320,18 @@ def main():
     default_sync_file = os.path.join(script_dir, '_last_sync.json')
     
     # 解析命令行参数
-    if len(sys.argv) > 1:
-        sync_file_path = sys.argv[1]
-    else:
-        sync_file_path = default_sync_file
+    parser = argparse.ArgumentParser(description="同步记录格式迁移工具")
+    parser.add_argument('sync_file', nargs='?', default=default_sync_file, help="同步记录文件路径")
+    parser.add_argument('--sqlite', metavar='DB', help="直接写入 SQLite 同步记录数据库（原文件保持不变，已有记录的配置会被跳过）")
+    parser.add_argument('--workers', type=int, help="计算哈希的线程数")
+    args = parser.parse_args()
+    sync_file_path = args.sync_file
         
     print(f"同步记录迁移工具")
     print(f"迁移文件: {sync_file_path}")
     
     # 执行迁移
-    success = migrate_sync_records(sync_file_path)
+    success = migrate_sync_records(sync_file_path, sqlite_path=args.sqlite, workers=args.workers)
     
     if success:
         print("\n迁移成功完成！")
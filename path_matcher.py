@@ -0,0 +1,117 @@
+import os
+import re
+from fnmatch import translate
+
+# fnmatch 中的通配符
+WILDCARDS = '*?['
+
+def _compile(patterns):
+    """将多个 fnmatch 模式编译为一个正则表达式，没有模式时返回 None"""
+    if not patterns:
+        return None
+    return re.compile('|'.join(f'(?:{translate(os.path.normcase(p))})' for p in patterns))
+
+def _literal_prefix(pattern):
+    """模式中第一个通配符之前的部分"""
+    for i, ch in enumerate(pattern):
+        if ch in WILDCARDS:
+            return pattern[:i]
+    return pattern
+
+class PathMatcher:
+    """编译后的忽略/仅同步规则
+
+    与 should_ignore_file 的判断结果一致（相对路径按 fnmatch 规则匹配），但所有模式只编译一次，
+    并且可以判断整个目录是否被排除，用于遍历目录时原地剪枝。
+    """
+
+    def __init__(self, source_dir, ignore_patterns, only_sync_files, log_file=None):
+        """
+        Args:
+            source_dir: 源目录
+            ignore_patterns: 忽略模式列表
+            only_sync_files: 仅同步文件列表（不为空时忽略 ignore_patterns）
+            log_file: 日志文件路径（始终忽略，包括轮转出的 .1、.2 ... 文件）
+        """
+        self.source_dir = os.path.abspath(source_dir)
+        self._prefix = os.path.join(self.source_dir, '')
+        self._log_file = os.path.normcase(os.path.abspath(log_file)) if log_file else None
+        self.only_sync_files = list(only_sync_files or [])
+        self.ignore_patterns = list(ignore_patterns or [])
+        self._only_re = _compile(self.only_sync_files)
+        self._ignore_re = _compile(self.ignore_patterns)
+
+        # '目录/*' 形式的忽略模式：目录部分匹配时，目录下的所有文件都会被忽略
+        # （fnmatch 的 * 可以匹配路径分隔符）
+        dir_patterns = []
+        for pattern in self.ignore_patterns:
+            pattern = os.path.normcase(pattern)
+            for suffix in ('/*', os.sep + '*'):
+                if pattern.endswith(suffix) and len(pattern) > len(suffix):
+                    dir_patterns.append(pattern[:-len(suffix)])
+                    break
+        self._ignore_dir_re = _compile(dir_patterns)
+        # 仅同步模式的字面前缀，目录与所有前缀都不相容时，目录下不可能有需要同步的文件
+        self._only_prefixes = [_literal_prefix(os.path.normcase(p)).replace('/', os.sep)
+                               for p in self.only_sync_files]
+
+    def relative(self, path):
+        """计算相对于源目录的路径"""
+        if not os.path.isabs(path):
+            path = os.path.abspath(path)
+        if path.startswith(self._prefix):
+            return path[len(self._prefix):]
+        return os.path.relpath(path, self.source_dir)
+
+    def ignores_relative(self, relative_path):
+        """按相对路径判断文件是否应该被忽略"""
+        relative_path = os.path.normcase(relative_path)
+        if self._only_re is not None:
+            return self._only_re.match(relative_path) is None
+        return self._ignore_re is not None and self._ignore_re.match(relative_path) is not None
+
+    def ignores(self, file_path, relative_path=None):
+        """判断文件是否应该被忽略
+
+        Args:
+            file_path: 文件路径
+            relative_path: 已知的相对路径，为 None 时根据 file_path 计算
+
+        Returns:
+            bool: 是否应该忽略该文件
+        """
+        if self._log_file is not None:
+            abs_path = file_path if os.path.isabs(file_path) else os.path.abspath(file_path)
+            normalized = os.path.normcase(os.path.normpath(abs_path))
+            if normalized == self._log_file or (normalized.startswith(self._log_file + '.')
+                                                and normalized[len(self._log_file) + 1:].isdigit()):
+                return True
+        if relative_path is None:
+            relative_path = self.relative(file_path)
+        return self.ignores_relative(relative_path)
+
+    def excludes_dir(self, relative_dir):
+        """判断整个目录（相对路径）是否被排除，即目录下的任何文件都不会被同步
+
+        判断是保守的：返回 False 不代表目录下一定有需要同步的文件。
+        """
+        relative_dir = os.path.normcase(relative_dir)
+        if relative_dir in ('', os.curdir):
+            return False
+        if self._only_re is not None:
+            dir_prefix = relative_dir + os.sep
+            return not any(prefix.startswith(dir_prefix) or dir_prefix.startswith(prefix)
+                           for prefix in self._only_prefixes)
+        return self._ignore_dir_re is not None and self._ignore_dir_re.match(relative_dir) is not None
+
+    def prune(self, root, dirs):
+        """在 os.walk 中原地移除被排除的子目录
+
+        Args:
+            root: 当前目录
+            dirs: os.walk 返回的子目录列表（会被原地修改）
+        """
+        relative_root = self.relative(root)
+        if relative_root == os.curdir:
+            relative_root = ''
+        dirs[:] = [d for d in dirs if not self.excludes_dir(os.path.join(relative_root, d))]
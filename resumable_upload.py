@@ -0,0 +1,192 @@
+import os
+import shlex
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from ssh_pool import ParamikoSession
+from hash_service import hash_file
+
+# 默认分块大小
+CHUNK_SIZE = 8 * 1024 * 1024
+
+# 在远程执行的辅助脚本：
+#   probe <临时文件>                     输出临时文件大小，不存在时输出 -1
+#   create <临时文件> <大小>             创建（或清空）临时文件并预设大小
+#   write <临时文件> <偏移>              把标准输入写入临时文件的指定偏移处并同步到磁盘
+#   finish <临时文件> <路径> <大小> <MD5> <权限> <修改时间>
+#                                        校验大小和 MD5，一致时设置权限和修改时间后原子替换，不一致时退出码为 4
+RESUME_HELPER = r'''
+import sys, os, hashlib
+action, tmp = sys.argv[1], sys.argv[2]
+if action == "probe":
+    print(os.path.getsize(tmp) if os.path.exists(tmp) else -1)
+elif action == "create":
+    os.makedirs(os.path.dirname(tmp) or ".", exist_ok=True)
+    with open(tmp, "wb") as f:
+        f.truncate(int(sys.argv[3]))
+elif action == "write":
+    with open(tmp, "r+b") as f:
+        f.seek(int(sys.argv[3]))
+        total = 0
+        for chunk in iter(lambda: sys.stdin.buffer.read(1048576), b""):
+            f.write(chunk)
+            total += len(chunk)
+        f.flush()
+        os.fsync(f.fileno())
+    print(total)
+elif action == "finish":
+    path, size, md5, mode, mtime = sys.argv[3], int(sys.argv[4]), sys.argv[5], int(sys.argv[6], 8), float(sys.argv[7])
+    h = hashlib.md5()
+    with open(tmp, "rb") as f:
+        for chunk in iter(lambda: f.read(1048576), b""):
+            h.update(chunk)
+    actual_size = os.path.getsize(tmp)
+    if actual_size != size or h.hexdigest() != md5:
+        print(actual_size, h.hexdigest())
+        sys.exit(4)
+    os.chmod(tmp, mode)
+    os.utime(tmp, (mtime, mtime))
+    os.replace(tmp, path)
+'''
+
+def upload_key(target, remote_path):
+    """上传进度在同步记录存储中的键"""
+    return f"{target['server']}:{target.get('port') or 22}:{remote_path}"
+
+def temp_path_for(remote_path):
+    """远程临时文件路径（固定名称，进程重启后可以找到）"""
+    directory, name = os.path.split(remote_path.replace('\\', '/'))
+    return f"{directory}/.{name}.part" if directory else f".{name}.part"
+
+def _helper(session, action, *args, stdin=None):
+    command = f"python3 -c {shlex.quote(RESUME_HELPER)} {action} " + " ".join(shlex.quote(str(arg)) for arg in args)
+    return session.run(command, stdin=stdin)
+
+class _ChunkWriter:
+    """把分块写入远程临时文件
+
+    paramiko 会话通过 SFTP 写入，并行时每个线程使用独立的 SFTP 通道；其他会话通过辅助脚本写入。
+    """
+
+    def __init__(self, session, temp_path):
+        self.session = session
+        self.temp_path = temp_path
+        self._local = threading.local()
+        self._channels = []
+        self._lock = threading.Lock()
+
+    def _sftp_file(self):
+        handle = getattr(self._local, 'handle', None)
+        if handle is None:
+            sftp = self.session.client.open_sftp()
+            handle = sftp.open(self.temp_path, 'r+')
+            self._local.handle = handle
+            with self._lock:
+                self._channels.append((sftp, handle))
+        return handle
+
+    def write(self, offset, data):
+        if isinstance(self.session, ParamikoSession):
+            handle = self._sftp_file()
+            handle.seek(offset)
+            handle.write(data)
+            handle.flush()
+            return
+        exit_code, out, err = _helper(self.session, 'write', self.temp_path, offset, stdin=data)
+        if exit_code != 0 or int(out.strip() or -1) != len(data):
+            raise Exception(f"写入远程分块失败 (退出码: {exit_code}): {err.strip()}")
+
+    def close(self):
+        with self._lock:
+            channels, self._channels = self._channels, []
+        for sftp, handle in channels:
+            try:
+                handle.close()
+                sftp.close()
+            except Exception:
+                pass
+
+def resumable_upload(session, local_path, remote_path, store, key, chunk_size=CHUNK_SIZE, parallel=1, mode=None):
+    """分块上传大文件，支持断点续传
+
+    数据先写入远程的临时文件，每个分块写入完成后把进度保存到同步记录存储中；重连或进程重启后
+    从已确认的分块继续。全部写完后在远程校验大小和 MD5，一致时才原子替换目标文件。
+
+    Args:
+        session: 会话对象
+        local_path: 本地文件路径（已完成行尾转换）
+        remote_path: 远程文件路径
+        store: 保存上传进度的 SyncStateStore
+        key: 上传进度的键（upload_key）
+        chunk_size: 分块大小
+        parallel: 并行上传的分块数（paramiko 会话使用多个 SFTP 通道）
+        mode: 远程文件的权限，为 None 时使用本地文件的权限
+
+    Returns:
+        dict: {'size': 文件大小, 'resumed_bytes': 续传时跳过的字节数, 'sent_bytes': 本次发送的字节数}
+    """
+    st = os.stat(local_path)
+    size = st.st_size
+    mode = st.st_mode if mode is None else mode
+    temp_path = temp_path_for(remote_path)
+    chunk_count = max(1, (size + chunk_size - 1) // chunk_size)
+
+    done = set()
+    progress = store.get_upload(key)
+    if (progress and progress.get('size') == size and progress.get('mtime_ns') == st.st_mtime_ns
+            and progress.get('chunk_size') == chunk_size and progress.get('temp_path') == temp_path):
+        exit_code, out, _ = _helper(session, 'probe', temp_path)
+        if exit_code == 0 and int(out.strip() or -1) == size:
+            done = set(progress.get('done', []))
+    if not done:
+        exit_code, _, err = _helper(session, 'create', temp_path, size)
+        if exit_code != 0:
+            raise Exception(f"创建远程临时文件失败 (退出码: {exit_code}): {err.strip()}")
+    resumed_bytes = sum(min(chunk_size, size - i * chunk_size) for i in done)
+    if resumed_bytes:
+        print(f"断点续传: {remote_path} 已完成 {resumed_bytes} / {size} 字节")
+
+    lock = threading.Lock()
+
+    def save_progress():
+        store.save_upload(key, {
+            'size': size,
+            'mtime_ns': st.st_mtime_ns,
+            'chunk_size': chunk_size,
+            'temp_path': temp_path,
+            'done': sorted(done)
+        })
+
+    save_progress()
+    writer = _ChunkWriter(session, temp_path)
+    pending = [i for i in range(chunk_count) if i not in done]
+
+    def send(index):
+        offset = index * chunk_size
+        with open(local_path, 'rb') as f:
+            f.seek(offset)
+            data = f.read(chunk_size)
+        writer.write(offset, data)
+        with lock:
+            done.add(index)
+            save_progress()
+        return len(data)
+
+    try:
+        if parallel > 1 and len(pending) > 1:
+            with ThreadPoolExecutor(max_workers=parallel, thread_name_prefix="upload") as executor:
+                sent_bytes = sum(executor.map(send, pending))
+        else:
+            sent_bytes = sum(send(index) for index in pending)
+    finally:
+        writer.close()
+
+    exit_code, out, err = _helper(session, 'finish', temp_path, remote_path, size, hash_file(local_path, 'md5'),
+                                  f"{mode & 0o7777:o}", repr(st.st_mtime))
+    if exit_code == 4:
+        # 临时文件内容与本地文件不一致，丢弃进度，下次重新上传
+        store.delete_upload(key)
+        raise Exception(f"远程文件校验失败: {remote_path} ({out.strip()})")
+    if exit_code != 0:
+        raise Exception(f"完成远程上传失败 (退出码: {exit_code}): {err.strip()}")
+    store.delete_upload(key)
+    return {'size': size, 'resumed_bytes': resumed_bytes, 'sent_bytes': sent_bytes}
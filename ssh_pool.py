@@ -0,0 +1,475 @@
+import hashlib
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+import paramiko
+
+# 连接断开时可能抛出的异常，遇到这些异常时丢弃会话并重连
+CONNECTION_ERRORS = (paramiko.SSHException, EOFError, socket.error)
+
+def target_key(target):
+    """根据 parse_targets 解析后的目标配置生成连接池的键
+
+    Args:
+        target: 目标配置
+
+    Returns:
+        tuple: (用户名@服务器, 端口, 密码, 是否启用SSH传输层压缩)
+    """
+    return (target['server'], target.get('port') or 22, target.get('password'), target.get('compression') == 'ssh')
+
+def split_server(target):
+    """从目标配置中拆分出用户名和服务器地址
+
+    Args:
+        target: 目标配置
+
+    Returns:
+        tuple: (用户名, 服务器地址)
+    """
+    username, server = target['server'].split('@', 1)
+    if '#' in server:  # 如果服务器地址中包含端口，需要去掉
+        server = server.split('#')[0]
+    return username, server
+
+class ParamikoSession:
+    """基于 paramiko 的持久 SSH 会话，复用 SSH 传输层和 SFTP 通道"""
+
+    def __init__(self, target, keepalive_interval=30):
+        username, server = split_server(target)
+        self.target = target
+        self.client = paramiko.SSHClient()
+        self.client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        self.client.connect(
+            server,
+            port=target.get('port') or 22,
+            username=username,
+            password=target['password'],
+            compress=target.get('compression') == 'ssh'
+        )
+        transport = self.client.get_transport()
+        if keepalive_interval:
+            transport.set_keepalive(keepalive_interval)
+        self._sftp = None
+        self.last_used = time.time()
+
+    def is_alive(self):
+        """检查底层传输层是否仍然可用"""
+        transport = self.client.get_transport()
+        return transport is not None and transport.is_active()
+
+    @property
+    def sftp(self):
+        """懒加载的 SFTP 通道，同一会话内复用"""
+        if self._sftp is None or self._sftp.sock.closed:
+            self._sftp = self.client.open_sftp()
+        return self._sftp
+
+    def run(self, command, stdin=None):
+        """执行远程命令并等待完成
+
+        Args:
+            command: 远程命令
+            stdin: 写入命令标准输入的数据（bytes 或二进制文件对象），可选
+
+        Returns:
+            tuple: (退出码, 标准输出, 标准错误)
+        """
+        channel_stdin, stdout, stderr = self.client.exec_command(command)
+        if stdin is not None:
+            if isinstance(stdin, bytes):
+                channel_stdin.write(stdin)
+            else:
+                for chunk in iter(lambda: stdin.read(1024 * 1024), b""):
+                    channel_stdin.write(chunk)
+            channel_stdin.flush()
+            channel_stdin.channel.shutdown_write()
+        channel_stdin.close()
+        out = stdout.read()
+        err = stderr.read()
+        exit_code = stdout.channel.recv_exit_status()
+        return exit_code, out.decode(errors='replace'), err.decode(errors='replace')
+
+    def put(self, local_path, remote_path):
+        """通过 SFTP 上传文件，并保留文件的修改时间"""
+        self.sftp.put(local_path, remote_path)
+        st = os.stat(local_path)
+        self.sftp.utime(remote_path, (st.st_atime, st.st_mtime))
+
+    def close(self):
+        """关闭 SFTP 通道和 SSH 连接"""
+        try:
+            if self._sftp is not None:
+                self._sftp.close()
+        except Exception:
+            pass
+        finally:
+            self._sftp = None
+            self.client.close()
+
+class OpenSSHSession:
+    """基于系统 ssh 命令的会话（无密码，依赖SSH密钥）
+
+    启用多路复用时，首次使用会启动一个 OpenSSH ControlMaster 主连接，之后的 ssh/scp
+    命令都通过控制套接字复用该连接，每个命令只需一次往返而不需要重新握手。
+    Windows 自带的 OpenSSH 不支持 ControlMaster，此时退化为每次调用独立连接。
+    """
+
+    # 多个线程可以同时在同一个主连接上执行命令
+    shareable = True
+
+    def __init__(self, target, keepalive_interval=30, control_dir=None):
+        self.target = target
+        self.server = target['server']
+        self.keepalive_interval = keepalive_interval
+        self.control_path = None
+        self._master = None
+        self._lock = threading.Lock()
+        self._started = False
+        self._control_dir = control_dir
+        self.last_used = time.time()
+
+    def _common_options(self):
+        options = []
+        if self.target.get('compression') == 'ssh':
+            options.append('-C')
+        if self.keepalive_interval:
+            options += ['-o', f'ServerAliveInterval={self.keepalive_interval}']
+        if self.control_path:
+            options += ['-o', 'ControlMaster=no', '-o', f'ControlPath={self.control_path}']
+        return options
+
+    def _ensure_master(self):
+        """懒启动 ControlMaster 主连接，启动失败时退化为独立连接"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+            if not self._control_dir:
+                return
+            # 控制套接字路径长度有限制，使用短哈希作为文件名
+            name = hashlib.md5(repr(target_key(self.target)).encode()).hexdigest()[:12]
+            control_path = os.path.join(self._control_dir, name)
+            command = ['ssh', '-M', '-N', '-o', 'ControlPersist=no', '-o', f'ControlPath={control_path}']
+            if self.target.get('compression') == 'ssh':
+                command.append('-C')
+            if self.keepalive_interval:
+                command += ['-o', f'ServerAliveInterval={self.keepalive_interval}']
+            command.append(self.server)
+            try:
+                self._master = subprocess.Popen(command, stdin=subprocess.DEVNULL)
+            except OSError as e:
+                print(f"启动SSH主连接失败: {e}")
+                return
+            deadline = time.time() + 30
+            while time.time() < deadline and self._master.poll() is None:
+                check = subprocess.run(
+                    ['ssh', '-o', f'ControlPath={control_path}', '-O', 'check', self.server],
+                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+                )
+                if check.returncode == 0:
+                    self.control_path = control_path
+                    return
+                time.sleep(0.2)
+            print(f"SSH主连接不可用，改为独立连接: {self.server}")
+            self._stop_master()
+
+    def _stop_master(self):
+        if self._master is None:
+            return
+        if self.control_path:
+            subprocess.run(
+                ['ssh', '-o', f'ControlPath={self.control_path}', '-O', 'exit', self.server],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+            )
+        if self._master.poll() is None:
+            self._master.terminate()
+        try:
+            self._master.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self._master.kill()
+        self._master = None
+        self.control_path = None
+
+    def is_alive(self):
+        """主连接仍在运行（或未使用多路复用）时返回 True"""
+        if not self._started or self._master is None:
+            return True
+        return self._master.poll() is None
+
+    def run(self, command, stdin=None):
+        """通过 ssh 执行远程命令并等待完成
+
+        Args:
+            command: 远程命令
+            stdin: 写入命令标准输入的数据（bytes 或二进制文件对象），可选
+
+        Returns:
+            tuple: (退出码, 标准输出, 标准错误)
+        """
+        self._ensure_master()
+        args = ['ssh'] + self._common_options() + [self.server, command]
+        if stdin is None or isinstance(stdin, bytes):
+            result = subprocess.run(args, input=stdin if stdin is not None else b"",
+                                    stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        else:
+            result = subprocess.run(args, stdin=stdin, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if result.returncode == 255 and not self.is_alive():
+            raise ConnectionError(f"SSH主连接已断开: {self.server}")
+        return result.returncode, result.stdout.decode(errors='replace'), result.stderr.decode(errors='replace')
+
+    def put(self, local_path, remote_path):
+        """通过 scp 上传文件，并保留文件的修改时间"""
+        self._ensure_master()
+        args = ['scp', '-p'] + self._common_options() + [local_path, f"{self.server}:{remote_path}"]
+        subprocess.run(args, check=True)
+
+    def close(self):
+        """关闭主连接"""
+        with self._lock:
+            self._stop_master()
+            self._started = False
+
+class LocalShellSession:
+    """在本机 shell 中执行命令的会话，与远程会话接口一致
+
+    用于把本地目录当作远程目标来测试增量传输等依赖远程命令的功能。
+    """
+
+    shareable = True
+
+    def __init__(self, target=None):
+        self.target = target or {'server': 'localhost', 'port': 0, 'password': None}
+        self.last_used = time.time()
+
+    def is_alive(self):
+        return True
+
+    def run(self, command, stdin=None):
+        """通过 sh -c 执行命令
+
+        Returns:
+            tuple: (退出码, 标准输出, 标准错误)
+        """
+        if stdin is None or isinstance(stdin, bytes):
+            result = subprocess.run(['sh', '-c', command], input=stdin if stdin is not None else b"",
+                                    stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        else:
+            result = subprocess.run(['sh', '-c', command], stdin=stdin,
+                                    stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        return result.returncode, result.stdout.decode(errors='replace'), result.stderr.decode(errors='replace')
+
+    def put(self, local_path, remote_path):
+        """复制文件，并保留文件的修改时间"""
+        shutil.copy2(local_path, remote_path)
+
+    def close(self):
+        pass
+
+class SSHConnectionPool:
+    """SSH 连接池，按目标配置复用连接
+
+    同一目标的连接在多次调用之间保持打开，空闲超过 idle_timeout 秒后由后台线程关闭，
+    连接断开时自动重连。有密码的目标使用 paramiko 会话，无密码的目标使用 OpenSSH
+    多路复用会话。
+    """
+
+    def __init__(self, idle_timeout=300, keepalive_interval=30, max_sessions_per_target=4, multiplex=True):
+        """
+        Args:
+            idle_timeout: 空闲连接的超时时间（秒）
+            keepalive_interval: SSH keepalive 间隔（秒），为 0 时不发送
+            max_sessions_per_target: 每个目标最多保留的空闲连接数
+            multiplex: 无密码目标是否使用 OpenSSH 连接多路复用（Windows 上不可用）
+        """
+        self.idle_timeout = idle_timeout
+        self.keepalive_interval = keepalive_interval
+        self.max_sessions_per_target = max_sessions_per_target
+        self.multiplex = multiplex and os.name != 'nt'
+        self._idle = {}  # 键 -> 空闲会话列表
+        self._shared = {}  # 键 -> 可在线程间共享的会话
+        self._users = {}  # 共享会话 -> 正在使用它的调用数（正在使用的会话不会被清理）
+        self._control_dir = None
+        self._lock = threading.Lock()
+        self._closed = False
+        self._reaper = None
+        self._stop_event = threading.Event()
+
+    def _create_session(self, target):
+        """为目标创建新的会话"""
+        if target.get('password'):
+            return ParamikoSession(target, self.keepalive_interval)
+        if self.multiplex and self._control_dir is None:
+            self._control_dir = tempfile.mkdtemp(prefix='fsync-')
+        return OpenSSHSession(target, self.keepalive_interval, self._control_dir if self.multiplex else None)
+
+    def _start_reaper(self):
+        """懒启动空闲连接清理线程"""
+        if self._reaper is None and self.idle_timeout:
+            self._reaper = threading.Thread(target=self._reap_loop, name="ssh-pool-reaper", daemon=True)
+            self._reaper.start()
+
+    def _reap_loop(self):
+        interval = max(1, min(self.idle_timeout / 2, 30))
+        while not self._stop_event.wait(interval):
+            self.close_idle()
+
+    def close_idle(self):
+        """关闭空闲时间超过 idle_timeout 的连接（正在使用的共享会话除外）"""
+        now = time.time()
+        expired = []
+        with self._lock:
+            for key, sessions in self._idle.items():
+                keep = []
+                for session in sessions:
+                    if now - session.last_used > self.idle_timeout or not session.is_alive():
+                        expired.append(session)
+                    else:
+                        keep.append(session)
+                self._idle[key] = keep
+            for key, session in list(self._shared.items()):
+                if self._users.get(session):
+                    continue
+                if now - session.last_used > self.idle_timeout or not session.is_alive():
+                    expired.append(self._shared.pop(key))
+        for session in expired:
+            session.close()
+
+    def acquire(self, target):
+        """获取目标的可用会话，没有空闲会话时新建连接
+
+        Returns:
+            tuple: (会话, 是否为新建连接)
+        """
+        if self._closed:
+            raise RuntimeError("SSH 连接池已关闭")
+        key = target_key(target)
+        if not target.get('password'):
+            with self._lock:
+                session = self._shared.get(key)
+                if session is not None and not session.is_alive():
+                    self._shared.pop(key)
+                    session.close()
+                    session = None
+                is_new = session is None
+                if is_new:
+                    session = self._shared[key] = self._create_session(target)
+                    self._start_reaper()
+                self._users[session] = self._users.get(session, 0) + 1
+                session.last_used = time.time()
+            return session, is_new
+        while True:
+            with self._lock:
+                sessions = self._idle.get(key)
+                session = sessions.pop() if sessions else None
+            if session is None:
+                break
+            if session.is_alive():
+                return session, False
+            session.close()
+        session = self._create_session(target)
+        with self._lock:
+            self._start_reaper()
+        return session, True
+
+    def release(self, session, discard=False):
+        """将会话归还到连接池
+
+        Args:
+            session: 会话
+            discard: 为 True 时直接关闭会话（例如连接已出错）
+        """
+        session.last_used = time.time()
+        if getattr(session, 'shareable', False):
+            with self._lock:
+                users = self._users.get(session, 0) - 1
+                if users > 0:
+                    self._users[session] = users
+                else:
+                    self._users.pop(session, None)
+                if discard or self._closed:
+                    if self._shared.get(target_key(session.target)) is session:
+                        self._shared.pop(target_key(session.target))
+            if discard or self._closed:
+                session.close()
+            return
+        if not discard and not self._closed and session.is_alive():
+            key = target_key(session.target)
+            with self._lock:
+                sessions = self._idle.setdefault(key, [])
+                if len(sessions) < self.max_sessions_per_target:
+                    sessions.append(session)
+                    return
+        session.close()
+
+    @contextmanager
+    def session(self, target):
+        """以上下文管理器的方式使用会话，出现连接错误时丢弃该会话"""
+        session, _ = self.acquire(target)
+        try:
+            yield session
+        except CONNECTION_ERRORS:
+            self.release(session, discard=True)
+            raise
+        except BaseException:
+            self.release(session)
+            raise
+        else:
+            self.release(session)
+
+    def call(self, target, func):
+        """在会话上执行 func(session)，复用的连接已断开时重连并重试一次
+
+        Args:
+            target: 目标配置
+            func: 接收会话作为参数的函数
+
+        Returns:
+            func 的返回值
+        """
+        session, is_new = self.acquire(target)
+        try:
+            result = func(session)
+        except CONNECTION_ERRORS:
+            self.release(session, discard=True)
+            if is_new:
+                raise
+            # 复用的连接可能已被服务器断开，重新建立连接后再试一次
+            session, _ = self.acquire(target)
+            try:
+                result = func(session)
+            except CONNECTION_ERRORS:
+                self.release(session, discard=True)
+                raise
+            except BaseException:
+                self.release(session)
+                raise
+        except BaseException:
+            self.release(session)
+            raise
+        self.release(session)
+        return result
+
+    def close_all(self):
+        """关闭连接池中的所有连接并停止清理线程"""
+        self._closed = True
+        self._stop_event.set()
+        with self._lock:
+            sessions = [s for group in self._idle.values() for s in group]
+            sessions += list(self._shared.values())
+            self._idle.clear()
+            self._shared.clear()
+            self._users.clear()
+        for session in sessions:
+            session.close()
+        if self._control_dir:
+            shutil.rmtree(self._control_dir, ignore_errors=True)
+            self._control_dir = None
+        if self._reaper is not None:
+            self._reaper.join(timeout=5)
+            self._reaper = None
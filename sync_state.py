@@ -0,0 +1,541 @@
+import os
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+# 文件修改时间与记录签名的时间相差小于该值时，同一时间粒度内的再次修改无法从签名上区分，需要重新计算哈希
+RACY_WINDOW_NS = 2_000_000_000
+
+class SyncStateStore:
+    """同步记录存储的基类
+
+    记录以绝对路径为键，值为 {'timestamp': ..., 'hash': ..., 'hash_algo': ..., 'size': ..., 'mtime_ns': ...,
+    'ino': ..., 'dev': ..., 'checked_ns': ...} 形式的字典。旧记录可能只有 'md5' 而没有
+    'hash'/'hash_algo'，也可能缺少文件签名字段。
+    每个实例只访问一个配置的记录。写操作在 batch() 内部会延迟到批次结束时一次性提交，
+    批次之外的单次写操作立即提交。
+    """
+
+    def __init__(self, config_name):
+        self.config_name = config_name
+        self._lock = threading.RLock()
+        self._batch_depth = 0
+        self._uploads = {}
+        self._dirs = {}
+
+    def get(self, path):
+        """查询单个文件的同步记录，不存在时返回 None"""
+        raise NotImplementedError
+
+    def items(self):
+        """返回当前配置的所有 (路径, 记录)"""
+        raise NotImplementedError
+
+    def paths_under(self, directory):
+        """返回目录下（任意深度）所有同步记录的路径"""
+        prefix = os.path.join(directory, '')
+        return [path for path, _ in self.items() if path.startswith(prefix)]
+
+    def _upsert(self, path, record):
+        raise NotImplementedError
+
+    def _delete(self, path):
+        raise NotImplementedError
+
+    def _commit(self):
+        raise NotImplementedError
+
+    def upsert(self, path, record):
+        """新增或更新一条同步记录"""
+        with self._lock:
+            self._upsert(path, record)
+            self._maybe_commit()
+
+    def delete(self, path):
+        """删除一条同步记录"""
+        self.delete_many([path])
+
+    def delete_many(self, paths):
+        """在一个事务中删除多条同步记录"""
+        with self._lock:
+            for path in paths:
+                self._delete(path)
+            self._maybe_commit()
+
+    def rename(self, old_path, new_path, is_directory=False):
+        """文件或目录移动后把同步记录移到新路径（不重新计算哈希，移动不改变文件签名）
+
+        Args:
+            old_path: 原路径
+            new_path: 新路径
+            is_directory: 为 True 时移动目录下的所有记录
+
+        Returns:
+            int: 移动的记录数
+        """
+        with self._lock:
+            moved = self._rename(old_path, new_path, is_directory)
+            self._maybe_commit()
+            return moved
+
+    def _rename(self, old_path, new_path, is_directory):
+        if is_directory:
+            old_prefix, new_prefix = os.path.join(old_path, ''), os.path.join(new_path, '')
+            records = self.items()
+            stale = [path for path, _ in records if path.startswith(new_prefix)]
+            moved = [(path, new_prefix + path[len(old_prefix):], record)
+                     for path, record in records if path.startswith(old_prefix)]
+        else:
+            record = self.get(old_path)
+            stale = [new_path]
+            moved = [(old_path, new_path, record)] if record is not None else []
+        # 目标位置原有的记录已经被覆盖
+        for path in stale:
+            self._delete(path)
+        for path, _, _ in moved:
+            self._delete(path)
+        for _, path, record in moved:
+            self._upsert(path, record)
+        return len(moved)
+
+    def _maybe_commit(self):
+        if self._batch_depth == 0:
+            self._commit()
+
+    @contextmanager
+    def batch(self):
+        """批量写入：批次内的所有写操作在退出时一次提交，可以嵌套"""
+        with self._lock:
+            self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._batch_depth -= 1
+                if self._batch_depth == 0:
+                    self._commit()
+
+    def flush(self):
+        """立即提交尚未写入的记录"""
+        with self._lock:
+            self._commit()
+
+    def close(self):
+        """提交并关闭存储"""
+        self.flush()
+
+    def get_upload(self, key):
+        """查询未完成的分块上传进度，不存在时返回 None
+
+        基类只在内存中保存上传进度（进程重启后无法续传），SQLite 存储会持久化。
+        """
+        with self._lock:
+            return self._uploads.get(key)
+
+    def save_upload(self, key, progress):
+        """保存分块上传进度"""
+        with self._lock:
+            self._uploads[key] = progress
+
+    def delete_upload(self, key):
+        """上传完成或放弃后删除进度"""
+        with self._lock:
+            self._uploads.pop(key, None)
+
+    def get_dir(self, path):
+        """查询单个目录的索引条目（见 dir_index.DirectoryIndex），不存在时返回 None
+
+        基类只在内存中保存目录索引（进程重启后失效），SQLite 存储会持久化。
+        """
+        with self._lock:
+            return self._dirs.get(path)
+
+    def dir_items(self):
+        """返回当前配置的所有 (目录相对路径, 索引条目)"""
+        with self._lock:
+            return list(self._dirs.items())
+
+    def save_dirs(self, entries):
+        """新增或更新多个目录的索引条目
+
+        Args:
+            entries: {目录相对路径: 索引条目}
+        """
+        with self._lock:
+            self._dirs.update(entries)
+
+    def delete_dirs(self, paths):
+        """删除多个目录的索引条目"""
+        with self._lock:
+            for path in paths:
+                self._dirs.pop(path, None)
+
+class JsonSyncState(SyncStateStore):
+    """旧的 JSON 文件格式（_last_sync.json），所有配置共用一个文件
+
+    记录在内存中维护，提交时整体重写文件，因此只适合小规模目录。
+    """
+
+    def __init__(self, path, config_name):
+        super().__init__(config_name)
+        self.path = path
+        self._dirty = False
+        self.records = load_json_records(path).get(config_name, {})
+
+    def get(self, path):
+        return self.records.get(path)
+
+    def items(self):
+        return list(self.records.items())
+
+    def paths_under(self, directory):
+        prefix = os.path.join(directory, '')
+        return [path for path in self.records if path.startswith(prefix)]
+
+    def _upsert(self, path, record):
+        self.records[path] = record
+        self._dirty = True
+
+    def _delete(self, path):
+        if self.records.pop(path, None) is not None:
+            self._dirty = True
+
+    def _commit(self):
+        if not self._dirty:
+            return
+        # 其他配置的记录也保存在同一个文件中，写入前重新读取
+        all_sync_times = load_json_records(self.path)
+        all_sync_times[self.config_name] = self.records
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(all_sync_times, f, indent=2, ensure_ascii=False)
+        os.replace(temp_path, self.path)
+        self._dirty = False
+
+class SqliteSyncState(SyncStateStore):
+    """基于 SQLite 的同步记录存储
+
+    每条记录是一行，按 (配置名, 路径) 建立主键索引，点查询和单条写入都不需要读写整个文件。
+    多个配置可以共用同一个数据库文件，彼此的记录互不影响。
+    """
+
+    # 批次内未提交的写操作超过该数量时提前提交，避免进程中断时丢失过多记录
+    MAX_PENDING = 5000
+
+    def __init__(self, path, config_name):
+        super().__init__(config_name)
+        self.path = path
+        self._pending = 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS sync_records ("
+            "config TEXT NOT NULL, path TEXT NOT NULL, record TEXT NOT NULL, "
+            "PRIMARY KEY (config, path)) WITHOUT ROWID"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS imports (config TEXT PRIMARY KEY, source TEXT)"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS uploads ("
+            "config TEXT NOT NULL, key TEXT NOT NULL, progress TEXT NOT NULL, "
+            "PRIMARY KEY (config, key)) WITHOUT ROWID"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS dir_index ("
+            "config TEXT NOT NULL, path TEXT NOT NULL, entry TEXT NOT NULL, "
+            "PRIMARY KEY (config, path)) WITHOUT ROWID"
+        )
+        self._in_transaction = False
+
+    def _begin(self):
+        if not self._in_transaction:
+            self.conn.execute("BEGIN")
+            self._in_transaction = True
+
+    def get(self, path):
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT record FROM sync_records WHERE config = ? AND path = ?",
+                (self.config_name, path)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def items(self):
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT path, record FROM sync_records WHERE config = ?",
+                (self.config_name,)
+            ).fetchall()
+        return [(path, json.loads(record)) for path, record in rows]
+
+    def paths_under(self, directory):
+        # 以前缀开头的路径都在 [前缀, 前缀最后一个字符加一) 范围内，可以使用主键索引，也不需要解析记录
+        prefix = os.path.join(directory, '')
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT path FROM sync_records WHERE config = ? AND path >= ? AND path < ?",
+                (self.config_name, prefix, upper)
+            ).fetchall()
+        return [path for path, in rows]
+
+    def _upsert(self, path, record):
+        self._begin()
+        self.conn.execute(
+            "INSERT OR REPLACE INTO sync_records (config, path, record) VALUES (?, ?, ?)",
+            (self.config_name, path, json.dumps(record, ensure_ascii=False))
+        )
+        self._pending += 1
+        if self._pending >= self.MAX_PENDING:
+            self._commit()
+
+    def _delete(self, path):
+        self._begin()
+        self.conn.execute(
+            "DELETE FROM sync_records WHERE config = ? AND path = ?",
+            (self.config_name, path)
+        )
+        self._pending += 1
+
+    def _rename(self, old_path, new_path, is_directory):
+        self._begin()
+        if not is_directory:
+            self.conn.execute("DELETE FROM sync_records WHERE config = ? AND path = ?", (self.config_name, new_path))
+            cursor = self.conn.execute(
+                "UPDATE sync_records SET path = ? WHERE config = ? AND path = ?",
+                (new_path, self.config_name, old_path)
+            )
+        else:
+            old_prefix, new_prefix = os.path.join(old_path, ''), os.path.join(new_path, '')
+            self.conn.execute(
+                "DELETE FROM sync_records WHERE config = ? AND substr(path, 1, ?) = ?",
+                (self.config_name, len(new_prefix), new_prefix)
+            )
+            cursor = self.conn.execute(
+                "UPDATE sync_records SET path = ? || substr(path, ?) WHERE config = ? AND substr(path, 1, ?) = ?",
+                (new_prefix, len(old_prefix) + 1, self.config_name, len(old_prefix), old_prefix)
+            )
+        self._pending += cursor.rowcount
+        return cursor.rowcount
+
+    def _commit(self):
+        if self._in_transaction:
+            self.conn.execute("COMMIT")
+            self._in_transaction = False
+        self._pending = 0
+
+    def has_records(self):
+        """当前配置是否已有同步记录"""
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT 1 FROM sync_records WHERE config = ? LIMIT 1", (self.config_name,)
+            ).fetchone()
+        return row is not None
+
+    def is_imported(self):
+        """当前配置是否已经导入过旧的 JSON 记录"""
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT 1 FROM imports WHERE config = ?", (self.config_name,)
+            ).fetchone()
+        return row is not None
+
+    def mark_imported(self, source):
+        """记录当前配置已从 source 导入"""
+        with self._lock:
+            self._begin()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO imports (config, source) VALUES (?, ?)",
+                (self.config_name, source)
+            )
+            self._maybe_commit()
+
+    def get_upload(self, key):
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT progress FROM uploads WHERE config = ? AND key = ?",
+                (self.config_name, key)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_upload(self, key, progress):
+        """保存分块上传进度并立即提交（即使在批次内），进程中断后可以从这里续传"""
+        with self._lock:
+            self._begin()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO uploads (config, key, progress) VALUES (?, ?, ?)",
+                (self.config_name, key, json.dumps(progress))
+            )
+            self._commit()
+
+    def delete_upload(self, key):
+        with self._lock:
+            self._begin()
+            self.conn.execute(
+                "DELETE FROM uploads WHERE config = ? AND key = ?",
+                (self.config_name, key)
+            )
+            self._commit()
+
+    def get_dir(self, path):
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT entry FROM dir_index WHERE config = ? AND path = ?",
+                (self.config_name, path)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def dir_items(self):
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT path, entry FROM dir_index WHERE config = ?",
+                (self.config_name,)
+            ).fetchall()
+        return [(path, json.loads(entry)) for path, entry in rows]
+
+    def save_dirs(self, entries):
+        with self._lock:
+            self._begin()
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO dir_index (config, path, entry) VALUES (?, ?, ?)",
+                [(self.config_name, path, json.dumps(entry, ensure_ascii=False)) for path, entry in entries.items()]
+            )
+            self._pending += len(entries)
+            self._maybe_commit()
+
+    def delete_dirs(self, paths):
+        with self._lock:
+            self._begin()
+            self.conn.executemany(
+                "DELETE FROM dir_index WHERE config = ? AND path = ?",
+                [(self.config_name, path) for path in paths]
+            )
+            self._pending += len(paths)
+            self._maybe_commit()
+
+    def close(self):
+        with self._lock:
+            self._commit()
+            self.conn.close()
+
+def load_json_records(path):
+    """读取旧的 JSON 同步记录文件
+
+    Returns:
+        dict: {配置名: {文件路径: 记录}}，文件不存在或为空时返回空字典
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        content = f.read()
+    return json.loads(content) if content else {}
+
+def normalize_record(sync_info):
+    """将旧格式（只有时间戳字符串）的记录转换为字典格式"""
+    if isinstance(sync_info, str):
+        return {'timestamp': sync_info}
+    return sync_info
+
+def record_digest(record):
+    """获取记录中的哈希算法和哈希值，兼容只有 'md5' 字段的旧记录
+
+    Returns:
+        tuple: (算法, 哈希值)，没有哈希记录时哈希值为 None
+    """
+    if not record:
+        return 'md5', None
+    if record.get('hash'):
+        return record.get('hash_algo', 'md5'), record['hash']
+    return 'md5', record.get('md5') or None
+
+def stat_signature(st):
+    """根据 os.stat 结果生成文件签名字段
+
+    Args:
+        st: os.stat_result
+
+    Returns:
+        dict: 包含大小、纳秒修改时间、inode、设备号和签名记录时间
+    """
+    return {
+        'size': st.st_size,
+        'mtime_ns': st.st_mtime_ns,
+        'ino': st.st_ino,
+        'dev': st.st_dev,
+        'checked_ns': time.time_ns()
+    }
+
+def signature_matches(record, st):
+    """比较记录中的文件签名与当前 stat 结果
+
+    Returns:
+        bool | None: 签名一致返回 True，不一致返回 False，记录中没有签名返回 None
+    """
+    if not isinstance(record, dict) or 'size' not in record or 'mtime_ns' not in record:
+        return None
+    if record['size'] != st.st_size or record['mtime_ns'] != st.st_mtime_ns:
+        return False
+    # Windows 上 os.scandir 返回的 inode/设备号为 0，此时不参与比较
+    for field, value in (('ino', st.st_ino), ('dev', st.st_dev)):
+        if record.get(field) and value and record[field] != value:
+            return False
+    return True
+
+def is_racy(record):
+    """签名记录时文件刚被修改过，签名一致也不能说明内容未变"""
+    checked_ns = record.get('checked_ns')
+    return checked_ns is None or checked_ns - record['mtime_ns'] < RACY_WINDOW_NS
+
+def import_json_records(store, json_path):
+    """一次性导入旧的 JSON 同步记录（包括只有时间戳字符串的旧格式记录）
+
+    Args:
+        store: 目标存储
+        json_path: _last_sync.json 文件路径
+
+    Returns:
+        int: 导入的记录数
+    """
+    records = load_json_records(json_path).get(store.config_name, {})
+    with store.batch():
+        for path, sync_info in records.items():
+            store.upsert(path, normalize_record(sync_info))
+    return len(records)
+
+def open_sync_state(config, config_name):
+    """根据配置打开同步记录存储
+
+    config['state_backend'] 为 'sqlite'（默认）时使用 config['sync_state_file']，
+    首次打开时自动导入 config['last_sync_file'] 中该配置的旧记录；为 'json' 时直接使用旧格式。
+
+    Args:
+        config: 配置字典
+        config_name: 配置名称
+
+    Returns:
+        SyncStateStore: 同步记录存储
+    """
+    json_path = os.path.abspath(config['last_sync_file'])
+    backend = config.get('state_backend', 'sqlite')
+    if backend == 'json':
+        return JsonSyncState(json_path, config_name)
+    if backend != 'sqlite':
+        raise ValueError(f"未知的同步记录存储类型: {backend}")
+
+    state_path = config.get('sync_state_file') or os.path.splitext(json_path)[0] + '.db'
+    store = SqliteSyncState(os.path.abspath(state_path), config_name)
+    if not store.is_imported():
+        try:
+            count = import_json_records(store, json_path)
+            if count:
+                print(f"已从 {json_path} 导入 {count} 条同步记录")
+            store.mark_imported(json_path)
+        except Exception as e:
+            print(f"导入旧同步记录失败: {e}")
+    return store
@@ -1,11 +1,20 @@
 import os
+import shlex
 import subprocess
 from datetime import datetime
 import json
-from fnmatch import fnmatch
+from functools import lru_cache
 import paramiko
-import hashlib
 from line_ending_handler import convert_line_endings, cleanup_temp_file
+from ssh_pool import SSHConnectionPool, CONNECTION_ERRORS
+from delta_transfer import delta_upload
+from bulk_transfer import bulk_upload
+from local_copy import LocalCopier
+from compression import choose_codec, compressed_upload
+from resumable_upload import resumable_upload, upload_key
+from sync_state import SyncStateStore
+from hash_service import hash_file
+from path_matcher import PathMatcher
 
 def calculate_md5(file_path):
     """计算文件的MD5哈希值
@@ -16,17 +25,15 @@ def calculate_md5(file_path):
     Returns:
         str: 文件的MD5哈希值
     """
-    hash_md5 = hashlib.md5()
-    with open(file_path, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hash_md5.update(chunk)
-    return hash_md5.hexdigest()
+    return hash_file(file_path, 'md5')
 
-def parse_targets(targets):
+def parse_targets(targets, remote_options=None):
     """解析目标路径列表，区分本地和远程路径
     
     Args:
-        targets: 目标路径列表，远程路径格式为 (用户名, IP, 路径, 密码, 端口) 元组
+        targets: 目标路径列表，远程路径格式为 (用户名, IP, 路径, 密码, 端口) 元组，
+            可以追加第六个元素作为该目标单独的选项字典（如 {'compression': 'auto'}）
+        remote_options: 合并到每个远程目标配置中的传输选项（如 delta_threshold、compression）
         
     Returns:
         解析后的目标配置列表
@@ -34,8 +41,10 @@ def parse_targets(targets):
     parsed_targets = []
     for target in targets:
         if isinstance(target, tuple):  # 远程路径
-            username, server_ip, remote_path, password, port = target
+            username, server_ip, remote_path, password, port, *extra = target
             parsed_targets.append({
+                **(remote_options or {}),
+                **(extra[0] if extra else {}),
                 'remote': True,
                 'server': f"{username}@{server_ip}",
                 'path': remote_path,
@@ -49,75 +58,144 @@ def parse_targets(targets):
             })
     return parsed_targets
 
-def sync_to_local(source_path, destination_path):
+def describe_target(target):
+    """生成目标的显示名称
+
+    Args:
+        target: parse_targets 解析后的目标配置
+
+    Returns:
+        str: 远程目标为 用户名@服务器:路径，本地目标为路径
+    """
+    if target['remote']:
+        return f"{target['server']}:{target['path']}"
+    return target['path']
+
+def run_with_session(target, pool, func):
+    """在目标的 SSH 会话上执行 func(session)
+
+    Args:
+        target: 目标配置
+        pool: SSH 连接池，为 None 时使用一次性连接
+        func: 接收会话作为参数的函数
+
+    Returns:
+        func 的返回值
+    """
+    if pool is not None:
+        return pool.call(target, func)
+    pool = SSHConnectionPool(idle_timeout=0, multiplex=False)
+    try:
+        return pool.call(target, func)
+    finally:
+        pool.close_all()
+
+def sync_to_local(source_path, destination_path, copier=None):
     """同步到本地目标目录
     
     Args:
         source_path: 源文件路径
         destination_path: 目标文件路径
+        copier: LocalCopier，为 None 时使用一次性的复制引擎
+        
+    Returns:
+        str: 使用的复制方式，目标文件已一致时为 'skipped'
     """
-    os.makedirs(os.path.dirname(destination_path), exist_ok=True)
-    try:
-        import shutil
-        # print(f"复制文件: {source_path} -> {destination_path}")
-        shutil.copy2(source_path, destination_path)
-    except Exception as e:
-        raise
+    if copier is None:
+        copier = LocalCopier()
+    # print(f"复制文件: {source_path} -> {destination_path}")
+    return copier.copy(source_path, destination_path)
 
-def sync_to_remote(source_path, remote_path, target):
-    """同步到远程服务器，有密码时使用paramiko，无密码时使用scp"""
+def sync_to_remote(source_path, remote_path, target, pool=None, progress=None):
+    """同步到远程服务器
+    
+    有密码时使用paramiko会话（SFTP上传），无密码时使用系统ssh/scp（依赖SSH密钥，不指定端口），
+    两者都从连接池中获取，同一目标的连接在多个文件之间复用。
+    文件大小超过 target['delta_threshold'] 且远程已有旧版本时，只传输变化的分块。
+    target['compression'] 为 'auto' 时按文件类型选择压缩算法边压缩边传输。
+    文件大小超过 target['resumable_threshold'] 时分块上传到临时文件，中断后可以续传。
+    
+    Args:
+        source_path: 源文件路径
+        remote_path: 远程文件路径
+        target: 目标配置
+        pool: SSH 连接池，为 None 时使用一次性连接
+        progress: 保存分块上传进度的 SyncStateStore，为 None 时进度只保存在内存中（重连后可续传）
+
+    Returns:
+        dict: 传输统计 {'method': 'delta' / 'resumable' / 'compressed' / 'full', 'size': 文件字节数,
+            'sent_bytes': 实际发送的字节数}，压缩传输时另外包含 'codec' 和 'level'
+    """
     file_path = None
     is_temp_file = False
     
     try:
-        server = target['server'].split('@')[1]
-        if '#' in server:  # 如果服务器地址中包含端口，需要去掉
-            server = server.split('#')[0]
-        
         # 转换行尾符号
         file_path, is_temp_file = convert_line_endings(source_path, target_os='linux')
+        if is_temp_file:
+            # 临时文件沿用源文件的修改时间，上传后远程文件的修改时间与源文件一致
+            src_st = os.stat(source_path)
+            os.utime(file_path, ns=(src_st.st_atime_ns, src_st.st_mtime_ns))
         
-        # 如果提供了密码，使用paramiko
-        if target.get('password'):
-            ssh = paramiko.SSHClient()
-            ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            try:
-                ssh.connect(
-                    server,
-                    port=target['port'],
-                    username=target['server'].split('@')[0],
-                    password=target['password']
-                )
-                
-                sftp = ssh.open_sftp()
-                remote_dir = os.path.dirname(remote_path)
-                mkdir_cmd = f"mkdir -p '{remote_dir}'"
-                # print(f"执行远程命令: {mkdir_cmd}")
-                
-                # 同步执行目录创建命令并检查结果
-                stdin, stdout, stderr = ssh.exec_command(mkdir_cmd)
-                exit_code = stdout.channel.recv_exit_status()  # 等待命令执行完成
-                if exit_code != 0:
-                    error_msg = stderr.read().decode().strip()
-                    raise Exception(f"远程目录创建失败 (退出码: {exit_code}): {error_msg}")
-                
-                # print(f"上传文件: {file_path} -> {target['server']}:{remote_path}")
-                sftp.put(file_path, remote_path)
-            finally:
-                ssh.close()
-        
-        # 如果没有提供密码，使用scp（依赖SSH密钥），不指定端口
-        else:
-            # 创建远程目录
-            remote_dir = os.path.dirname(remote_path)
-            mkdir_cmd = f"ssh {target['server']} \"mkdir -p '{remote_dir}'\""
-            # print(f"执行命令: {mkdir_cmd}")
-            subprocess.run(mkdir_cmd, shell=True, check=True)
-            
-            # 执行scp命令
-            scp_cmd = f"scp \"{file_path}\" \"{target['server']}:{remote_path}\""
-            # print(f"执行命令: {scp_cmd}")
-            subprocess.run(scp_cmd, shell=True, check=True)
+        remote_dir = os.path.dirname(remote_path)
+        mkdir_cmd = f"mkdir -p '{remote_dir}'"
+
+        delta_threshold = target.get('delta_threshold')
+        size = os.path.getsize(file_path)
+        use_delta = bool(delta_threshold) and size >= delta_threshold
+        codec = choose_codec(file_path, size) if target.get('compression') == 'auto' else None
+        resumable_threshold = target.get('resumable_threshold')
+        use_resumable = bool(resumable_threshold) and size >= resumable_threshold
+        if use_resumable and progress is None:
+            progress = SyncStateStore(None)
+        source_mode = os.stat(source_path).st_mode
+
+        def upload(session):
+            # 大文件优先尝试增量传输，远程文件不存在或失败时整体上传
+            if use_delta:
+                try:
+                    stats = delta_upload(session, file_path, remote_path)
+                except CONNECTION_ERRORS:
+                    raise
+                except Exception as e:
+                    print(f"增量传输失败，改为整体上传: {e}")
+                    stats = None
+                if stats is not None:
+                    print(f"增量传输: {remote_path} 发送 {stats['delta_bytes']} / {stats['size']} 字节")
+                    return {'method': 'delta', 'size': stats['size'], 'sent_bytes': stats['delta_bytes']}
+
+            # 大文件分块上传，连接断开后连接池重试时从已完成的分块继续
+            if use_resumable:
+                stats = resumable_upload(session, file_path, remote_path, progress, upload_key(target, remote_path),
+                                         chunk_size=target.get('resumable_chunk_size') or 8 * 1024 * 1024,
+                                         parallel=target.get('resumable_parallel') or 1, mode=source_mode)
+                print(f"分块上传: {remote_path} 发送 {stats['sent_bytes']} / {stats['size']} 字节")
+                return {'method': 'resumable', 'size': stats['size'], 'sent_bytes': stats['sent_bytes']}
+
+            # 启用压缩时，值得压缩的文件边压缩边传输，失败时整体上传
+            if codec is not None:
+                try:
+                    stats = compressed_upload(session, file_path, remote_path, *codec, mode=source_mode)
+                except CONNECTION_ERRORS:
+                    raise
+                except Exception as e:
+                    print(f"压缩传输失败，改为整体上传: {e}")
+                    stats = None
+                if stats is not None:
+                    # 节省的字节数由调用方写入传输日志
+                    return dict(stats, method='compressed')
+
+            # print(f"执行远程命令: {mkdir_cmd}")
+            # 同步执行目录创建命令并检查结果
+            exit_code, _, error_msg = session.run(mkdir_cmd)
+            if exit_code != 0:
+                raise Exception(f"远程目录创建失败 (退出码: {exit_code}): {error_msg.strip()}")
+
+            # print(f"上传文件: {file_path} -> {target['server']}:{remote_path}")
+            session.put(file_path, remote_path)
+            return {'method': 'full', 'size': size, 'sent_bytes': size}
+
+        return run_with_session(target, pool, upload)
             
     except (subprocess.CalledProcessError, paramiko.SSHException) as e:
         print(f"远程同步失败: {e}")
@@ -127,6 +205,30 @@ def sync_to_remote(source_path, remote_path, target):
         if file_path and is_temp_file:
             cleanup_temp_file(file_path, is_temp_file)
 
+def bulk_sync_to_remote(files, target, pool=None):
+    """把多个文件打包为一个 tar 流同步到远程服务器（一次远程命令）
+    
+    Args:
+        files: (源文件路径, 相对路径) 列表
+        target: 目标配置
+        pool: SSH 连接池，为 None 时使用一次性连接
+        
+    Returns:
+        dict: {'packed': 已上传的源文件路径列表, 'bytes': 文件内容字节数, 'sent_bytes': 实际发送的字节数,
+            'compressed': 是否压缩传输}
+    """
+    try:
+        compress = target.get('compression') == 'auto'
+        result = run_with_session(target, pool, lambda session: bulk_upload(session, target['path'], files, compress))
+    except (subprocess.CalledProcessError, paramiko.SSHException) as e:
+        print(f"远程批量同步失败: {e}")
+        raise
+    return dict(result, compressed=compress)
+
+@lru_cache(maxsize=32)
+def _get_matcher(source_dir, ignore_patterns, only_sync_files, log_file):
+    return PathMatcher(source_dir, ignore_patterns, only_sync_files, log_file)
+
 def should_ignore_file(file_path, source_dir, ignore_patterns, only_sync_files, log_file):
     """检查文件是否应该被忽略
     根据配置文件中的 ignore_patterns 和 only_sync_files 进行判断
@@ -141,14 +243,9 @@ def should_ignore_file(file_path, source_dir, ignore_patterns, only_sync_files,
     Returns:
         bool: 是否应该忽略该文件
     """
-    if os.path.abspath(file_path) == os.path.abspath(log_file):
-        return True
-    
-    relative_path = os.path.relpath(file_path, source_dir)
-    if only_sync_files:
-        return not any(fnmatch(relative_path, pattern) for pattern in only_sync_files)
-    
-    return any(fnmatch(relative_path, pattern) for pattern in ignore_patterns)
+    matcher = _get_matcher(os.path.abspath(source_dir), tuple(ignore_patterns or ()),
+                           tuple(only_sync_files or ()), log_file)
+    return matcher.ignores(file_path)
 
 def delete_from_local(destination_path):
     """从本地目标目录删除文件
@@ -169,60 +266,79 @@ def delete_from_local(destination_path):
         print(f"删除本地文件失败: {e}")
         raise
 
-def delete_from_remote(remote_path, target):
-    """从远程服务器删除文件
+def delete_from_remote(remote_path, target, pool=None):
+    """从远程服务器删除文件（目录为空时一并删除）
     
     Args:
         remote_path: 远程文件路径
         target: 目标配置
+        pool: SSH 连接池，为 None 时使用一次性连接
     """
+    delete_many_from_remote([remote_path], target, pool=pool, cleanup_dirs=[os.path.dirname(remote_path)])
+
+# 批量删除脚本中每条 rm 命令包含的路径数
+DELETE_CHUNK = 200
+
+def delete_many_from_remote(remote_paths, target, pool=None, cleanup_dirs=()):
+    """通过一个远程命令删除多个文件或目录，再自底向上删除变空的目录
+
+    删除脚本通过标准输入交给远程的 sh 执行，只占用一个通道，删除失败时退出码不为 0。
+
+    Args:
+        remote_paths: 远程文件或目录路径列表
+        target: 目标配置
+        pool: SSH 连接池，为 None 时使用一次性连接
+        cleanup_dirs: 删除后如果为空就删除的远程目录（按深度从深到浅依次尝试）
+    """
+    if not remote_paths:
+        return
+    lines = ["set -e"]
+    for i in range(0, len(remote_paths), DELETE_CHUNK):
+        lines.append("rm -rf -- " + " ".join(shlex.quote(path) for path in remote_paths[i:i + DELETE_CHUNK]))
+    for directory in sorted(set(cleanup_dirs), key=lambda d: d.count('/'), reverse=True):
+        lines.append(f"rmdir -- {shlex.quote(directory)} 2>/dev/null || true")
+    script = "\n".join(lines) + "\n"
     try:
-        server = target['server'].split('@')[1]
-        if '#' in server:  # 如果服务器地址中包含端口，需要去掉
-            server = server.split('#')[0]
-        
-        # 如果提供了密码，使用paramiko
-        if target.get('password'):
-            ssh = paramiko.SSHClient()
-            ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            try:
-                ssh.connect(
-                    server,
-                    port=target['port'],
-                    username=target['server'].split('@')[0],
-                    password=target['password']
-                )
-                
-                # 删除远程文件
-                rm_cmd = f"rm -f '{remote_path}'"
-                print(f"执行远程命令: {rm_cmd}")
-                ssh.exec_command(rm_cmd)
-                
-                # 如果目录为空，删除目录
-                remote_dir = os.path.dirname(remote_path)
-                rmdir_cmd = f"rmdir '{remote_dir}' 2>/dev/null || true"
-                print(f"执行远程命令: {rmdir_cmd}")
-                ssh.exec_command(rmdir_cmd)
-            finally:
-                ssh.close()
-        
-        # 如果没有提供密码，使用ssh命令（依赖SSH密钥）
-        else:
-            # 删除远程文件
-            rm_cmd = f"ssh {target['server']} \"rm -f '{remote_path}'\""
-            print(f"执行命令: {rm_cmd}")
-            subprocess.run(rm_cmd, shell=True, check=True)
-            
-            # 如果目录为空，删除目录
-            remote_dir = os.path.dirname(remote_path)
-            rmdir_cmd = f"ssh {target['server']} \"rmdir '{remote_dir}' 2>/dev/null || true\""
-            print(f"执行命令: {rmdir_cmd}")
-            subprocess.run(rmdir_cmd, shell=True, check=True)
-            
+        def remove(session):
+            print(f"执行远程批量删除: {target['server']} {len(remote_paths)} 个路径")
+            exit_code, out, err = session.run("sh -s", stdin=script.encode('utf-8'))
+            if exit_code != 0:
+                raise subprocess.CalledProcessError(exit_code, "sh -s", out, err)
+
+        run_with_session(target, pool, remove)
+
     except (subprocess.CalledProcessError, paramiko.SSHException) as e:
         print(f"删除远程文件失败: {e}")
         raise
 
+def delete_many_from_local(destination_paths, cleanup_dirs=()):
+    """删除本地目标中的多个文件或目录，再自底向上删除变空的目录
+
+    Args:
+        destination_paths: 文件或目录路径列表
+        cleanup_dirs: 删除后如果为空就删除的目录（按深度从深到浅依次尝试）
+    """
+    import shutil
+    try:
+        for path in destination_paths:
+            try:
+                if os.path.isdir(path) and not os.path.islink(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+            except FileNotFoundError:
+                # 已经不存在（如所在目录已被同时处理的删除事件删除）
+                pass
+    except Exception as e:
+        print(f"删除本地文件失败: {e}")
+        raise
+    for directory in sorted(set(cleanup_dirs), key=lambda d: d.count(os.sep), reverse=True):
+        try:
+            os.rmdir(directory)
+            print(f"删除空目录: {directory}")
+        except OSError:
+            pass
+
 def delete_from_local_dir(destination_path):
     """从本地目标目录删除目录
     
@@ -238,44 +354,73 @@ def delete_from_local_dir(destination_path):
         print(f"删除本地目录失败: {e}")
         raise
 
-def delete_from_remote_dir(remote_path, target):
+def delete_from_remote_dir(remote_path, target, pool=None):
     """从远程服务器删除目录
     
     Args:
         remote_path: 远程目录路径
         target: 目标配置
+        pool: SSH 连接池，为 None 时使用一次性连接
     """
+    delete_many_from_remote([remote_path], target, pool=pool)
+
+def move_in_local(source_path, destination_path, is_directory=False):
+    """在本地目标目录中移动（重命名）文件或目录
+
+    Args:
+        source_path: 目标中的原路径
+        destination_path: 目标中的新路径
+        is_directory: 是否为目录
+
+    Returns:
+        bool: 是否已移动；原路径不存在或目标目录已存在且不为空时返回 False，由调用方改为复制
+    """
+    if not os.path.lexists(source_path):
+        return False
+    if is_directory and os.path.isdir(destination_path) and os.listdir(destination_path):
+        return False
     try:
-        server = target['server'].split('@')[1]
-        if '#' in server:  # 如果服务器地址中包含端口，需要去掉
-            server = server.split('#')[0]
-        
-        # 如果提供了密码，使用paramiko
-        if target.get('password'):
-            ssh = paramiko.SSHClient()
-            ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            try:
-                ssh.connect(
-                    server,
-                    port=target['port'],
-                    username=target['server'].split('@')[0],
-                    password=target['password']
-                )
-                
-                # 删除远程目录
-                rm_cmd = f"rm -rf '{remote_path}'"
-                print(f"执行远程命令: {rm_cmd}")
-                ssh.exec_command(rm_cmd)
-            finally:
-                ssh.close()
-        
-        # 如果没有提供密码，使用ssh命令（依赖SSH密钥）
-        else:
-            # 删除远程目录
-            rm_cmd = f"ssh {target['server']} \"rm -rf '{remote_path}'\""
-            print(f"执行命令: {rm_cmd}")
-            subprocess.run(rm_cmd, shell=True, check=True)
-            
+        os.makedirs(os.path.dirname(destination_path), exist_ok=True)
+        print(f"移动本地{'目录' if is_directory else '文件'}: {source_path} -> {destination_path}")
+        os.replace(source_path, destination_path)
+        return True
+    except Exception as e:
+        print(f"移动本地{'目录' if is_directory else '文件'}失败: {e}")
+        raise
+
+def move_in_remote(remote_source, remote_destination, target, pool=None, is_directory=False):
+    """在远程服务器上移动（重命名）文件或目录
+
+    Args:
+        remote_source: 远程原路径
+        remote_destination: 远程新路径
+        target: 目标配置
+        pool: SSH 连接池，为 None 时使用一次性连接
+        is_directory: 是否为目录
+
+    Returns:
+        bool: 是否已移动；远程原路径不存在或目标目录已存在时返回 False，由调用方改为上传
+    """
+    source = shlex.quote(remote_source)
+    destination = shlex.quote(remote_destination)
+    parent = shlex.quote(os.path.dirname(remote_destination) or '.')
+    # 退出码 3 表示无法直接移动（目录已存在时 mv 会移动到目录内部，不能使用）
+    if is_directory:
+        mv_cmd = f"[ -e {source} ] && [ ! -e {destination} ] || exit 3; mkdir -p {parent} && mv {source} {destination}"
+    else:
+        mv_cmd = f"[ -e {source} ] || exit 3; mkdir -p {parent} && mv -f {source} {destination}"
+    try:
+        def move(session):
+            print(f"执行远程命令: {mv_cmd}")
+            exit_code, out, err = session.run(mv_cmd)
+            if exit_code == 3:
+                return False
+            if exit_code != 0:
+                raise subprocess.CalledProcessError(exit_code, mv_cmd, out, err)
+            return True
+
+        return run_with_session(target, pool, move)
+
     except (subprocess.CalledProcessError, paramiko.SSHException) as e:
-        print(f"删除远程目录失败: {e}")
+        print(f"移动远程{'目录' if is_directory else '文件'}失败: {e}")
         raise
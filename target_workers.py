@@ -0,0 +1,121 @@
+import time
+import queue
+import threading
+from concurrent.futures import Future
+
+class TargetBusyError(Exception):
+    """目标的任务队列已满"""
+
+class TargetFuture(Future):
+    """记录提交时间和开始执行时间的 Future"""
+
+    def __init__(self):
+        super().__init__()
+        self.submitted_at = time.monotonic()
+        self.started_at = None
+        self._started = threading.Event()
+
+    def _mark_started(self):
+        self.started_at = time.monotonic()
+        self._started.set()
+
+    def wait_started(self, timeout=None):
+        """等待任务开始执行
+
+        Returns:
+            bool: 任务是否已开始执行（或已结束）
+        """
+        return self._started.wait(timeout) or self.done()
+
+class TargetWorker:
+    """单个同步目标的工作线程组
+
+    每个目标拥有独立的有界队列和固定数量的工作线程，慢速或故障的目标只会占满自己的队列，
+    不会拖慢其他目标。
+    """
+
+    def __init__(self, name, concurrency=1, queue_size=64):
+        """
+        Args:
+            name: 目标名称（用于线程名和日志）
+            concurrency: 该目标同时执行的任务数
+            queue_size: 队列中最多等待的任务数
+        """
+        self.name = name
+        self.concurrency = max(1, concurrency)
+        self._queue = queue.Queue(maxsize=max(1, queue_size))
+        self._threads = []
+        self._lock = threading.Lock()
+        self._closed = False
+        # 正在执行的任务数
+        self._running = 0
+
+    def _start(self):
+        """懒启动工作线程"""
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.concurrency):
+                thread = threading.Thread(target=self._run, name=f"target-{self.name}-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            future, func, args, kwargs = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            future._mark_started()
+            with self._lock:
+                self._running += 1
+            try:
+                future.set_result(func(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                with self._lock:
+                    self._running -= 1
+
+    def submit(self, func, *args, **kwargs):
+        """提交任务，队列已满时返回带 TargetBusyError 异常的 Future 而不阻塞调用方
+
+        Returns:
+            TargetFuture: 任务结果
+        """
+        future = TargetFuture()
+        if self._closed:
+            future.set_exception(RuntimeError(f"目标工作线程已关闭: {self.name}"))
+            return future
+        self._start()
+        try:
+            self._queue.put_nowait((future, func, args, kwargs))
+        except queue.Full:
+            future.set_exception(TargetBusyError(f"目标任务队列已满: {self.name}"))
+        return future
+
+    def queue_depth(self):
+        """当前排队和正在执行的任务数"""
+        with self._lock:
+            running = self._running
+        return self._queue.qsize() + running
+
+    def close(self, timeout=None):
+        """停止工作线程，等待已排队的任务完成
+
+        Args:
+            timeout: 每个线程的最长等待时间（秒），None 表示一直等待
+        """
+        with self._lock:
+            self._closed = True
+            threads = list(self._threads)
+        for _ in threads:
+            try:
+                self._queue.put_nowait(None)
+            except queue.Full:
+                # 队列被卡住的任务占满时不再等待，工作线程是守护线程
+                break
+        for thread in threads:
+            thread.join(timeout)
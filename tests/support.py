@@ -0,0 +1,14 @@
+"""测试共用的辅助类"""
+import os
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from ssh_pool import LocalShellSession, SSHConnectionPool
+
+class LocalShellPool(SSHConnectionPool):
+    """所有目标都使用 LocalShellSession 的连接池（把本地目录当作远程目标）"""
+
+    def _create_session(self, target):
+        return LocalShellSession(target)
@@ -0,0 +1,93 @@
+"""删除事件的批量处理测试：通过文件监控删除整个目录树，远程目标只执行一次批量删除
+
+用法:
+    python -m pytest tests
+"""
+import io
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+import contextlib
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from support import LocalShellPool
+import file_handler
+from file_handler import FileHandler
+from watch_manager import WatchManager
+
+class BatchedDeleteTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='delete-test-')
+        self.source = os.path.join(self.dir, 'src')
+        self.dest = os.path.join(self.dir, 'dst')
+        for relative_dir in ('tree', 'tree/a', 'tree/a/b', 'tree/c'):
+            for root in (self.source, self.dest):
+                os.makedirs(os.path.join(root, relative_dir))
+                for i in range(20):
+                    with open(os.path.join(root, relative_dir, f'f{i}.txt'), 'w') as f:
+                        f.write(str(i))
+        config = {
+            'source_dir': self.source,
+            'targets': [('user', 'localhost', self.dest, None, None)],
+            'log_file': os.path.join(self.dir, '_sync_log.txt'),
+            'last_sync_file': os.path.join(self.dir, '_last_sync.json'),
+            'sync_state_file': os.path.join(self.dir, '_sync_state.db'),
+            'ignore_patterns': [],
+            'only_sync_files': [],
+            'mode': 3,
+            'debounce_seconds': 0.3,
+            'event_workers': 2,
+        }
+        self.output = io.StringIO()
+        with contextlib.redirect_stdout(self.output):
+            self.handler = FileHandler(config, 'test')
+        self.handler.ssh_pool.close_all()
+        self.handler.ssh_pool = LocalShellPool(idle_timeout=0)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_rmtree_is_one_remote_delete(self):
+        tree = os.path.join(self.source, 'tree')
+        # 名称以 tree 开头的同级路径不在被删除的目录下
+        sibling = os.path.join(self.source, 'tree0.txt')
+        with open(sibling, 'w') as f:
+            f.write('keep')
+        with self.handler.state.batch():
+            for root, _, files in os.walk(self.source):
+                for name in files:
+                    self.handler.state.upsert(os.path.abspath(os.path.join(root, name)), {'hash': name})
+        watch_manager = WatchManager()
+        with mock.patch.object(file_handler, 'delete_many_from_remote',
+                               wraps=file_handler.delete_many_from_remote) as delete_many, \
+                contextlib.redirect_stdout(self.output):
+            self.handler.start()
+            watch_manager.add(self.handler)
+            try:
+                shutil.rmtree(tree)
+                deadline = time.time() + 10
+                while time.time() < deadline and (os.path.exists(os.path.join(self.dest, 'tree'))
+                                                   or len(self.handler.events)):
+                    time.sleep(0.1)
+                # 等待可能的后续批次
+                time.sleep(1)
+                remaining = [path for path, _ in self.handler.state.items()]
+            finally:
+                watch_manager.stop()
+                watch_manager.join()
+                self.handler.close()
+
+        self.assertFalse(os.path.exists(os.path.join(self.dest, 'tree')))
+        self.assertEqual(delete_many.call_count, 1)
+        remote_paths = delete_many.call_args.args[0]
+        self.assertEqual(remote_paths, [os.path.join(self.dest, 'tree')])
+        # 目录下的同步记录全部删除
+        self.assertEqual(remaining, [os.path.abspath(sibling)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+"""增量传输的端到端测试：把本地目录当作远程目标，通过 LocalShellSession 运行远程辅助脚本
+
+用法:
+    python -m pytest tests
+"""
+import os
+import sys
+import io
+import random
+import shutil
+import tempfile
+import unittest
+import contextlib
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from support import LocalShellPool
+import delta_transfer
+from delta_transfer import delta_upload, choose_block_size
+from ssh_pool import LocalShellSession
+from sync_utils import sync_to_remote
+
+SIZE = 3 * 1024 * 1024
+
+def random_bytes(size, seed):
+    # 不含 \r，避免行尾转换改变内容
+    return random.Random(seed).randbytes(size).replace(b'\r', b'\n')
+
+class DeltaTransferTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='delta-test-')
+        self.local = os.path.join(self.dir, 'local.bin')
+        self.remote = os.path.join(self.dir, 'remote', 'data.bin')
+        os.makedirs(os.path.dirname(self.remote))
+        self.session = LocalShellSession()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def write(self, path, data):
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    def read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_small_edit_sends_only_changed_blocks(self):
+        original = random_bytes(SIZE, 1)
+        self.write(self.remote, original)
+        changed = bytearray(original)
+        changed[1000000:1000010] = b'x' * 10
+        # 插入的数据会让之后的分块错位，需要滚动校验和重新对齐
+        changed[2000000:2000000] = b'inserted'
+        self.write(self.local, bytes(changed))
+        os.utime(self.local, (1600000000, 1600000000))
+
+        stats = delta_upload(self.session, self.local, self.remote)
+
+        self.assertIsNotNone(stats)
+        self.assertEqual(self.read(self.remote), bytes(changed))
+        self.assertEqual(os.path.getmtime(self.remote), 1600000000)
+        self.assertLess(stats['delta_bytes'], 4 * choose_block_size(SIZE))
+        self.assertEqual(stats['literal_bytes'] + stats['matched_bytes'], len(changed))
+
+    def test_truncated_tail_matches_last_block(self):
+        original = random_bytes(SIZE + 1234, 2)
+        self.write(self.remote, original)
+        self.write(self.local, original[:-1234 - choose_block_size(SIZE)] + original[-1234:])
+
+        stats = delta_upload(self.session, self.local, self.remote)
+
+        self.assertIsNotNone(stats)
+        self.assertEqual(self.read(self.remote), self.read(self.local))
+        self.assertEqual(stats['literal_bytes'], 0)
+
+    def test_rewritten_file_falls_back(self):
+        original = random_bytes(SIZE, 3)
+        self.write(self.remote, original)
+        self.write(self.local, random_bytes(SIZE, 4))
+
+        self.assertIsNone(delta_upload(self.session, self.local, self.remote))
+        self.assertEqual(self.read(self.remote), original)
+
+    def test_missing_remote_file_falls_back(self):
+        self.write(self.local, random_bytes(SIZE, 5))
+        self.assertIsNone(delta_upload(self.session, self.local, self.remote))
+        self.assertFalse(os.path.exists(self.remote))
+
+    def test_large_file_falls_back(self):
+        original = random_bytes(SIZE, 7)
+        self.write(self.remote, original)
+        self.write(self.local, original + b'appended')
+
+        with mock.patch.object(delta_transfer, 'MAX_DELTA_SIZE', SIZE):
+            self.assertIsNone(delta_upload(self.session, self.local, self.remote))
+        self.assertEqual(self.read(self.remote), original)
+
+    def test_sync_to_remote(self):
+        target = {'server': 'localhost', 'port': 0, 'password': None, 'delta_threshold': 1024 * 1024}
+        pool = LocalShellPool(idle_timeout=0)
+        try:
+            # 远程没有旧版本时整体上传，之后的修改只传输变化的分块
+            data = random_bytes(SIZE, 6)
+            self.write(self.local, data)
+            sync_to_remote(self.local, self.remote, target, pool)
+            self.assertEqual(self.read(self.remote), data)
+
+            changed = data[:SIZE // 2] + b'edited' + data[SIZE // 2:]
+            self.write(self.local, changed)
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                sync_to_remote(self.local, self.remote, target, pool)
+            self.assertEqual(self.read(self.remote), changed)
+            self.assertIn('增量传输', output.getvalue())
+        finally:
+            pool.close_all()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+"""目录索引测试：扫描、保存索引，以及运行期间同步成功/失败的文件对下次扫描的影响
+
+用法:
+    python -m pytest tests
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import support  # noqa: F401  把仓库目录加入 sys.path
+from dir_index import DirectoryIndex
+from path_matcher import PathMatcher
+from sync_state import SqliteSyncState
+
+FILES = ['top.txt', 'a/a1.txt', 'a/b/b1.txt', 'a/b/b2.txt', 'c/c1.txt']
+
+class DirectoryIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='index-test-')
+        self.source = os.path.join(self.dir, 'src')
+        for relative_path in FILES:
+            self.write(relative_path, relative_path)
+        # 修改时间在模糊区间之外，签名才会被记录
+        self.old = time.time_ns() - 100 * 10 ** 9
+        for relative_path in FILES:
+            os.utime(self.path(relative_path), ns=(self.old, self.old))
+        for relative_dir in ('a/b', 'a', 'c', ''):
+            os.utime(self.path(relative_dir), ns=(self.old, self.old))
+        self.state = SqliteSyncState(os.path.join(self.dir, '_sync_state.db'), 'cfg')
+        self.matcher = PathMatcher(self.source, [], [])
+
+    def tearDown(self):
+        self.state.close()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def path(self, relative_path):
+        return os.path.join(self.source, relative_path.replace('/', os.sep)) if relative_path else self.source
+
+    def write(self, relative_path, content):
+        os.makedirs(os.path.dirname(self.path(relative_path)), exist_ok=True)
+        with open(self.path(relative_path), 'w') as f:
+            f.write(content)
+
+    def scan(self, trust_mtime=False, failed=()):
+        """用新的索引对象扫描（相当于重新启动），返回需要检查的文件和统计"""
+        index = DirectoryIndex(self.state, self.matcher, trust_mtime)
+        checked = sorted(os.path.relpath(entry.path, self.source).replace(os.sep, '/') for entry in index.scan())
+        return checked, index.commit(failed=[self.path(p) for p in failed])
+
+    def digests(self):
+        return {path: entry['digest'] for path, entry in self.state.dir_items()}
+
+    def test_unchanged_tree_is_skipped(self):
+        checked, stats = self.scan()
+        self.assertEqual(checked, sorted(FILES))
+        self.assertFalse(stats['unchanged'])
+
+        for trust_mtime in (False, True):
+            checked, stats = self.scan(trust_mtime)
+            self.assertEqual(checked, [])
+            self.assertTrue(stats['unchanged'])
+            self.assertEqual(stats['skipped_files'], len(FILES))
+        self.assertEqual(stats['trusted_dirs'], 4)
+
+    def test_failed_file_is_checked_again(self):
+        self.scan()
+        synced = self.digests()
+        checked, stats = self.scan(failed=['a/b/b1.txt'])
+        self.assertEqual(checked, [])
+        self.assertEqual(stats['changed_dirs'], 3)
+
+        # 祖先目录的聚合哈希都发生变化，同级目录不变
+        failed = self.digests()
+        for relative_dir in (os.path.join('a', 'b'), 'a', ''):
+            self.assertNotEqual(failed[relative_dir], synced[relative_dir])
+        self.assertEqual(failed['c'], synced['c'])
+
+        # 无论是否信任目录修改时间，失败的文件都不会被跳过
+        for trust_mtime in (False, True):
+            checked, _ = self.scan(trust_mtime, failed=['a/b/b1.txt'])
+            self.assertEqual(checked, ['a/b/b1.txt'])
+
+        # 同步成功后恢复
+        checked, _ = self.scan()
+        self.assertEqual(checked, ['a/b/b1.txt'])
+        self.assertEqual(self.digests(), synced)
+        checked, stats = self.scan(True)
+        self.assertEqual(checked, [])
+        self.assertTrue(stats['unchanged'])
+
+    def test_file_failed_at_runtime(self):
+        self.scan()
+        synced = self.digests()
+
+        index = DirectoryIndex(self.state, self.matcher)
+        index.file_failed(self.path('a/b/b1.txt'))
+        index.flush()
+
+        # 所在目录和所有祖先的聚合哈希失效，其他目录不受影响
+        digests = self.digests()
+        for relative_dir in (os.path.join('a', 'b'), 'a', ''):
+            self.assertIsNone(digests[relative_dir])
+        self.assertEqual(digests['c'], synced['c'])
+
+        checked, stats = self.scan(True, failed=['a/b/b1.txt'])
+        self.assertEqual(checked, ['a/b/b1.txt'])
+        self.assertFalse(stats['unchanged'])
+        self.assertEqual(stats['changed_dirs'], 3)
+        checked, _ = self.scan(False, failed=['a/b/b1.txt'])
+        self.assertEqual(checked, ['a/b/b1.txt'])
+
+    def test_file_synced_at_runtime(self):
+        self.scan()
+
+        # 运行期间原地修改（目录修改时间不变）并同步完成
+        self.write('a/b/b2.txt', 'changed content')
+        os.utime(self.path('a/b/b2.txt'), ns=(self.old + 10 ** 9, self.old + 10 ** 9))
+        index = DirectoryIndex(self.state, self.matcher)
+        index.file_synced(self.path('a/b/b2.txt'), os.stat(self.path('a/b/b2.txt')))
+        index.flush()
+        self.assertIsNone(self.digests()['a'])
+
+        for trust_mtime in (True, False):
+            checked, _ = self.scan(trust_mtime)
+            self.assertEqual(checked, [])
+        self.assertNotIn(None, self.digests().values())
+
+    def test_changed_file_is_checked(self):
+        self.scan()
+        self.write('c/c1.txt', 'modified')
+        os.utime(self.path('c/c1.txt'), ns=(self.old + 10 ** 9, self.old + 10 ** 9))
+
+        checked, stats = self.scan()
+        self.assertEqual(checked, ['c/c1.txt'])
+        self.assertEqual(stats['changed_dirs'], 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,160 @@
+"""事件队列测试：后沿防抖、目录范围事件与其下事件的顺序、丢弃和关闭
+
+使用可控的时钟，不依赖真实的等待时间。
+
+用法:
+    python -m pytest tests
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import support  # noqa: F401  把仓库目录加入 sys.path
+from event_queue import CoalescingEventQueue
+
+def directory_scope(kind, payload):
+    return kind == 'created'
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+class EventQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.queue = CoalescingEventQueue(delay=1.0, clock=self.clock)
+
+    def advance(self, seconds):
+        self.clock.now += seconds
+
+    def poll(self, **kwargs):
+        return self.queue.get_batch(block=False, **kwargs)
+
+    def keys(self, batch):
+        return sorted(key for key, _, _ in batch)
+
+    def test_burst_yields_one_batch(self):
+        for i in range(5):
+            self.queue.put('a.txt', 'modified', {'version': i})
+            self.queue.put('b.txt', 'modified', {'version': i})
+            self.advance(0.2)
+        # 最后一次事件之后还没有经过防抖时间
+        self.advance(0.7)
+        self.assertEqual(self.poll(), [])
+
+        self.advance(0.1)
+        batch = self.poll()
+        self.assertEqual(self.keys(batch), ['a.txt', 'b.txt'])
+        self.assertEqual([payload for _, _, payload in batch], [{'version': 4}, {'version': 4}])
+        self.assertEqual(self.queue.coalesced_count, 8)
+        self.assertEqual(len(self.queue), 0)
+
+    def test_merge_function(self):
+        self.queue.put('a.txt', 'moved', {'n': 1})
+        self.queue.put('a.txt', 'modified', {'n': 2},
+                       merge=lambda old_kind, old_payload, kind, payload: (old_kind, old_payload))
+        self.advance(1)
+        self.assertEqual(self.poll(), [('a.txt', 'moved', {'n': 1})])
+
+    def test_in_flight_key_is_not_handed_out_again(self):
+        self.queue.put('a.txt', 'modified')
+        self.advance(1)
+        self.assertEqual(self.keys(self.poll()), ['a.txt'])
+        # 处理期间到达的新事件在处理完成后才取出
+        self.queue.put('a.txt', 'modified')
+        self.advance(1)
+        self.assertEqual(self.poll(), [])
+        self.queue.done('a.txt')
+        self.assertEqual(self.keys(self.poll()), ['a.txt'])
+
+    def test_child_held_while_directory_in_flight(self):
+        child = os.path.join('d', 'e', 'x.txt')
+        sibling = os.path.join('d0', 'y.txt')
+        self.queue.put('d', 'created', scope=directory_scope)
+        self.advance(1)
+        self.assertEqual(self.keys(self.poll()), ['d'])
+
+        self.queue.put(child, 'modified')
+        self.queue.put(sibling, 'modified')
+        self.advance(1)
+        # 名称以 d 开头的同级目录不受影响
+        self.assertEqual(self.keys(self.poll()), [sibling])
+        self.assertEqual(self.poll(), [])
+        self.queue.done('d')
+        self.assertEqual(self.keys(self.poll()), [child])
+
+    def test_directory_held_while_child_in_flight(self):
+        child = os.path.join('d', 'x.txt')
+        self.queue.put(child, 'modified')
+        self.advance(1)
+        self.assertEqual(self.keys(self.poll()), [child])
+
+        self.queue.put('d', 'created', scope=directory_scope)
+        self.advance(1)
+        self.assertEqual(self.poll(), [])
+        self.queue.done(child)
+        self.assertEqual(self.keys(self.poll()), ['d'])
+
+    def test_cover_extends_pending_directory(self):
+        self.queue.put('d', 'created', scope=directory_scope)
+        self.advance(0.5)
+        self.assertTrue(self.queue.cover(os.path.join('d', 'e', 'x.txt')))
+        self.assertFalse(self.queue.cover(os.path.join('d0', 'x.txt')))
+        # 目录事件的防抖从最后一次被覆盖的事件算起
+        self.advance(0.7)
+        self.assertEqual(self.poll(), [])
+        self.advance(0.3)
+        self.assertEqual(self.keys(self.poll()), ['d'])
+        # 正在处理的目录不再覆盖新的事件
+        self.assertFalse(self.queue.cover(os.path.join('d', 'y.txt')))
+
+    def test_merged_event_loses_scope(self):
+        self.queue.put('d', 'created', scope=directory_scope)
+        self.queue.put('d', 'deleted', scope=directory_scope)
+        self.assertFalse(self.queue.cover(os.path.join('d', 'x.txt')))
+
+    def test_due_delete_takes_pending_deletes(self):
+        self.queue.put('a', 'deleted')
+        self.advance(0.6)
+        self.queue.put('b', 'deleted')
+        self.queue.put('c.txt', 'modified')
+        self.advance(0.4)
+        # a 到期时，尚未到期的删除事件一并取出，修改事件仍然等待防抖
+        batch = self.poll(max_items=64, extra_kind='deleted', extra_items=10)
+        self.assertEqual(self.keys(batch), ['a', 'b'])
+
+    def test_discard(self):
+        self.queue.put('d', 'created', scope=directory_scope)
+        self.queue.put(os.path.join('d', 'a.txt'), 'modified')
+        self.queue.put(os.path.join('d', 'b.txt'), 'deleted')
+        removed = self.queue.discard(lambda key: key.startswith(os.path.join('d', '')), kinds=('modified',))
+        self.assertEqual(removed, [(os.path.join('d', 'a.txt'), 'modified', None)])
+
+        self.assertEqual([key for key, _, _ in self.queue.discard(lambda key: key == 'd')], ['d'])
+        # 被丢弃的目录事件不再覆盖其下的事件
+        self.assertFalse(self.queue.cover(os.path.join('d', 'c.txt')))
+        self.assertEqual(len(self.queue), 1)
+
+    def test_close_drains_pending_events(self):
+        self.queue.put('a.txt', 'modified')
+        self.queue.put('b.txt', 'modified')
+        self.queue.close(drain=True)
+        # 关闭后忽略防抖时间
+        self.assertEqual(self.keys(self.poll()), ['a.txt', 'b.txt'])
+        self.assertIsNone(self.poll())
+        self.assertFalse(self.queue.put('c.txt', 'modified'))
+        self.assertIsNone(self.poll())
+
+    def test_close_without_drain_drops_events(self):
+        self.queue.put('a.txt', 'modified')
+        self.queue.close(drain=False)
+        self.assertIsNone(self.queue.get_batch())
+        self.assertEqual(len(self.queue), 0)
+
+if __name__ == '__main__':
+    unittest.main()
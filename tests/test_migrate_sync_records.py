@@ -0,0 +1,136 @@
+"""同步记录迁移工具测试：流式解析 JSON 记录，以及写入 SQLite 时不覆盖已有的记录
+
+用法:
+    python -m pytest tests
+"""
+import io
+import os
+import sys
+import json
+import shutil
+import hashlib
+import tempfile
+import unittest
+import contextlib
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import support  # noqa: F401  把仓库目录加入 sys.path
+import migrate_sync_records
+from migrate_sync_records import iter_json_records, migrate_sync_records as migrate
+from sync_state import SqliteSyncState
+
+RECORDS = {
+    '配置一': {
+        '/src/旧格式.txt': '2024-01-01 10:00:00',
+        '/src/新格式.txt': {'timestamp': '2024-01-02 10:00:00', 'md5': 'abc'},
+        '/src/引号"和\\反斜杠.txt': {'timestamp': '2024-01-03 10:00:00', 'md5': '', 'size': 12345},
+    },
+    'empty': {},
+    'cfg': {'/src/a.txt': '2024-01-04 10:00:00'},
+}
+
+class IterJsonRecordsTest(unittest.TestCase):
+    def parse(self, text):
+        return list(iter_json_records(io.StringIO(text)))
+
+    def expected(self):
+        result = []
+        for config_name, records in RECORDS.items():
+            if not records:
+                result.append((config_name, None, None))
+            for path, record in records.items():
+                result.append((config_name, path, record))
+        return result
+
+    def test_one_character_reads(self):
+        # 每次只读一个字符，所有的值（包括非 ASCII 的键和数字）都会跨越缓冲区边界
+        for indent in (None, 2):
+            text = json.dumps(RECORDS, ensure_ascii=False, indent=indent)
+            with mock.patch.object(migrate_sync_records, 'READ_SIZE', 1):
+                self.assertEqual(self.parse(text), self.expected())
+
+    def test_escaped_non_ascii(self):
+        text = json.dumps(RECORDS, ensure_ascii=True)
+        with mock.patch.object(migrate_sync_records, 'READ_SIZE', 1):
+            self.assertEqual(self.parse(text), self.expected())
+
+    def test_empty(self):
+        self.assertEqual(self.parse(''), [])
+        self.assertEqual(self.parse(' {} '), [])
+
+    def test_malformed(self):
+        with self.assertRaises(ValueError):
+            self.parse('{"cfg": ["/src/a.txt"]}')
+
+class MigrateToSqliteTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='migrate-test-')
+        self.json_path = os.path.join(self.dir, '_last_sync.json')
+        self.db = os.path.join(self.dir, '_sync_state.db')
+        self.file = os.path.join(self.dir, '中文.txt')
+        with open(self.file, 'w', encoding='utf-8') as f:
+            f.write('内容')
+        records = {
+            '配置一': {self.file: '2024-01-01 10:00:00', '/src/不存在.txt': '2024-01-01 11:00:00'},
+            'cfg': {'/src/b.txt': {'timestamp': '2024-01-02 10:00:00', 'md5': 'old'}},
+        }
+        with open(self.json_path, 'w', encoding='utf-8') as f:
+            json.dump(records, f, ensure_ascii=False)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def migrate(self):
+        with contextlib.redirect_stdout(io.StringIO()), \
+                mock.patch.object(migrate_sync_records, 'READ_SIZE', 1):
+            return migrate(self.json_path, sqlite_path=self.db, workers=1, chunk_size=1)
+
+    def records(self, config_name):
+        store = SqliteSyncState(self.db, config_name)
+        try:
+            return dict(store.items()), store.is_imported()
+        finally:
+            store.close()
+
+    def test_streamed_import(self):
+        self.assertTrue(self.migrate())
+
+        records, imported = self.records('配置一')
+        self.assertTrue(imported)
+        self.assertEqual(records[self.file]['md5'], hashlib.md5('内容'.encode('utf-8')).hexdigest())
+        self.assertEqual(records['/src/不存在.txt']['md5'], '')
+        records, imported = self.records('cfg')
+        self.assertTrue(imported)
+        self.assertEqual(records, {'/src/b.txt': {'timestamp': '2024-01-02 10:00:00', 'md5': 'old'}})
+
+    def test_rerun_keeps_newer_records(self):
+        self.assertTrue(self.migrate())
+        store = SqliteSyncState(self.db, 'cfg')
+        store.upsert('/src/b.txt', {'timestamp': '2024-02-01 10:00:00', 'hash': 'new', 'hash_algo': 'md5'})
+        store.close()
+
+        self.assertTrue(self.migrate())
+
+        records, _ = self.records('cfg')
+        self.assertEqual(records['/src/b.txt']['hash'], 'new')
+
+    def test_existing_records_are_not_overwritten(self):
+        # 同步程序已经在使用数据库（尚未导入 JSON 记录）
+        store = SqliteSyncState(self.db, 'cfg')
+        store.upsert('/src/b.txt', {'timestamp': '2024-02-01 10:00:00', 'hash': 'new', 'hash_algo': 'md5'})
+        store.close()
+
+        self.assertTrue(self.migrate())
+
+        records, _ = self.records('cfg')
+        self.assertEqual(records, {'/src/b.txt': {'timestamp': '2024-02-01 10:00:00', 'hash': 'new',
+                                                  'hash_algo': 'md5'}})
+        # 其他配置照常导入
+        records, imported = self.records('配置一')
+        self.assertTrue(imported)
+        self.assertEqual(len(records), 2)
+
+if __name__ == '__main__':
+    unittest.main()
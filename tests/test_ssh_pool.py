@@ -0,0 +1,79 @@
+"""连接池测试：共享会话在使用期间不会被空闲清理关闭
+
+用法:
+    python -m pytest tests
+"""
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from support import LocalShellPool
+from ssh_pool import LocalShellSession
+
+TARGET = {'server': 'user@localhost', 'port': 0, 'password': None}
+
+class ClosableSession(LocalShellSession):
+    """记录是否已被关闭的共享会话"""
+
+    def __init__(self, target=None):
+        super().__init__(target)
+        self.closed = False
+
+    def is_alive(self):
+        return not self.closed
+
+    def close(self):
+        self.closed = True
+
+class ClosablePool(LocalShellPool):
+    def _create_session(self, target):
+        return ClosableSession(target)
+
+class SharedSessionTest(unittest.TestCase):
+    def setUp(self):
+        # 不启动清理线程，由测试直接调用 close_idle
+        self.pool = ClosablePool(idle_timeout=0.05)
+        self.pool._start_reaper = lambda: None
+
+    def tearDown(self):
+        self.pool.close_all()
+
+    def test_session_in_use_survives_close_idle(self):
+        session, is_new = self.pool.acquire(TARGET)
+        self.assertTrue(is_new)
+        # 传输时间超过 idle_timeout
+        time.sleep(0.1)
+        self.pool.close_idle()
+        self.assertTrue(session.is_alive())
+
+        # 另一个调用复用同一个会话，先归还的调用不会让会话变为可清理
+        other, is_new = self.pool.acquire(TARGET)
+        self.assertIs(other, session)
+        self.assertFalse(is_new)
+        self.pool.release(other)
+        time.sleep(0.1)
+        self.pool.close_idle()
+        self.assertTrue(session.is_alive())
+
+        self.pool.release(session)
+        time.sleep(0.1)
+        self.pool.close_idle()
+        self.assertFalse(session.is_alive())
+
+    def test_reacquired_idle_session_is_refreshed(self):
+        session, _ = self.pool.acquire(TARGET)
+        self.pool.release(session)
+        time.sleep(0.1)
+        # 空闲超时后、清理之前重新取出的会话正在使用，不会被关闭
+        again, is_new = self.pool.acquire(TARGET)
+        self.assertIs(again, session)
+        self.assertFalse(is_new)
+        self.pool.close_idle()
+        self.assertTrue(session.is_alive())
+        self.pool.release(again)
+
+if __name__ == '__main__':
+    unittest.main()
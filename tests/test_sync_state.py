@@ -0,0 +1,151 @@
+"""同步记录存储测试：SQLite 存储的读写、目录移动，以及旧 JSON 记录的导入
+
+用法:
+    python -m pytest tests
+"""
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import support  # noqa: F401  把仓库目录加入 sys.path
+from sync_state import JsonSyncState, SqliteSyncState, open_sync_state
+
+class SqliteSyncStateTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='state-test-')
+        self.db = os.path.join(self.dir, '_sync_state.db')
+        self.store = SqliteSyncState(self.db, 'cfg')
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def path(self, relative_path):
+        return os.path.join(self.dir, 'src', relative_path)
+
+    def reopen(self, config_name='cfg'):
+        return SqliteSyncState(self.db, config_name)
+
+    def test_batch_round_trip(self):
+        with self.store.batch():
+            for name in ('a.txt', 'b.txt', 'c.txt'):
+                self.store.upsert(self.path(name), {'hash': name, 'size': 1})
+            # 批次内的写入在同一连接上立即可见
+            self.assertEqual(self.store.get(self.path('a.txt')), {'hash': 'a.txt', 'size': 1})
+            self.store.upsert(self.path('a.txt'), {'hash': 'changed'})
+            self.store.delete(self.path('b.txt'))
+            self.store.delete_many([self.path('c.txt'), self.path('missing.txt')])
+
+        other = self.reopen()
+        try:
+            self.assertEqual(other.items(), [(self.path('a.txt'), {'hash': 'changed'})])
+            self.assertIsNone(other.get(self.path('b.txt')))
+        finally:
+            other.close()
+        # 其他配置的记录互不影响
+        second = self.reopen('other')
+        try:
+            self.assertEqual(second.items(), [])
+        finally:
+            second.close()
+
+    def test_rename_directory(self):
+        with self.store.batch():
+            for name in ('a/x.txt', 'a/b/y.txt', 'ab/z.txt', 'c/old.txt'):
+                self.store.upsert(self.path(name), {'hash': name})
+
+        moved = self.store.rename(self.path('a'), self.path('c'), is_directory=True)
+
+        self.assertEqual(moved, 2)
+        self.assertEqual(dict(self.store.items()), {
+            self.path('c/x.txt'): {'hash': 'a/x.txt'},
+            self.path('c/b/y.txt'): {'hash': 'a/b/y.txt'},
+            # 名称以 a 开头的同级目录不受影响
+            self.path('ab/z.txt'): {'hash': 'ab/z.txt'},
+        })
+        self.assertEqual(sorted(self.store.paths_under(self.path('c'))),
+                         sorted([self.path('c/x.txt'), self.path('c/b/y.txt')]))
+
+    def test_rename_file_replaces_existing_record(self):
+        self.store.upsert(self.path('old.txt'), {'hash': 'old'})
+        self.store.upsert(self.path('new.txt'), {'hash': 'overwritten'})
+
+        self.assertEqual(self.store.rename(self.path('old.txt'), self.path('new.txt')), 1)
+        self.assertEqual(self.store.items(), [(self.path('new.txt'), {'hash': 'old'})])
+
+    def test_paths_under_matches_json_store(self):
+        json_store = JsonSyncState(os.path.join(self.dir, '_last_sync.json'), 'cfg')
+        names = ('d/x.txt', 'd/e/y.txt', 'd0.txt', 'de/z.txt', 'x.txt')
+        for store in (self.store, json_store):
+            with store.batch():
+                for name in names:
+                    store.upsert(self.path(name), {'hash': name})
+        expected = sorted([self.path('d/x.txt'), self.path('d/e/y.txt')])
+        self.assertEqual(sorted(self.store.paths_under(self.path('d'))), expected)
+        self.assertEqual(sorted(json_store.paths_under(self.path('d'))), expected)
+
+class ImportJsonRecordsTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='state-test-')
+        self.json_path = os.path.join(self.dir, '_last_sync.json')
+        self.config = {'last_sync_file': self.json_path,
+                       'sync_state_file': os.path.join(self.dir, '_sync_state.db')}
+        with open(self.json_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'cfg': {
+                    '/src/旧格式.txt': '2024-01-01 12:00:00',
+                    '/src/new.txt': {'timestamp': '2024-01-02 12:00:00', 'md5': 'abc', 'size': 3},
+                },
+                'other': {'/other/a.txt': '2024-01-03 12:00:00'},
+            }, f, ensure_ascii=False)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def open(self, config_name='cfg'):
+        with mock.patch('builtins.print'):
+            return open_sync_state(self.config, config_name)
+
+    def test_imports_string_and_dict_records(self):
+        store = self.open()
+        try:
+            self.assertEqual(dict(store.items()), {
+                '/src/旧格式.txt': {'timestamp': '2024-01-01 12:00:00'},
+                '/src/new.txt': {'timestamp': '2024-01-02 12:00:00', 'md5': 'abc', 'size': 3},
+            })
+            self.assertTrue(store.is_imported())
+        finally:
+            store.close()
+
+    def test_import_runs_once_per_config(self):
+        store = self.open()
+        try:
+            store.delete('/src/new.txt')
+            store.upsert('/src/旧格式.txt', {'hash': 'newer'})
+        finally:
+            store.close()
+
+        # 再次打开时不重新导入，运行期间的修改不会被旧记录覆盖
+        store = self.open()
+        try:
+            self.assertEqual(dict(store.items()), {'/src/旧格式.txt': {'hash': 'newer'}})
+            row = store.conn.execute("SELECT source FROM imports WHERE config = 'cfg'").fetchone()
+            self.assertEqual(row, (os.path.abspath(self.json_path),))
+        finally:
+            store.close()
+
+        # 同一数据库中的其他配置第一次打开时导入自己的记录
+        other = self.open('other')
+        try:
+            self.assertEqual(other.items(), [('/other/a.txt', {'timestamp': '2024-01-03 12:00:00'})])
+        finally:
+            other.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+"""目标传输超时测试：超时从任务开始执行时算起，排在卡住的任务之后的任务被取消
+
+用法:
+    python -m pytest tests
+"""
+import io
+import os
+import sys
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import support  # noqa: F401  把仓库目录加入 sys.path
+from file_handler import FileHandler
+
+class TargetTimeoutTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='timeout-test-')
+        config = {
+            'source_dir': os.path.join(self.dir, 'src'),
+            'targets': [os.path.join(self.dir, 'dst')],
+            'log_file': os.path.join(self.dir, '_sync_log.txt'),
+            'last_sync_file': os.path.join(self.dir, '_last_sync.json'),
+            'sync_state_file': os.path.join(self.dir, '_sync_state.db'),
+            'ignore_patterns': [],
+            'only_sync_files': [],
+            'mode': 3,
+            'target_concurrency': 1,
+            'target_timeout': 0.4,
+        }
+        os.makedirs(config['source_dir'])
+        self.output = io.StringIO()
+        with contextlib.redirect_stdout(self.output):
+            self.handler = FileHandler(config, 'test')
+        self.target = self.handler.targets[0]
+        self.worker = self.handler.target_workers[0]
+
+    def tearDown(self):
+        with contextlib.redirect_stdout(self.output):
+            self.handler.close()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def wait(self, future, name):
+        with contextlib.redirect_stdout(self.output):
+            return self.handler._wait_target(self.target, future, name)
+
+    def test_queued_task_gets_full_timeout(self):
+        # 两个任务合计超过 target_timeout，但每个任务自己的执行时间都在限制内
+        first = self.worker.submit(time.sleep, 0.3)
+        second = self.worker.submit(time.sleep, 0.3)
+        self.assertTrue(self.wait(first, 'first'))
+        self.assertTrue(self.wait(second, 'second'))
+
+    def test_task_behind_stuck_task_is_cancelled(self):
+        release = threading.Event()
+        ran = threading.Event()
+        stuck = self.worker.submit(release.wait)
+        queued = self.worker.submit(ran.set)
+        try:
+            start = time.monotonic()
+            self.assertFalse(self.wait(stuck, 'stuck'))
+            self.assertFalse(self.wait(queued, 'queued'))
+            self.assertLess(time.monotonic() - start, 1.5)
+            self.assertTrue(queued.cancelled())
+            self.assertIn('排队超时', self.output.getvalue())
+        finally:
+            release.set()
+        # 被取消的任务不会再执行
+        time.sleep(0.1)
+        self.assertFalse(ran.is_set())
+
+if __name__ == '__main__':
+    unittest.main()
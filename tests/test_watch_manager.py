@@ -0,0 +1,101 @@
+"""共用文件监控的测试：被排除的目录不添加监控，其中的事件不会分发给处理器
+
+用法:
+    python -m pytest tests
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import support  # noqa: F401  把仓库目录加入 sys.path
+import watch_manager
+from watch_manager import WatchManager
+from path_matcher import PathMatcher
+from metrics import MetricsRegistry
+
+class RecordingHandler:
+    """只记录收到的事件的处理器"""
+
+    def __init__(self, source_dir, ignore_patterns):
+        self.source_dir = source_dir
+        self.matcher = PathMatcher(source_dir, ignore_patterns, [])
+        self.events = []
+
+    def dispatch(self, event):
+        self.events.append(event)
+
+    def paths(self):
+        return {os.path.relpath(event.src_path, self.source_dir) for event in self.events}
+
+class WatchManagerTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='watch-test-')
+        self.source = os.path.join(self.dir, 'src')
+        for relative_dir in ('kept', 'data/deep'):
+            os.makedirs(os.path.join(self.source, relative_dir))
+        self.handler = RecordingHandler(self.source, ['data/*'])
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def watch(self):
+        manager = WatchManager(registry=MetricsRegistry())
+        manager.add(self.handler)
+        return manager
+
+    def write_files(self):
+        for relative_path in ('kept/a.txt', 'b.txt', 'data/c.txt', 'data/deep/d.txt'):
+            with open(os.path.join(self.source, relative_path), 'w') as f:
+                f.write('x')
+
+    def wait_for(self, relative_path, timeout=5):
+        deadline = time.time() + timeout
+        while time.time() < deadline and relative_path not in self.handler.paths():
+            time.sleep(0.05)
+        # 等待可能晚到的其他事件
+        time.sleep(0.3)
+
+    def test_events_in_pruned_directory_are_not_delivered(self):
+        manager = self.watch()
+        if not manager.pruning:
+            manager.stop()
+            manager.join()
+            self.skipTest("当前平台或 watchdog 版本不支持按目录剪枝的监控")
+        try:
+            self.assertEqual(manager.watch_count(), 2)
+            self.write_files()
+            self.wait_for('b.txt')
+        finally:
+            manager.stop()
+            manager.join()
+
+        paths = self.handler.paths()
+        self.assertIn(os.path.join('kept', 'a.txt'), paths)
+        self.assertIn('b.txt', paths)
+        self.assertFalse([path for path in paths if path.startswith('data')])
+
+    @unittest.skipUnless(watch_manager.HAS_INOTIFY, "只有 Linux 上使用剪枝监控")
+    def test_incompatible_watchdog_falls_back(self):
+        # 剪枝监控依赖的内部接口不存在时改用默认观察者，事件照常分发
+        with mock.patch.object(watch_manager, '_pruning_supported', None), \
+                mock.patch.object(watch_manager._PrunedInotifyEmitter, '_watcher',
+                                  property(lambda emitter: emitter._missing_internal)), \
+                mock.patch('builtins.print'):
+            manager = self.watch()
+        try:
+            self.assertFalse(manager.pruning)
+            self.write_files()
+            self.wait_for('b.txt')
+        finally:
+            manager.stop()
+            manager.join()
+        self.assertIn('b.txt', self.handler.paths())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+# 扫描得到的文件：绝对路径、相对路径、大小、纳秒修改时间、os.stat 结果（with_stat=False 时为 None）
+ScanEntry = namedtuple('ScanEntry', ['path', 'relative_path', 'size', 'mtime_ns', 'stat'])
+
+def scan_directory(path, relative_dir, matcher, with_stat):
+    """读取单个目录
+
+    Returns:
+        tuple: (文件列表, 子目录列表 [(绝对路径, 相对路径)])
+    """
+    files = []
+    subdirs = []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                relative_path = os.path.join(relative_dir, entry.name) if relative_dir else entry.name
+                try:
+                    if entry.is_dir():
+                        # 与 os.walk 一致，不进入指向目录的符号链接
+                        if entry.is_symlink():
+                            continue
+                        if matcher is not None and matcher.excludes_dir(relative_path):
+                            continue
+                        subdirs.append((entry.path, relative_path))
+                    elif entry.is_file():
+                        if matcher is not None and matcher.ignores(entry.path, relative_path):
+                            continue
+                        if with_stat:
+                            # Windows 上 stat 结果直接来自目录读取，其他平台每个文件一次 stat
+                            st = entry.stat()
+                            files.append(ScanEntry(entry.path, relative_path, st.st_size, st.st_mtime_ns, st))
+                        else:
+                            files.append(ScanEntry(entry.path, relative_path, None, None, None))
+                except OSError as e:
+                    print(f"读取文件信息失败: {e}, 文件: {entry.path}")
+    except OSError as e:
+        print(f"读取目录失败: {e}, 目录: {path}")
+    return files, subdirs
+
+def scan_tree(root, matcher=None, workers=1, with_stat=True, relative_dir=''):
+    """基于 os.scandir 遍历目录树，返回需要同步的文件及其 stat 信息
+
+    被 matcher 排除的目录整个跳过，被忽略的文件不会返回。
+
+    Args:
+        root: 根目录
+        matcher: PathMatcher，为 None 时不过滤
+        workers: 并行扫描子目录的线程数，1 表示单线程按深度优先顺序扫描
+        with_stat: 是否获取文件的 stat 信息
+        relative_dir: root 相对于源目录的路径（只扫描源目录中的子目录时，用于按相对路径匹配规则）
+
+    Yields:
+        ScanEntry: 扫描到的文件
+    """
+    root = os.path.abspath(root)
+    if workers <= 1:
+        stack = [(root, relative_dir)]
+        while stack:
+            path, relative_dir = stack.pop()
+            files, subdirs = scan_directory(path, relative_dir, matcher, with_stat)
+            yield from files
+            stack.extend(reversed(subdirs))
+        return
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="scan") as executor:
+        pending = {executor.submit(scan_directory, root, relative_dir, matcher, with_stat)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                files, subdirs = future.result()
+                for path, relative_dir in subdirs:
+                    pending.add(executor.submit(scan_directory, path, relative_dir, matcher, with_stat))
+                yield from files
@@ -0,0 +1,268 @@
+import os
+import sys
+import errno
+import queue
+import shutil
+import tempfile
+import threading
+from watchdog.events import (FileSystemEventHandler, DirCreatedEvent, DirDeletedEvent,
+                             FileCreatedEvent, FileDeletedEvent, DirModifiedEvent)
+from watchdog.observers import Observer
+from metrics import REGISTRY
+
+try:
+    from watchdog.observers.api import BaseObserver, ObservedWatch
+    from watchdog.observers.inotify import InotifyEmitter
+    from watchdog.observers.inotify_buffer import InotifyBuffer
+    from watchdog.observers.inotify_c import Inotify, inotify_rm_watch
+    from watchdog.utils import BaseThread
+    from watchdog.utils.delayed_queue import DelayedQueue
+    HAS_INOTIFY = sys.platform.startswith('linux')
+except ImportError:
+    HAS_INOTIFY = False
+
+def _contains(root, path):
+    """path 是否是 root 或 root 下的路径"""
+    return path == root or path.startswith(os.path.join(root, root[:0]))
+
+if HAS_INOTIFY:
+    class _PrunedInotify(Inotify):
+        """只监控未被排除的目录的 inotify 实例
+
+        不使用 watchdog 自带的递归监控（会为每个子目录添加监控），由 add_subtree 在遍历时剪枝，
+        新建或移入的目录由 _PrunedInotifyEmitter 补充监控。
+        """
+
+        def __init__(self, path, excluded, event_mask=None):
+            self._excluded = excluded
+            super().__init__(path, recursive=False, event_mask=event_mask)
+            self.add_subtree(path)
+
+        def add_subtree(self, path):
+            """监控 path 及其下所有未被排除的目录（已监控的目录重复添加不受影响）"""
+            directories = []
+            for root, dirs, _ in os.walk(path):
+                if root == path:
+                    if root != self._path and self._excluded(root):
+                        return
+                    directories.append(root)
+                dirs[:] = [d for d in dirs if not os.path.islink(os.path.join(root, d))
+                           and not self._excluded(os.path.join(root, d))]
+                directories.extend(os.path.join(root, d) for d in dirs)
+            with self._lock:
+                if self._closed:
+                    return
+                for directory in directories:
+                    try:
+                        self._add_watch(directory, self._event_mask)
+                    except OSError as e:
+                        # 目录在遍历之后被删除
+                        if e.errno not in (errno.ENOENT, errno.ENOTDIR):
+                            raise
+
+        def remove_subtree(self, path, only_excluded=False):
+            """移除 path 及其下目录的监控（only_excluded 时只移除被排除的目录）
+
+            记录由内核随后发出的 IN_IGNORED 事件清理。
+            """
+            with self._lock:
+                if self._closed:
+                    return
+                for watched, wd in list(self._wd_for_path.items()):
+                    if _contains(path, watched) and watched != self._path:
+                        if not only_excluded or self._excluded(watched):
+                            inotify_rm_watch(self._inotify_fd, wd)
+
+        def source_for_move(self, destination_event):
+            # 非递归模式下 watchdog 只更新被移动目录本身的路径，这里同时更新其下已监控的目录
+            move_src_path = super().source_for_move(destination_event)
+            if move_src_path is not None and destination_event.is_directory:
+                prefix = move_src_path + os.sep.encode()
+                for path in [p for p in self._wd_for_path if p.startswith(prefix)]:
+                    wd = self._wd_for_path.pop(path)
+                    moved_path = destination_event.src_path + path[len(move_src_path):]
+                    self._wd_for_path[moved_path] = wd
+                    self._path_for_wd[wd] = moved_path
+            return move_src_path
+
+    class _PrunedInotifyBuffer(InotifyBuffer):
+        def __init__(self, path, excluded, event_mask=None):
+            BaseThread.__init__(self)
+            self._queue = DelayedQueue(self.delay)
+            self._inotify = _PrunedInotify(path, excluded, event_mask=event_mask)
+            self.start()
+
+    class _PrunedInotifyEmitter(InotifyEmitter):
+        """在目录新建、移入、移出和删除时增减监控的 inotify 发射器"""
+
+        def __init__(self, event_queue, watch, excluded=None, **kwargs):
+            super().__init__(event_queue, watch, **kwargs)
+            self._excluded = excluded
+
+        def on_thread_start(self):
+            path = os.fsencode(self.watch.path)
+            self._inotify = _PrunedInotifyBuffer(path, lambda p: self._excluded(os.fsdecode(p)),
+                                                 event_mask=self.get_event_mask_from_filter())
+
+        @property
+        def _watcher(self):
+            return self._inotify._inotify if self._inotify is not None else None
+
+        def watch_count(self):
+            watcher = self._watcher
+            return len(watcher._wd_for_path) if watcher is not None else 0
+
+        def rewatch(self, path):
+            """按当前的排除规则重新整理 path 下的监控"""
+            watcher = self._watcher
+            if watcher is not None:
+                watcher.remove_subtree(os.fsencode(path), only_excluded=True)
+                watcher.add_subtree(os.fsencode(path))
+
+        def queue_event(self, event):
+            # 先调整监控再交给处理器：处理器扫描新目录时，之后在其中新建的文件已经会产生事件
+            watcher = self._watcher
+            if watcher is not None and event.is_directory and not isinstance(event, DirModifiedEvent) \
+                    and not event.is_synthetic:
+                if event.event_type == 'created':
+                    watcher.add_subtree(os.fsencode(event.src_path))
+                elif event.event_type == 'deleted':
+                    # 移出监控目录的目录不会收到 IN_IGNORED，需要主动移除
+                    watcher.remove_subtree(os.fsencode(event.src_path))
+                elif event.event_type == 'moved':
+                    self.rewatch(event.dest_path)
+            super().queue_event(event)
+
+_pruning_supported = None
+
+def pruning_supported():
+    """当前平台和 watchdog 版本是否支持按目录剪枝的 inotify 监控
+
+    剪枝监控依赖 watchdog 的内部实现（InotifyBuffer 的构造过程、Inotify 的监控表、InotifyEmitter._inotify），
+    升级 watchdog 后可能不再适用。第一次调用时在临时目录上实际构造一次来检查，不满足时返回 False，
+    由调用方改用 watchdog 默认的观察者。
+    """
+    global _pruning_supported
+    if _pruning_supported is None:
+        _pruning_supported = HAS_INOTIFY and _probe_pruning()
+    return _pruning_supported
+
+def _probe_pruning():
+    probe_dir = tempfile.mkdtemp(prefix='fsync-watch-')
+    emitter = None
+    try:
+        for name in ('kept', 'pruned'):
+            os.mkdir(os.path.join(probe_dir, name))
+        emitter = _PrunedInotifyEmitter(queue.Queue(), ObservedWatch(probe_dir, recursive=True),
+                                        excluded=lambda path: os.path.basename(path) == 'pruned')
+        emitter.on_thread_start()
+        watcher = emitter._watcher
+        expected = {os.fsencode(probe_dir), os.fsencode(os.path.join(probe_dir, 'kept'))}
+        return (set(watcher._wd_for_path) == expected
+                and all(watcher._path_for_wd.get(wd) == path for path, wd in watcher._wd_for_path.items()))
+    except Exception as e:
+        print(f"当前 watchdog 版本不支持按目录剪枝的监控，改用默认监控: {e}")
+        return False
+    finally:
+        buffer = getattr(emitter, '_inotify', None)
+        if buffer is not None:
+            buffer.close()
+        shutil.rmtree(probe_dir, ignore_errors=True)
+
+class WatchManager(FileSystemEventHandler):
+    """所有配置共用的文件监控
+
+    所有 FileHandler 共用一个观察者，每个互不包含的源目录只监控一次，事件按路径分发给源目录
+    包含该路径的处理器（源目录重叠时分发给多个处理器）。在 Linux 上只为未被排除的目录添加
+    inotify 监控（目录对所有包含它的配置都被排除时才跳过），并随目录的新建、移动和删除增减；
+    其他平台（或 watchdog 版本不兼容时，见 pruning_supported）使用 watchdog 默认的递归监控。
+    """
+
+    def __init__(self, registry=REGISTRY):
+        super().__init__()
+        self._lock = threading.Lock()
+        self._handlers = ()
+        self._watches = {}
+        self.pruning = pruning_supported()
+        if self.pruning:
+            self.observer = BaseObserver(
+                emitter_class=lambda *args, **kwargs: _PrunedInotifyEmitter(*args, excluded=self.excluded, **kwargs))
+        else:
+            self.observer = Observer()
+        self._started = False
+        registry.register_callback('watched_directories', 'gauge', self.watch_count,
+                                   help_text='监控的目录数')
+
+    def excluded(self, path):
+        """目录是否对所有源目录包含它的处理器都被排除"""
+        for handler in self._handlers:
+            if _contains(handler.source_dir, path) and not handler.matcher.excludes_dir(handler.matcher.relative(path)):
+                return False
+        return True
+
+    def add(self, handler):
+        """开始把事件分发给处理器，需要时监控其源目录
+
+        Args:
+            handler: 已调用 start() 的 FileHandler
+        """
+        with self._lock:
+            self._handlers = self._handlers + (handler,)
+            source_dir = handler.source_dir
+            covering = next((root for root in self._watches if _contains(root, source_dir)), None)
+            if covering is not None:
+                # 已被其他配置的监控覆盖，按新的排除规则补充监控
+                for emitter in list(self.observer.emitters):
+                    if emitter.watch.path == covering and hasattr(emitter, 'rewatch'):
+                        emitter.rewatch(source_dir)
+                return
+            self._watches[source_dir] = self.observer.schedule(self, source_dir, recursive=True)
+            # 新的源目录包含的已有监控不再需要
+            for root in [root for root in self._watches if root != source_dir and _contains(source_dir, root)]:
+                self.observer.unschedule(self._watches.pop(root))
+            if not self._started:
+                self.observer.start()
+                self._started = True
+
+    def watch_count(self):
+        """当前监控的目录数（非 Linux 平台为 0）"""
+        return sum(emitter.watch_count() for emitter in list(self.observer.emitters)
+                   if hasattr(emitter, 'watch_count'))
+
+    def dispatch(self, event):
+        """把事件分发给源目录包含其路径的处理器
+
+        移动的一端不在处理器的源目录中时，对该处理器改为新建（移入）或删除（移出）。
+        """
+        for handler in self._handlers:
+            routed = self._route(handler.source_dir, event)
+            if routed is not None:
+                try:
+                    handler.dispatch(routed)
+                except Exception as e:
+                    print(f"处理文件事件失败: {e}")
+
+    @staticmethod
+    def _route(source_dir, event):
+        src_inside = _contains(source_dir, event.src_path)
+        if event.event_type != 'moved':
+            return event if src_inside else None
+        dest_inside = _contains(source_dir, event.dest_path)
+        if src_inside and dest_inside:
+            return event
+        if src_inside:
+            cls = DirDeletedEvent if event.is_directory else FileDeletedEvent
+            return cls(event.src_path, is_synthetic=event.is_synthetic)
+        if dest_inside:
+            cls = DirCreatedEvent if event.is_directory else FileCreatedEvent
+            return cls(event.dest_path, is_synthetic=event.is_synthetic)
+        return None
+
+    def stop(self):
+        """停止监控（之后调用 join 等待结束）"""
+        if self._started:
+            self.observer.stop()
+
+    def join(self):
+        if self._started:
+            self.observer.join()